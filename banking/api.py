@@ -1,43 +1,285 @@
 # coding=utf-8
 # flake8: noqa E402
 
+import base64
+import binascii
+import json
 import logging
 import os
 import typing
+from functools import wraps
+from hashlib import sha256
 from uuid import UUID
 from dotenv import load_dotenv
 
-from flask import Flask, request
+from flask import Flask, Response, g, request
 from flask_jwt_extended import (
     JWTManager,
     create_access_token,
-    jwt_required,
+    get_jwt,
     get_jwt_identity,
+    verify_jwt_in_request,
 )
+from flask_jwt_extended.config import config
 from flask_restful import Resource, Api
+from eventsourcing.system import SingleThreadedRunner, System
+from eventsourcing.utils import strtobool
 
 from banking.applicationmodel import Bank
+from banking.readmodel import AccountBalances
+from banking.sharding import ShardedBank
+from banking.utils.custom_exceptions import (
+    TransactionError,
+    TransferNotFoundError,
+)
+from banking.utils import metrics
 from banking.utils.error_handler import error_handler
+from banking.utils.tokencache import TokenCache
+
+
+# Largest page of GET /api/v1/account/transactions.
+TRANSACTIONS_MAX_LIMIT = 200
 
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
 
 app = Flask(__name__)
 load_dotenv()
 app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY")
 app.config["JWT_DEFAULT_REALM"] = os.getenv("JWT_DEFAULT_REALM")
+# Let the JWT errors reach the handlers of JWTManager, flask-restful
+# would turn them into 500s otherwise.
+app.config["PROPAGATE_EXCEPTIONS"] = True
 api = Api(app, prefix="/api/v1")
-_bank = Bank()
+
+
+def start_bank(
+    shards: int = 0, async_transfers: bool = False
+) -> typing.Tuple[typing.Any, typing.Any]:
+    """Start the Bank and its balances read model in this process, or
+    partitioned across `shards` worker processes (see ShardedBank)
+
+    Args:
+        shards (int): 0 runs the Bank in this process
+        async_transfers (bool): complete the transfers requested on
+            the Bank (see Bank.request_transfer) on a thread of its own,
+            see Bank.start_transfer_pipeline
+
+    Raises:
+        ValueError
+
+    Returns:
+        Tuple[Bank, AccountBalances]: or their sharded counterparts
+    """
+    if shards:
+        if async_transfers:
+            raise ValueError("Async transfers need the Bank in this process")
+        sharded = ShardedBank(shards)
+        return sharded, sharded.balances
+    runner = SingleThreadedRunner(System(pipes=[[Bank, AccountBalances]]))
+    runner.start()
+    bank = runner.get(Bank)
+    balances = runner.get(AccountBalances)
+    # Project the events stored before this process started.
+    balances.pull_and_process(bank.name)
+    if async_transfers:
+        bank.start_transfer_pipeline()
+    return bank, balances
+
+
+_async_transfers = strtobool(os.getenv("ASYNC_TRANSFERS", "n"))
+_bank, _balances = start_bank(
+    int(os.getenv("BANK_SHARDS", "0")), _async_transfers
+)
 jwt = JWTManager(app)
+_token_cache = TokenCache(
+    maxsize=int(os.getenv("JWT_CACHE_MAXSIZE", "10000")),
+    max_ttl=float(os.getenv("JWT_CACHE_MAX_TTL", "300")),
+)
+_metrics_enabled = strtobool(os.getenv("METRICS_ENABLED", "y"))
 
 
 def bank() -> Bank:
-    """Return a Bank App instance"""
+    """Return a Bank App instance, or the ShardedBank of BANK_SHARDS"""
     return _bank
 
 
+def balances() -> AccountBalances:
+    """Return the balances read model of the Bank"""
+    return _balances
+
+
+def async_transfers() -> bool:
+    """Whether transfers only wait for the debit, see ASYNC_TRANSFERS"""
+    return _async_transfers
+
+
+def token_cache() -> TokenCache:
+    """Return the cache of verified tokens"""
+    return _token_cache
+
+
+@jwt.token_in_blocklist_loader
+def token_revoked(jwt_header, jwt_data) -> bool:
+    """Reject the tokens revoked through the token cache"""
+    return token_cache().is_revoked(jwt_data)
+
+
+@app.before_request
+def start_request_timer() -> None:
+    """Time the phases of the request, unless METRICS_ENABLED is off"""
+    if _metrics_enabled:
+        rule = request.url_rule
+        metrics.start_request(rule.rule if rule else "unmatched")
+
+
+@app.after_request
+def record_request_timer(response: Response) -> Response:
+    """Record the timings of the request in the histograms"""
+    metrics.finish_request(response.status_code)
+    return response
+
+
+@app.route("/metrics")
+def metrics_endpoint() -> Response:
+    """GET /metrics, the histograms in the Prometheus text format"""
+    return Response(
+        metrics.REGISTRY.render(),
+        mimetype="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+def encode_cursor(version: int) -> str:
+    """Opaque cursor of a page of the transactions of an account"""
+    return base64.urlsafe_b64encode(f"v{version}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    """Version of the account a cursor continues below
+
+    Raises:
+        TransactionError
+    """
+    try:
+        decoded = base64.urlsafe_b64decode(cursor.encode()).decode()
+        if decoded[:1] == "v" and decoded[1:].isdigit():
+            return int(decoded[1:])
+    except (binascii.Error, UnicodeDecodeError):
+        pass
+    raise TransactionError("Invalid cursor")
+
+
+def cached_jwt_required(func):
+    """Decorator used like jwt_required(), that verifies a bearer
+    token once and then serves its claims from the token cache
+    until the token expires or is revoked
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with metrics.phase("jwt"):
+            token = request.headers.get(config.header_name, "").strip()
+            cached = token_cache().get(token) if token else None
+            if cached is None:
+                # Raises without a valid token, OPTIONS never gets here.
+                verified = verify_jwt_in_request()
+                assert verified is not None
+                token_cache().put(token, *verified)
+            else:
+                # The same request context verify_jwt_in_request sets up.
+                g._jwt_extended_jwt_header, g._jwt_extended_jwt = cached
+                g._jwt_extended_jwt_user = None
+                g._jwt_extended_jwt_location = "headers"
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def unit_of_work(func):
+    """Decorator used to run a request in a single Bank unit of work,
+    so each account is loaded once and saved once per request, and
+    the whole request is retried when it loses a version conflict
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return bank().run_unit_of_work(func, *args, **kwargs)
+
+    return wrapper
+
+
+def call_idempotent(
+    func: typing.Callable[[], typing.Any],
+    account_id: UUID,
+    key: typing.Optional[str],
+    method: str,
+    path: str,
+    data: typing.Any,
+) -> typing.Any:
+    """Call func for a request of an account, unless a response was
+    saved for its Idempotency-Key, then save the response with the
+    changes of the unit of work the call runs in
+
+    Args:
+        func (Callable[[], Any]): the request handler
+        account_id (UUID)
+        key (str, optional): Idempotency-Key of the request
+        method (str)
+        path (str)
+        data (Any): JSON body of the request
+
+    Raises:
+        TransactionError: invalid key
+        IdempotencyKeyReusedError
+
+    Returns:
+        Any: result of func, or the saved body and status with an
+            Idempotent-Replayed header
+    """
+    if key is None:
+        return func()
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise TransactionError(f"Invalid {IDEMPOTENCY_KEY_HEADER}")
+    body = json.dumps(data, sort_keys=True)
+    fingerprint = sha256(f"{method} {path} {body}".encode()).hexdigest()
+    saved = bank().get_idempotent_response(account_id, key, fingerprint)
+    if saved is not None:
+        return saved[0], saved[1], {"Idempotent-Replayed": "true"}
+    result = func()
+    data, status = result if isinstance(result, tuple) else (result, 200)
+    bank().save_idempotent_response(
+        account_id, key, fingerprint, data, status
+    )
+    return result
+
+
+def idempotent(func):
+    """Decorator used to answer the retries of a request made with an
+    Idempotency-Key header with the response of the first one, saved
+    in the unit of work of the request, so its changes are applied
+    once. Only successful responses are saved, a failed request runs
+    again when retried.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return call_idempotent(
+            lambda: func(*args, **kwargs),
+            UUID(get_jwt_identity()),
+            request.headers.get(IDEMPOTENCY_KEY_HEADER),
+            request.method,
+            request.path,
+            request.get_json(silent=True),
+        )
+
+    return wrapper
+
+
 class SignupResource(Resource):
     """Endpoint used to make the signup"""
 
     @error_handler
+    @unit_of_work
     def post(self) -> typing.Tuple[typing.Dict[str, str], int]:
         """POST /api/v1/signup"""
         data = request.get_json()
@@ -51,6 +293,7 @@ class LoginResource(Resource):
     """Endpoint used to make the login"""
 
     @error_handler
+    @unit_of_work
     def post(self) -> typing.Tuple[typing.Dict[str, str], int]:
         """POST /api/v1/login"""
         data = request.get_json()
@@ -64,23 +307,90 @@ class LoginResource(Resource):
 class AccountResource(Resource):
     """Endpoint used to make the account information"""
 
-    @jwt_required()
+    @cached_jwt_required
     @error_handler
     def get(self) -> typing.Dict[str, typing.Any]:
         """GET /api/v1/account"""
         logging.info("account get")
-        account = bank().get_account(UUID(get_jwt_identity()))
+        summary = balances().get_summary(UUID(get_jwt_identity()))
         return {
-            "balance": str(account.balance),
+            "balance": str(summary.balance),
             "identity": get_jwt_identity(),
         }
 
 
+class AccountTransactionsResource(Resource):
+    """Endpoint used to page through the transactions of the account"""
+
+    @cached_jwt_required
+    @error_handler
+    def get(self) -> typing.Dict[str, typing.Any]:
+        """GET /api/v1/account/transactions?limit=50&cursor=...
+
+        Newest first, next_cursor is null on the last page.
+        """
+        limit = request.args.get("limit", "50")
+        if not limit.isdigit() or not 0 < int(limit) <= TRANSACTIONS_MAX_LIMIT:
+            raise TransactionError(
+                f"limit must be between 1 and {TRANSACTIONS_MAX_LIMIT}"
+            )
+        cursor = request.args.get("cursor")
+        page, next_version = bank().get_transactions(
+            UUID(get_jwt_identity()),
+            before=decode_cursor(cursor) if cursor else None,
+            limit=int(limit),
+        )
+        return {
+            "transactions": [
+                {
+                    "type": record.kind,
+                    "amount": record.amount,
+                    "timestamp": record.timestamp,
+                    "transfer_id": (
+                        str(record.transfer_id) if record.transfer_id else None
+                    ),
+                }
+                for record in page
+            ],
+            "next_cursor": (
+                encode_cursor(next_version)
+                if next_version is not None
+                else None
+            ),
+        }
+
+
+class LogoutResource(Resource):
+    """Endpoint used to revoke the token of the request"""
+
+    @cached_jwt_required
+    @error_handler
+    def post(self) -> typing.Dict[str, typing.Any]:
+        """POST /api/v1/logout"""
+        token_cache().revoke(get_jwt())
+        return {"result": "success"}
+
+
+class BalancesProjectionResource(Resource):
+    """Endpoint used to monitor the balances read model"""
+
+    @cached_jwt_required
+    @error_handler
+    def get(self) -> typing.Dict[str, typing.Any]:
+        """GET /api/v1/projections/balances"""
+        return {
+            "position": balances().position(bank()),
+            "lag": balances().lag(bank()),
+        }
+
+
 class DepositResource(Resource):
     """Endpoint used to make the deposits to the account"""
 
-    @jwt_required()
+    @cached_jwt_required
     @error_handler
+    @unit_of_work
+    @idempotent
     def post(self) -> typing.Dict[str, typing.Any]:
         """POST /api/v1/deposit"""
         data = request.get_json()
@@ -92,22 +402,87 @@ class DepositResource(Resource):
 class TransferResource(Resource):
     """Endpoint used to make the transfers to other accounts"""
 
-    @jwt_required()
+    @cached_jwt_required
     @error_handler
-    def post(self) -> typing.Dict[str, typing.Any]:
-        """POST /api/v1/transfer"""
+    @unit_of_work
+    @idempotent
+    def post(self) -> typing.Any:
+        """POST /api/v1/transfer
+
+        With ASYNC_TRANSFERS it answers 202 with the id of the
+        transfer once the source is debited, see TransferStatusResource.
+        """
         data = request.get_json()
         amount = data["amount"]
         destination_id = UUID(data["destination_id"])
+        if async_transfers():
+            transfer_id = bank().request_transfer(
+                UUID(get_jwt_identity()), destination_id, amount
+            )
+            return {"transfer_id": str(transfer_id), "status": "pending"}, 202
         bank().transfer_funds(UUID(get_jwt_identity()), destination_id, amount)
         return {"result": "success"}
 
 
+class TransferStatusResource(Resource):
+    """Endpoint used to follow a transfer requested from the account"""
+
+    @cached_jwt_required
+    @error_handler
+    def get(self, transfer_id: UUID) -> typing.Dict[str, typing.Any]:
+        """GET /api/v1/transfers/<transfer_id>
+
+        The status is "pending", "completed" or "failed".
+        """
+        transfer = bank().get_transfer(transfer_id)
+        if str(transfer.source_id) != get_jwt_identity():
+            raise TransferNotFoundError(transfer_id)
+        return {
+            "transfer_id": str(transfer.id),
+            "destination_id": str(transfer.destination_id),
+            "amount": transfer.amount_in_cents,
+            "status": transfer.status,
+            "error": transfer.error,
+        }
+
+
+class TransferBatchResource(Resource):
+    """Endpoint used to make many transfers from the account at once"""
+
+    @cached_jwt_required
+    @error_handler
+    @unit_of_work
+    def post(self) -> typing.Tuple[typing.Dict[str, typing.Any], int]:
+        """POST /api/v1/transfers/batch
+
+        The mode is "atomic" (default), where nothing is saved
+        unless every transfer succeeds, or "best_effort".
+        """
+        data = request.get_json()
+        source_id = UUID(get_jwt_identity())
+        transfers = [
+            (source_id, UUID(item["destination_id"]), item["amount"])
+            for item in data["transfers"]
+        ]
+        mode = data.get("mode", "atomic")
+        if mode not in ("atomic", "best_effort"):
+            raise TransactionError(f"Unknown batch mode: {mode}")
+        atomic = mode == "atomic"
+        results = bank().transfer_funds_batch(transfers, atomic=atomic)
+        committed = not atomic or all(r.status == "success" for r in results)
+        return {
+            "committed": committed,
+            "results": [result._asdict() for result in results],
+        }, (200 if committed else 400)
+
+
 class WithdrawResource(Resource):
     """Endpoint used to make the withdraws"""
 
-    @jwt_required()
+    @cached_jwt_required
     @error_handler
+    @unit_of_work
+    @idempotent
     def post(self) -> typing.Dict[str, typing.Any]:
         """POST /api/v1/withdraw"""
         data = request.get_json()
@@ -117,8 +492,13 @@ class WithdrawResource(Resource):
 
 
 api.add_resource(AccountResource, "/account")
+api.add_resource(AccountTransactionsResource, "/account/transactions")
 api.add_resource(SignupResource, "/signup")
 api.add_resource(LoginResource, "/login")
+api.add_resource(LogoutResource, "/logout")
 api.add_resource(DepositResource, "/deposit")
 api.add_resource(TransferResource, "/transfer")
+api.add_resource(TransferBatchResource, "/transfers/batch")
+api.add_resource(TransferStatusResource, "/transfers/<uuid:transfer_id>")
 api.add_resource(WithdrawResource, "/withdraw")
+api.add_resource(BalancesProjectionResource, "/projections/balances")
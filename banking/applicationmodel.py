@@ -1,19 +1,195 @@
 # coding=utf-8
 
-from uuid import NAMESPACE_URL, UUID, uuid5
-from hashlib import sha512
+import logging
+import random
+import threading
+import time
+import typing
+from contextlib import contextmanager
+from copy import deepcopy
+from functools import wraps
+from uuid import UUID, uuid4
 
-from eventsourcing.application import AggregateNotFound, Application
+from eventsourcing.application import (
+    AggregateNotFound,
+    Application,
+    LRUCache,
+    NotificationLog,
+    ProcessingEvent,
+    Repository,
+)
+from eventsourcing.domain import Aggregate, DomainEventProtocol
+from eventsourcing.persistence import (
+    Mapper,
+    Recording,
+    RecordConflictError,
+    Tracking,
+    Transcoder,
+)
+from eventsourcing.system import (
+    Follower,
+    MultiThreadedRunnerThread,
+    ProcessApplication,
+)
+from eventsourcing.utils import Environment, EnvType, get_topic
 
-from banking.domainmodel import Account
+from banking.domainmodel import (
+    Account,
+    AccountShard,
+    IdempotentResponse,
+    Transfer,
+    idempotency_id_for,
+    shard_id_for,
+)
+from banking.emailindex import EmailIndex, account_id_for
+from banking.replaystats import (
+    AggregateReplays,
+    ReplayCountingMapper,
+    ReplayStats,
+)
+from banking.transcoder import CompactTranscoder, TolerantZlibCompressor
+from banking.unitofwork import UnitOfWork
+from banking.utils import metrics
+from banking.utils.cache import CountingLRUCache
+from banking.utils.concurrency import StripedLock, backoff_delay
+from banking.utils.idempotency import IdempotencyCache
+from banking.utils.passwords import CredentialPool
 from banking.utils.custom_exceptions import (
+    AccountAlreadyExistsError,
+    AccountBusyError,
+    AccountClosedError,
     BadCredentials,
+    IdempotencyKeyReusedError,
+    InsufficientFundsError,
     TransactionError,
+    TransferNotFoundError,
+    TransferPipelineError,
     AccountNotFoundError,
 )
 
 
-class Bank(Application):
+class TransferResult(typing.NamedTuple):
+    """Outcome of one transfer of a batch
+
+    status is "success", "failed", or "aborted" when the
+    transfer was valid but its all-or-nothing batch failed.
+    """
+
+    status: str
+    error: typing.Optional[str] = None
+
+
+class TransactionRecord(typing.NamedTuple):
+    """Credit or debit of the history of an account
+
+    version is the position of its event in the account,
+    pages of history continue below it.
+    """
+
+    version: int
+    kind: str
+    amount: int
+    timestamp: str
+    transfer_id: typing.Optional[UUID] = None
+
+
+# Events of the history of an account, by the kind of transaction.
+TRANSACTION_KINDS: typing.Dict[type, str] = {
+    Account.Credited: "credit",
+    Account.Debited: "debit",
+    Account.TransferRequested: "debit",
+    Account.TransferRefunded: "credit",
+}
+
+T = typing.TypeVar("T")
+
+
+def transactional(func: typing.Callable[..., T]) -> typing.Callable[..., T]:
+    """Decorator used to run a Bank method in a unit of work
+    that is retried when it loses a version conflict
+    """
+
+    @wraps(func)
+    def wrapper(self: "Bank", *args: typing.Any, **kwargs: typing.Any) -> T:
+        return self.run_unit_of_work(func, self, *args, **kwargs)
+
+    return wrapper
+
+
+class TransferPipeline(MultiThreadedRunnerThread):
+    """
+    This is the thread on which the Bank follows its
+    own log, to complete the transfers requested on
+    its accounts (see Bank.policy).
+
+    An event that fails to process is not tracked,
+    so the thread keeps running and pulls again from
+    that event after a jittered backoff, from
+    retry_backoff up to max_retry_backoff seconds.
+    The pipeline is unhealthy from the failure until
+    a pull succeeds.
+    """
+
+    def __init__(
+        self,
+        follower: Follower,
+        retry_backoff: float = 0.1,
+        max_retry_backoff: float = 5.0,
+    ) -> None:
+        super().__init__(follower, has_errored=threading.Event())
+        self.name = "transfer-pipeline"
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self.failures = 0
+
+    @property
+    def healthy(self) -> bool:
+        """Whether the thread runs and its last pull succeeded"""
+        return self.is_alive() and not self.has_errored.is_set()
+
+    def prompt(self, leader_name: str) -> None:
+        """Pull the new notifications of a leader
+
+        Args:
+            leader_name (str)
+        """
+        with self.prompted_names_lock:
+            self.prompted_names.append(leader_name)
+            self.is_prompted.set()
+
+    def run(self) -> None:
+        """Pull and process the prompted logs until stopped, pulling
+        again after a backoff when processing fails"""
+        self.has_started.set()
+        while not self.is_stopping.is_set():
+            self.is_prompted.wait()
+            with self.prompted_names_lock:
+                prompted_names = self.prompted_names
+                self.prompted_names = []
+                self.is_prompted.clear()
+            for name in prompted_names:
+                try:
+                    self.follower.pull_and_process(name)
+                except Exception as error:
+                    logging.exception("Transfer pipeline failed")
+                    self.error = error
+                    self.failures += 1
+                    self.has_errored.set()
+                    self.is_stopping.wait(
+                        backoff_delay(
+                            self.failures,
+                            self.retry_backoff,
+                            self.max_retry_backoff,
+                        )
+                    )
+                    self.prompt(name)
+                else:
+                    self.failures = 0
+                    self.error = None
+                    self.has_errored.clear()
+
+
+class Bank(ProcessApplication):
     """
     This is the model of the application, it has
     all of its events in the from of aggregate
@@ -25,13 +201,592 @@ class Bank(Application):
       new_account = Account(...)
 
     To load existing aggregates run:
-      account1 = self.repository.get(account_id1)
-      account2 = self.repository.get(account_id2)
+      account1 = self._get_account(account_id1)
+      account2 = self._get_account(account_id2)
 
     To save any aggregates run:
-      self.save(account1, account2, new_account)
+      self._save(account1, account2, new_account)
+
+    Inside a unit of work (see unit_of_work) those
+    use its identity map, so each aggregate is loaded
+    once and everything is saved when it ends. Every
+    write method is transactional, so it runs in one.
+
+    The settings of the Bank are listed in the readme.
     """
 
+    # Only the transfer requests of the log are processed (and
+    # tracked), see policy.
+    follow_topics = [get_topic(Account.TransferRequested)]
+
+    ACCOUNT_SNAPSHOTTING_INTERVAL = "ACCOUNT_SNAPSHOTTING_INTERVAL"
+    TRANSACTIONS_SCAN_SIZE = "TRANSACTIONS_SCAN_SIZE"
+    TRANSFER_BATCH_MAX_SIZE = "TRANSFER_BATCH_MAX_SIZE"
+    EMAIL_INDEX_CAPACITY = "EMAIL_INDEX_CAPACITY"
+    EMAIL_INDEX_PATH = "EMAIL_INDEX_PATH"
+    CONFLICT_RETRY_ATTEMPTS = "CONFLICT_RETRY_ATTEMPTS"
+    CONFLICT_RETRY_BACKOFF = "CONFLICT_RETRY_BACKOFF"
+    CONFLICT_RETRY_MAX_BACKOFF = "CONFLICT_RETRY_MAX_BACKOFF"
+    ACCOUNT_LOCK_STRIPES = "ACCOUNT_LOCK_STRIPES"
+    ACCOUNT_LOCK_TIMEOUT = "ACCOUNT_LOCK_TIMEOUT"
+    EVENT_TRANSCODER = "EVENT_TRANSCODER"
+    EVENT_COMPRESSION = "EVENT_COMPRESSION"
+    PASSWORD_HASH_ITERATIONS = "PASSWORD_HASH_ITERATIONS"
+    CREDENTIAL_POOL_WORKERS = "CREDENTIAL_POOL_WORKERS"
+    CREDENTIAL_POOL_MAX_PENDING = "CREDENTIAL_POOL_MAX_PENDING"
+    CREDENTIAL_POOL_TIMEOUT = "CREDENTIAL_POOL_TIMEOUT"
+    REPLAY_STATS_MAXSIZE = "REPLAY_STATS_MAXSIZE"
+    IDEMPOTENCY_KEY_TTL = "IDEMPOTENCY_KEY_TTL"
+    IDEMPOTENCY_CACHE_MAXSIZE = "IDEMPOTENCY_CACHE_MAXSIZE"
+
+    env: EnvType = {
+        ACCOUNT_SNAPSHOTTING_INTERVAL: "100",
+        Application.AGGREGATE_CACHE_MAXSIZE: "1000",
+        TRANSACTIONS_SCAN_SIZE: "100",
+        TRANSFER_BATCH_MAX_SIZE: "10000",
+        EMAIL_INDEX_CAPACITY: "1000000",
+        CONFLICT_RETRY_ATTEMPTS: "5",
+        CONFLICT_RETRY_BACKOFF: "0.005",
+        CONFLICT_RETRY_MAX_BACKOFF: "0.1",
+        ACCOUNT_LOCK_STRIPES: "0",
+        ACCOUNT_LOCK_TIMEOUT: "1",
+        EVENT_TRANSCODER: "compact",
+        EVENT_COMPRESSION: "none",
+        PASSWORD_HASH_ITERATIONS: "600000",
+        CREDENTIAL_POOL_WORKERS: "2",
+        CREDENTIAL_POOL_MAX_PENDING: "64",
+        CREDENTIAL_POOL_TIMEOUT: "5",
+        REPLAY_STATS_MAXSIZE: "10000",
+        IDEMPOTENCY_KEY_TTL: "86400",
+        IDEMPOTENCY_CACHE_MAXSIZE: "10000",
+    }
+
+    def __init__(self, env: typing.Optional[EnvType] = None) -> None:
+        super().__init__(env)
+        self._local = threading.local()
+        self._unit_of_work_stats_lock = threading.Lock()
+        self._unit_of_work_stats = {"units": 0, "loads": 0, "loads_avoided": 0}
+        self.email_index = EmailIndex(
+            self.recorder,
+            capacity=int(self.env.get(self.EMAIL_INDEX_CAPACITY, "1000000")),
+        )
+        email_index_path = self.env.get(self.EMAIL_INDEX_PATH)
+        if email_index_path:
+            self.email_index.load(email_index_path)
+        self.email_index.catch_up()
+        stripes = int(self.env.get(self.ACCOUNT_LOCK_STRIPES) or 0)
+        self.account_locks = StripedLock(stripes) if stripes else None
+        self._concurrency_stats_lock = threading.Lock()
+        self._concurrency_stats = {
+            "writes": 0,
+            "conflicts": 0,
+            "retries": 0,
+            "failures": 0,
+        }
+        self.credentials = CredentialPool(
+            iterations=int(self.env.get(self.PASSWORD_HASH_ITERATIONS, "1")),
+            workers=int(self.env.get(self.CREDENTIAL_POOL_WORKERS) or 0),
+            max_pending=int(
+                self.env.get(self.CREDENTIAL_POOL_MAX_PENDING, "64")
+            ),
+            timeout=float(self.env.get(self.CREDENTIAL_POOL_TIMEOUT, "5")),
+        )
+        self.idempotent_responses = IdempotencyCache(
+            maxsize=int(self.env.get(self.IDEMPOTENCY_CACHE_MAXSIZE) or 0)
+        )
+        self.idempotency_key_ttl = float(
+            self.env.get(self.IDEMPOTENCY_KEY_TTL, "86400")
+        )
+        self.transfer_pipeline: typing.Optional[TransferPipeline] = None
+
+    def construct_env(
+        self, name: str, env: typing.Optional[EnvType] = None
+    ) -> Environment:
+        """Build the environment and enable Account snapshotting
+        when a positive interval is configured
+
+        Args:
+            name (str): name of the application
+            env (EnvType, optional): explicit settings
+
+        Raises:
+            ValueError
+
+        Returns:
+            Environment
+        """
+        _env = super().construct_env(name, env)
+        interval = int(_env.get(self.ACCOUNT_SNAPSHOTTING_INTERVAL) or 0)
+        if interval < 0:
+            raise ValueError("Snapshotting interval can't be less than 0")
+        if interval:
+            self.snapshotting_intervals = {
+                Account: interval,
+                AccountShard: interval,
+            }
+            _env["IS_SNAPSHOTTING_ENABLED"] = "y"
+        return _env
+
+    def construct_repository(self) -> Repository:
+        """Build the repository with a counting LRU cache, timing
+        its loads and recording what they replay
+
+        Returns:
+            Repository
+        """
+        repository = super().construct_repository()
+        if isinstance(repository.cache, LRUCache):
+            repository.cache = CountingLRUCache(repository.cache.maxsize)
+        self.replays = ReplayStats(
+            maxsize=int(self.env.get(self.REPLAY_STATS_MAXSIZE) or 0)
+        )
+        get = repository.get
+
+        def timed_get(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+            with metrics.phase("load"):
+                return self.replays.measure(
+                    args[0], lambda: get(*args, **kwargs)
+                )
+
+        # Every load, through a unit of work or not, is a load phase of
+        # the request being served.
+        repository.get = timed_get  # type: ignore[assignment]
+        return repository
+
+    def construct_transcoder(self) -> Transcoder:
+        """Build the transcoder named by EVENT_TRANSCODER
+
+        Raises:
+            ValueError
+
+        Returns:
+            Transcoder
+        """
+        name = self.env.get(self.EVENT_TRANSCODER) or "compact"
+        if name == "json":
+            return super().construct_transcoder()
+        if name != "compact":
+            raise ValueError(f"Unknown event transcoder: {name}")
+        transcoder = CompactTranscoder()
+        self.register_transcodings(transcoder)
+        return transcoder
+
+    def construct_mapper(self) -> Mapper:
+        """Build the mapper with the compression named by
+        EVENT_COMPRESSION
+
+        Raises:
+            ValueError
+
+        Returns:
+            Mapper
+        """
+        mapper = self.factory.mapper(
+            transcoder=self.construct_transcoder(),
+            mapper_class=ReplayCountingMapper,
+        )
+        compression = self.env.get(self.EVENT_COMPRESSION) or "none"
+        if compression == "zlib":
+            mapper.compressor = TolerantZlibCompressor()
+        elif compression != "none":
+            raise ValueError(f"Unknown event compression: {compression}")
+        return mapper
+
+    def _record(
+        self, processing_event: ProcessingEvent
+    ) -> typing.List[Recording]:
+        """Record the events, index the opened accounts and refresh
+        the cached copies of the saved aggregates
+
+        Args:
+            processing_event (ProcessingEvent)
+
+        Returns:
+            List[Recording]
+        """
+        with metrics.phase("save"):
+            recordings = super()._record(processing_event)
+        for event in processing_event.events:
+            if isinstance(event, Account.Opened):
+                self.email_index.add(event.originator_id)
+        for aggregate in processing_event.aggregates.values():
+            if isinstance(aggregate, IdempotentResponse):
+                self._cache_idempotent_response(aggregate)
+        cache = self.repository.cache
+        if cache is not None and self.repository.fastforward:
+            for aggregate_id, aggregate in processing_event.aggregates.items():
+                cache.put(aggregate_id, deepcopy(aggregate))
+        return recordings
+
+    def follow(self, name: str, log: NotificationLog) -> None:
+        """Follow the log of the Bank itself, to complete the
+        transfers requested on its accounts
+
+        Args:
+            name (str): name of the followed application
+            log (NotificationLog)
+        """
+        super().follow(name, log)
+        # Read the log with the transcoder and compression it was
+        # written with.
+        self.mappers[name] = self.mapper
+
+    def start_transfer_pipeline(self) -> TransferPipeline:
+        """Complete the transfers requested on the Bank on a thread
+        that follows its log, prompted by its new events, starting
+        with the transfers requested before
+
+        Returns:
+            TransferPipeline
+        """
+        pipeline = TransferPipeline(self)
+        self.follow(self.name, self.notification_log)
+        pipeline.start()
+        self.lead(pipeline)
+        pipeline.prompt(self.name)
+        self.transfer_pipeline = pipeline
+        return pipeline
+
+    def process_event(
+        self, domain_event: DomainEventProtocol, tracking: Tracking
+    ) -> None:
+        """Process an event of the Bank, again when the changes of
+        the policy lose a version conflict
+
+        Args:
+            domain_event (DomainEventProtocol)
+            tracking (Tracking): position of the event in the log
+        """
+        process_event = super().process_event
+        self._retry(lambda: process_event(domain_event, tracking))
+
+    def policy(
+        self,
+        domain_event: DomainEventProtocol,
+        processing_event: ProcessingEvent,
+    ) -> None:
+        """Complete a requested transfer by crediting its destination,
+        or fail it and refund its source when the destination is
+        missing or closed
+
+        Args:
+            domain_event (DomainEventProtocol)
+            processing_event (ProcessingEvent)
+        """
+        # The Bank follows its transfer requests only (follow_topics).
+        assert isinstance(domain_event, Account.TransferRequested)
+        with self.unit_of_work(processing_event) as unit_of_work:
+            transfer: Transfer = unit_of_work.get(domain_event.transfer_id)
+            try:
+                destination = self._get_account(domain_event.destination_id)
+                destination.check_if_closed()
+            except (AggregateNotFound, AccountClosedError) as error:
+                source = self._get_account(domain_event.originator_id)
+                source.refund_transfer(
+                    transfer.id, domain_event.amount_in_cents
+                )
+                self._save(source)
+                transfer.fail(
+                    "Account not found."
+                    if isinstance(error, AggregateNotFound)
+                    else str(error)
+                )
+            else:
+                self._credit(destination, domain_event.amount_in_cents)
+                transfer.complete()
+            self._save(transfer)
+
+    @contextmanager
+    def unit_of_work(
+        self, processing_event: typing.Optional[ProcessingEvent] = None
+    ) -> typing.Iterator[UnitOfWork]:
+        """Run the Bank methods called in this block in one unit of
+        work, which is committed with a single save when the block
+        exits and discarded if it raises. Nested blocks join the
+        unit of work of the enclosing block.
+
+        Args:
+            processing_event (ProcessingEvent, optional): collect the
+                changes on it instead of saving them, in a policy
+
+        Returns:
+            Iterator[UnitOfWork]
+        """
+        current = self._current_unit_of_work()
+        if current is not None:
+            yield current
+            return
+
+        unit_of_work = UnitOfWork(
+            self.repository,
+            locks=self.account_locks,
+            lock_timeout=float(self.env.get(self.ACCOUNT_LOCK_TIMEOUT, "1")),
+        )
+        self._local.unit_of_work = unit_of_work
+        try:
+            yield unit_of_work
+            if processing_event is not None:
+                processing_event.collect_events(*unit_of_work.pending.values())
+            elif unit_of_work.pending:
+                self.save(*unit_of_work.pending.values())
+        finally:
+            self._local.unit_of_work = None
+            unit_of_work.release()
+            with self._unit_of_work_stats_lock:
+                self._unit_of_work_stats["units"] += 1
+                self._unit_of_work_stats["loads"] += unit_of_work.loads
+                self._unit_of_work_stats[
+                    "loads_avoided"
+                ] += unit_of_work.loads_avoided
+
+    def unit_of_work_stats(self) -> typing.Dict[str, int]:
+        """Return how many units of work ended, how many aggregates
+        they loaded and how many redundant loads they avoided
+
+        Returns:
+            Dict[str, int]
+        """
+        with self._unit_of_work_stats_lock:
+            return dict(self._unit_of_work_stats)
+
+    def run_unit_of_work(
+        self,
+        func: typing.Callable[..., T],
+        *args: typing.Any,
+        **kwargs: typing.Any,
+    ) -> T:
+        """Call func in a new unit of work, calling it again in a fresh
+        one when saving loses a version conflict or an account lock
+        can't be taken. Inside an existing unit of work func is just
+        called, the outermost unit of work retries.
+
+        Args:
+            func (Callable)
+
+        Raises:
+            RecordConflictError
+            AccountBusyError
+
+        Returns:
+            T: the result of func
+        """
+        if self._current_unit_of_work() is not None:
+            return func(*args, **kwargs)
+
+        def attempt() -> T:
+            with self.unit_of_work():
+                return func(*args, **kwargs)
+
+        return self._retry(attempt)
+
+    def _retry(self, func: typing.Callable[[], T]) -> T:
+        """Call func again, after a backoff, while it loses a version
+        conflict or an account lock, at most CONFLICT_RETRY_ATTEMPTS
+        times
+
+        Args:
+            func (Callable)
+
+        Raises:
+            RecordConflictError
+            AccountBusyError
+
+        Returns:
+            T: the result of func
+        """
+        attempts = int(self.env.get(self.CONFLICT_RETRY_ATTEMPTS, "5"))
+        backoff = float(self.env.get(self.CONFLICT_RETRY_BACKOFF, "0.005"))
+        max_backoff = float(
+            self.env.get(self.CONFLICT_RETRY_MAX_BACKOFF, "0.1")
+        )
+        self._count("writes")
+        attempt = 1
+        while True:
+            try:
+                return func()
+            except (RecordConflictError, AccountBusyError):
+                self._count("conflicts")
+                if attempt >= attempts:
+                    self._count("failures")
+                    raise
+            self._count("retries")
+            time.sleep(backoff_delay(attempt, backoff, max_backoff))
+            attempt += 1
+
+    def concurrency_stats(self) -> typing.Dict[str, int]:
+        """Return how many writes ran, how many attempts lost a
+        conflict, how many were retried and how many gave up
+
+        Returns:
+            Dict[str, int]
+        """
+        with self._concurrency_stats_lock:
+            return dict(self._concurrency_stats)
+
+    def _count(self, counter: str) -> None:
+        with self._concurrency_stats_lock:
+            self._concurrency_stats[counter] += 1
+
+    def _current_unit_of_work(self) -> typing.Optional[UnitOfWork]:
+        return getattr(self._local, "unit_of_work", None)
+
+    def _get_account(self, account_id: UUID) -> Account:
+        """Load an account, through the current unit of work if any
+
+        Args:
+            account_id (UUID)
+
+        Returns:
+            Account
+        """
+        unit_of_work = self._current_unit_of_work()
+        if unit_of_work is not None:
+            return unit_of_work.get(account_id)
+        return self.repository.get(account_id)
+
+    def _get_shard(self, account_id: UUID, index: int) -> AccountShard:
+        """Load a shard of a hot account, like _get_account
+
+        Args:
+            account_id (UUID)
+            index (int)
+
+        Returns:
+            AccountShard
+        """
+        shard_id = shard_id_for(account_id, index)
+        unit_of_work = self._current_unit_of_work()
+        if unit_of_work is not None:
+            return unit_of_work.get(shard_id)
+        return self.repository.get(shard_id)
+
+    def _credit(self, account: Account, amount: int) -> None:
+        """Credit an account, on a random shard when it is hot
+
+        Args:
+            account (Account)
+            amount (int)
+        """
+        if account.shards:
+            shard = self._get_shard(
+                account.id, random.randrange(account.shards)
+            )
+            shard.credit(amount)
+            self._save(shard)
+        else:
+            account.credit(amount)
+            self._save(account)
+
+    def _debit(self, account: Account, amount: int) -> None:
+        """Debit an account, sweeping its shards first when it is
+        hot and its main ledger can't cover the amount
+
+        Args:
+            account (Account)
+            amount (int)
+
+        Raises:
+            InsufficientFundsError
+        """
+        self._cover(account, amount)
+        account.debit(amount)
+        self._save(account)
+
+    def _cover(self, account: Account, amount: int) -> None:
+        """Sweep the shards of a hot account into its main ledger when
+        the main ledger can't cover the amount
+
+        Args:
+            account (Account)
+            amount (int)
+        """
+        if account.shards and not self._covers(account, amount):
+            shards = [
+                self._get_shard(account.id, index)
+                for index in range(account.shards)
+            ]
+            self._sweep(account, shards)
+            self._save(*shards)
+
+    @staticmethod
+    def _covers(account: Account, amount: int) -> bool:
+        return account.balance + account.get_overdraft_limit() >= amount
+
+    @staticmethod
+    def _sweep(
+        account: Account, shards: typing.Iterable[AccountShard]
+    ) -> None:
+        for shard in shards:
+            amount = shard.balance
+            if amount > 0:
+                shard.sweep(amount)
+                account.credit(amount)
+
+    def _save(self, *accounts: Aggregate) -> None:
+        """Save accounts when the current unit of work ends, every
+        Bank write runs in one (see transactional)
+
+        Args:
+            accounts (Aggregate)
+        """
+        unit_of_work = self._current_unit_of_work()
+        assert unit_of_work is not None, "Bank writes run in a unit of work"
+        unit_of_work.add(*accounts)
+
+    def close(self) -> None:
+        """Stop the transfer pipeline, save the email index, if it has
+        a file, stop the credential workers and close the Bank"""
+        if self.transfer_pipeline is not None:
+            self.transfer_pipeline.stop()
+            self.transfer_pipeline.join()
+        email_index_path = self.env.get(self.EMAIL_INDEX_PATH)
+        if email_index_path:
+            self.email_index.catch_up()
+            self.email_index.save(email_index_path)
+        self.credentials.shutdown()
+        super().close()
+
+    def cache_stats(self) -> typing.Dict[str, int]:
+        """Return hit, miss and eviction counters of the aggregate cache
+
+        Returns:
+            Dict[str, int]: empty when the cache is disabled
+        """
+        cache = self.repository.cache
+        if isinstance(cache, CountingLRUCache):
+            return cache.stats()
+        return {}
+
+    def replay_stats(self) -> typing.Dict[str, typing.Any]:
+        """Return the totals of the aggregate loads: loads, full loads,
+        loads from snapshots, events replayed and seconds, and the
+        distribution of the versions of the REPLAY_STATS_MAXSIZE most
+        recently loaded aggregates
+
+        Returns:
+            Dict[str, Any]
+        """
+        return self.replays.stats()
+
+    def top_replays(
+        self, n: int = 10, by: str = "events"
+    ) -> typing.List[AggregateReplays]:
+        """Return the loaded aggregates that cost the most to load,
+        exact for n up to 100 whenever they were loaded
+
+        Args:
+            n (int)
+            by (str): "events", "seconds", "version" or "loads"
+
+        Raises:
+            ValueError
+
+        Returns:
+            List[AggregateReplays]
+        """
+        return self.replays.top(n, by)
+
+    @transactional
     def open_account(
         self,
         full_name: str,
@@ -47,45 +802,92 @@ class Bank(Application):
 
         Returns:
             UUID: unique identifier of the account
+
+        Raises:
+            AccountAlreadyExistsError
         """
+        if self.email_index.lookup(email_address) is not None:
+            raise AccountAlreadyExistsError(email_address)
         account = Account(
             self.get_account_id_by_email(email_address),
             full_name=full_name,
             email_address=email_address,
-            password=password,
+            hashed_password=self.credentials.hash(password),
         )
-        self.save(account)
+        self._save(account)
         return account.id
 
+    @transactional
+    def open_accounts(
+        self, applicants: typing.Iterable[typing.Tuple[str, str, str]]
+    ) -> typing.Tuple[typing.List[UUID], int]:
+        """Function used to open many accounts with a single save.
+        Existing emails are found through the email index, and the
+        passwords are hashed on every credential worker at once.
+
+        Args:
+            applicants (Iterable[Tuple[str, str, str]]): full name,
+                email and password of each owner
+
+        Returns:
+            Tuple[List[UUID], int]: ids of the opened accounts and
+                number of duplicate emails skipped
+        """
+        pending: typing.Dict[UUID, typing.Tuple[str, str, str]] = {}
+        duplicates = 0
+        for full_name, email_address, password in applicants:
+            account_id = account_id_for(email_address)
+            if account_id in pending:
+                duplicates += 1
+            else:
+                pending[account_id] = (full_name, email_address, password)
+
+        new = {
+            account_id: applicant
+            for account_id, applicant in pending.items()
+            if self.email_index.lookup(applicant[1]) is None
+        }
+        duplicates += len(pending) - len(new)
+
+        hashed_passwords = self.credentials.hash_many(
+            [password for _, _, password in new.values()]
+        )
+        accounts = []
+        for account_id, hashed_password in zip(new, hashed_passwords):
+            full_name, email_address, _ = new[account_id]
+            accounts.append(
+                Account(
+                    account_id,
+                    full_name=full_name,
+                    email_address=email_address,
+                    hashed_password=hashed_password,
+                )
+            )
+        self._save(*accounts)
+        return [account.id for account in accounts], duplicates
+
+    @transactional
     def close_account(self, account_id: UUID) -> None:
         """Function used to close an existing account
 
         Args:
             account_id (UUID)
         """
-        account = self.repository.get(account_id)
+        account = self._get_account(account_id)
         account.close_account()
-        self.save(account)
+        self._save(account)
 
     def get_account_id_by_email(self, email_address: str) -> UUID:
-        """Function used to get an account by email
+        """Function used to get the id of the account of an email,
+        which is derived from the email, whether it exists or not
 
         Args:
             email_address (str)
 
-        Raises:
-            AccountNotFoundError
-
         Returns:
             UUID
         """
-        account_id = uuid5(NAMESPACE_URL, email_address)
-
-        try:
-            existing_account = self.repository.get(account_id)
-            return existing_account.id
-        except AggregateNotFound:
-            return account_id
+        return account_id_for(email_address)
 
     def authenticate(self, email_address: str, password: str) -> UUID:
         """Function used to make the authentication process
@@ -95,16 +897,41 @@ class Bank(Application):
             password (str)
 
         Raises:
+            AccountNotFoundError
             BadCredentials
 
         Returns:
             UUID
         """
-        account_id = self.get_account_id_by_email(email_address)
-        account = self.repository.get(account_id)
-        if account.authenticate(email_address, password):
-            return account_id
-        raise BadCredentials(email_address)
+        account_id = self.email_index.lookup(email_address)
+        if account_id is None:
+            raise AccountNotFoundError(email_address)
+        account = self._get_account(account_id)
+        hashed_password = account.hashed_password
+        if not self.credentials.verify(password, hashed_password):
+            raise BadCredentials(email_address)
+        if self.credentials.needs_rehash(hashed_password):
+            self._rehash_password(
+                account_id, hashed_password, self.credentials.hash(password)
+            )
+        return account_id
+
+    @transactional
+    def _rehash_password(
+        self, account_id: UUID, old_hash: str, new_hash: str
+    ) -> None:
+        """Replace the hash of a password checked at login, unless the
+        password changed in the meantime
+
+        Args:
+            account_id (UUID)
+            old_hash (str)
+            new_hash (str)
+        """
+        account = self._get_account(account_id)
+        if account.hashed_password == old_hash:
+            account.change_password(new_hash)
+            self._save(account)
 
     def validate_password(self, account_id: UUID, password: str) -> bool:
         """Validate if the incoming password matchs with the account's password
@@ -119,12 +946,12 @@ class Bank(Application):
         Returns:
             bool
         """
-        account = self.repository.get(account_id)
-        hashed_password = sha512(password.encode()).hexdigest()
-        if not hashed_password.__eq__(account.hashed_password):
+        account = self._get_account(account_id)
+        if not self.credentials.verify(password, account.hashed_password):
             raise BadCredentials(account.email_address)
         return True
 
+    @transactional
     def change_password(
         self, account_id: UUID, current_password: str, new_password: str
     ) -> None:
@@ -136,9 +963,9 @@ class Bank(Application):
             new_password (str)
         """
         if self.validate_password(account_id, current_password):
-            account = self.repository.get(account_id)
-            account.change_password(new_password)
-            self.save(account)
+            account = self._get_account(account_id)
+            account.change_password(self.credentials.hash(new_password))
+            self._save(account)
 
     def get_account(self, account_id: UUID) -> Account:
         """Get accunt by its id
@@ -149,7 +976,7 @@ class Bank(Application):
         Returns:
             Account
         """
-        return self.repository.get(account_id)
+        return self._get_account(account_id)
 
     def get_balance(self, account_id: UUID) -> int:
         """Get balance by account ID
@@ -158,17 +985,76 @@ class Bank(Application):
             account_id (UUID)
 
         Returns:
-            int
+            int: main ledger plus the shards of a hot account
         """
         try:
-            account = self.repository.get(account_id)
+            account = self._get_account(account_id)
         except AggregateNotFound:
             raise AccountNotFoundError(
                 f"Account with ID {account_id} not found"
             )
 
-        return account.balance
+        return account.balance + sum(
+            self._get_shard(account_id, index).balance
+            for index in range(account.shards)
+        )
+
+    def get_transactions(
+        self,
+        account_id: UUID,
+        before: typing.Optional[int] = None,
+        limit: int = 50,
+    ) -> typing.Tuple[typing.List[TransactionRecord], typing.Optional[int]]:
+        """Get a page of the credits and debits of an account, newest
+        first, reading its stored events backwards from a version
+        TRANSACTIONS_SCAN_SIZE at a time, so neither the aggregate nor
+        its whole history is loaded. Credits of hot accounts count
+        when their shards are swept into the main ledger.
+
+        Args:
+            account_id (UUID)
+            before (int, optional): version the page starts below,
+                the cursor of the previous page
+            limit (int): size of the page
+
+        Raises:
+            AccountNotFoundError
 
+        Returns:
+            Tuple[List[TransactionRecord], Optional[int]]: the page and
+                the cursor of the next one, None on the last page
+        """
+        scan_size = int(self.env.get(self.TRANSACTIONS_SCAN_SIZE, "100"))
+        page: typing.List[TransactionRecord] = []
+        lte = before - 1 if before is not None else None
+        while lte is None or lte > 0:
+            scanned = 0
+            for domain_event in self.events.get(
+                account_id, lte=lte, desc=True, limit=scan_size
+            ):
+                scanned += 1
+                lte = domain_event.originator_version - 1
+                kind = TRANSACTION_KINDS.get(type(domain_event))
+                if kind is None:
+                    continue
+                if len(page) == limit:
+                    return page, page[-1].version
+                page.append(
+                    TransactionRecord(
+                        version=domain_event.originator_version,
+                        kind=kind,
+                        amount=domain_event.amount_in_cents,
+                        timestamp=domain_event.timestamp.isoformat(),
+                        transfer_id=getattr(domain_event, "transfer_id", None),
+                    )
+                )
+            if scanned < scan_size:
+                break
+        if lte is None:
+            raise AccountNotFoundError(f"Account with ID {account_id}")
+        return page, None
+
+    @transactional
     def deposit_funds(self, account_id: UUID, amount: int) -> None:
         """Function used to make deposits in your account.
 
@@ -176,11 +1062,22 @@ class Bank(Application):
             account_id (UUID)
             amount (int)
         """
-        account = self.repository.get(account_id)
+        account = self._get_account(account_id)
         account.check_if_closed()
-        account.credit(amount)
-        self.save(account)
+        self._credit(account, amount)
+
+    @transactional
+    def refund_funds(self, account_id: UUID, amount: int) -> None:
+        """Function used to give back the amount of a transfer that
+        could not be completed, even when the account was closed since
 
+        Args:
+            account_id (UUID)
+            amount (int)
+        """
+        self._credit(self._get_account(account_id), amount)
+
+    @transactional
     def transfer_funds(
         self,
         source_account_id: UUID,
@@ -197,20 +1094,303 @@ class Bank(Application):
         Raises:
             TransactionError
         """
-        source_account = self.repository.get(source_account_id)
-        destination_account = self.repository.get(destination_account_id)
-
         if source_account_id == destination_account_id:
             raise TransactionError("Cannot transfer to the same account")
 
+        source_account = self._get_account(source_account_id)
+        destination_account = self._get_account(destination_account_id)
+
         source_account.check_if_closed()
         destination_account.check_if_closed()
 
-        source_account.debit(amount)
-        destination_account.credit(amount)
+        self._debit(source_account, amount)
+        self._credit(destination_account, amount)
 
-        self.save(source_account, destination_account)
+    @transactional
+    def request_transfer(
+        self,
+        source_account_id: UUID,
+        destination_account_id: UUID,
+        amount: int,
+    ) -> UUID:
+        """Function used to transfer cash from your account to other
+        without waiting for the destination: the source is debited
+        now and the Bank credits the destination, or refunds the
+        source, when it processes the request (see policy)
+
+        Args:
+            source_account_id (UUID)
+            destination_account_id (UUID)
+            amount (int)
+
+        Raises:
+            TransactionError
+            TransferPipelineError: the transfer pipeline is failing,
+                so the transfer would not complete
+
+        Returns:
+            UUID: id of the transfer, see get_transfer
+        """
+        pipeline = self.transfer_pipeline
+        if pipeline is not None and not pipeline.healthy:
+            raise TransferPipelineError("Transfers are unavailable")
+        if source_account_id == destination_account_id:
+            raise TransactionError("Cannot transfer to the same account")
+
+        source_account = self._get_account(source_account_id)
+        source_account.check_if_closed()
+        self._cover(source_account, amount)
+        transfer = Transfer(
+            uuid4(), source_account_id, destination_account_id, amount
+        )
+        source_account.request_transfer(
+            transfer.id, destination_account_id, amount
+        )
+        self._save(source_account, transfer)
+        return transfer.id
+
+    def get_transfer(self, transfer_id: UUID) -> Transfer:
+        """Get a transfer requested with request_transfer
+
+        Args:
+            transfer_id (UUID)
 
+        Raises:
+            TransferNotFoundError
+
+        Returns:
+            Transfer
+        """
+        try:
+            transfer = self.repository.get(transfer_id)
+        except AggregateNotFound:
+            raise TransferNotFoundError(transfer_id)
+        if not isinstance(transfer, Transfer):
+            raise TransferNotFoundError(transfer_id)
+        return transfer
+
+    def get_idempotent_response(
+        self, account_id: UUID, key: str, fingerprint: str
+    ) -> typing.Optional[typing.Tuple[typing.Dict[str, typing.Any], int]]:
+        """Get the response saved for a request of an account made with
+        an idempotency key, for IDEMPOTENCY_KEY_TTL seconds, from the
+        IDEMPOTENCY_CACHE_MAXSIZE responses in memory when it can
+
+        Args:
+            account_id (UUID)
+            key (str): Idempotency-Key of the request
+            fingerprint (str): digest of the request
+
+        Raises:
+            IdempotencyKeyReusedError: the key was used for a
+                different request
+
+        Returns:
+            Optional[Tuple[Dict[str, Any], int]]: body and status, None
+                unless a response was saved and hasn't expired
+        """
+        response_id = idempotency_id_for(account_id, key)
+        cached = self.idempotent_responses.get(response_id)
+        if cached is None:
+            try:
+                response = self.repository.get(response_id)
+            except AggregateNotFound:
+                return None
+            if self._idempotent_response_expired(response):
+                return None
+            cached = self._cache_idempotent_response(response)
+        saved_fingerprint, body, status = cached
+        if saved_fingerprint != fingerprint:
+            raise IdempotencyKeyReusedError(key)
+        return body, status
+
+    @transactional
+    def save_idempotent_response(
+        self,
+        account_id: UUID,
+        key: str,
+        fingerprint: str,
+        body: typing.Dict[str, typing.Any],
+        status: int,
+    ) -> None:
+        """Save the response of a request made with an idempotency key,
+        call it in the unit of work of the request so it is saved with
+        its changes
+
+        Args:
+            account_id (UUID)
+            key (str): Idempotency-Key of the request
+            fingerprint (str): digest of the request
+            body (Dict[str, Any])
+            status (int)
+
+        Raises:
+            RecordConflictError: a response was saved for the key
+                meanwhile, retrying the request returns it
+        """
+        response_id = idempotency_id_for(account_id, key)
+        unit_of_work = self._current_unit_of_work()
+        assert unit_of_work is not None, "Bank writes run in a unit of work"
+        try:
+            response = unit_of_work.get(response_id)
+        except AggregateNotFound:
+            response = IdempotentResponse(
+                response_id, fingerprint, body, status
+            )
+        else:
+            if not self._idempotent_response_expired(response):
+                raise RecordConflictError(response_id)
+            response.replace(fingerprint, body, status)
+        self._save(response)
+
+    def idempotency_stats(self) -> typing.Dict[str, int]:
+        """Return hit, miss, eviction and expiration counters of the
+        cache of idempotent responses
+
+        Returns:
+            Dict[str, int]
+        """
+        return self.idempotent_responses.stats()
+
+    def _idempotent_response_expired(
+        self, response: IdempotentResponse
+    ) -> bool:
+        age = time.time() - response.modified_on.timestamp()
+        return age >= self.idempotency_key_ttl
+
+    def _cache_idempotent_response(
+        self, response: IdempotentResponse
+    ) -> typing.Tuple[str, typing.Dict[str, typing.Any], int]:
+        cached = (response.fingerprint, response.body, response.status)
+        self.idempotent_responses.put(
+            response.id,
+            response.modified_on.timestamp() + self.idempotency_key_ttl,
+            cached,
+        )
+        return cached
+
+    @transactional
+    def transfer_funds_batch(
+        self,
+        transfers: typing.Sequence[typing.Tuple[UUID, UUID, int]],
+        atomic: bool = True,
+    ) -> typing.List[TransferResult]:
+        """Function used to make many transfers with a single save.
+        Every account is loaded once, however many transfers use it,
+        and hot accounts take their credits on the main ledger.
+
+        Args:
+            transfers (Sequence[Tuple[UUID, UUID, int]]): source account
+                id, destination account id and amount of each transfer
+            atomic (bool): save nothing if any transfer fails,
+                otherwise save the transfers that succeeded
+
+        Raises:
+            TransactionError
+
+        Returns:
+            List[TransferResult]: one result per transfer, in order
+        """
+        max_size = int(self.env.get(self.TRANSFER_BATCH_MAX_SIZE, "10000"))
+        if len(transfers) > max_size:
+            raise TransactionError(
+                f"Cannot make more than {max_size} transfers in a batch"
+            )
+
+        unit_of_work = self._current_unit_of_work()
+        assert unit_of_work is not None
+        accounts: typing.Dict[UUID, typing.Any] = {}
+        preloaded: typing.Set[UUID] = set()
+
+        def load(account_id: UUID) -> typing.Any:
+            if account_id not in accounts:
+                if account_id in unit_of_work.loaded:
+                    # Work on a copy, so an aborted batch leaves the
+                    # accounts loaded before the batch untouched.
+                    preloaded.add(account_id)
+                    account = deepcopy(self._get_account(account_id))
+                else:
+                    account = self._get_account(account_id)
+                accounts[account_id] = account
+            return accounts[account_id]
+
+        results = []
+        for source_account_id, destination_account_id, amount in transfers:
+            try:
+                if source_account_id == destination_account_id:
+                    raise TransactionError(
+                        "Cannot transfer to the same account"
+                    )
+                source_account = load(source_account_id)
+                destination_account = load(destination_account_id)
+                source_account.check_if_closed()
+                destination_account.check_if_closed()
+                if source_account.shards and not self._covers(
+                    source_account, amount
+                ):
+                    self._sweep(
+                        source_account,
+                        (
+                            load(shard_id_for(source_account_id, index))
+                            for index in range(source_account.shards)
+                        ),
+                    )
+                source_account.debit(amount)
+                destination_account.credit(amount)
+            except AggregateNotFound:
+                results.append(TransferResult("failed", "Account not found."))
+            except (
+                AccountClosedError,
+                InsufficientFundsError,
+                TransactionError,
+                ValueError,
+            ) as error:
+                results.append(TransferResult("failed", str(error)))
+            else:
+                results.append(TransferResult("success"))
+
+        if atomic and any(result.status == "failed" for result in results):
+            unit_of_work.forget(*(set(accounts) - preloaded))
+            return [
+                TransferResult("aborted") if result.error is None else result
+                for result in results
+            ]
+
+        self._save(*accounts.values())
+        return results
+
+    @transactional
+    def enable_hot_mode(self, account_id: UUID, shards: int) -> None:
+        """Function used to spread the credits of a busy account,
+        like a merchant's, across shards. The number of shards can
+        grow later, never shrink.
+
+        Each credit goes to a random shard, the balance is the main
+        ledger plus every shard, and a debit the main ledger can't
+        cover sweeps the shards into it first. Striped locks still
+        serialize the writers of the main ledger, so leave
+        ACCOUNT_LOCK_STRIPES off for hot accounts.
+
+        Args:
+            account_id (UUID)
+            shards (int)
+
+        Raises:
+            ValueError
+        """
+        account = self._get_account(account_id)
+        account.check_if_closed()
+        opened = account.shards
+        account.enable_hot_mode(shards)
+        self._save(
+            account,
+            *(
+                AccountShard(shard_id_for(account_id, index), account_id)
+                for index in range(opened, shards)
+            ),
+        )
+
+    @transactional
     def withdraw_funds(self, account_id: UUID, amount: int) -> None:
         """Function used to make withdraws.
 
@@ -218,10 +1398,9 @@ class Bank(Application):
             account_id (UUID)
             amount (int)
         """
-        account = self.repository.get(account_id)
+        account = self._get_account(account_id)
         account.check_if_closed()
-        account.debit(amount)
-        self.save(account)
+        self._debit(account, amount)
 
     def get_overdraft_limit(self, account_id: UUID) -> int:
         """Function used to get the current overdraft limit of the account
@@ -232,9 +1411,10 @@ class Bank(Application):
         Returns:
             int
         """
-        account = self.repository.get(account_id)
+        account = self._get_account(account_id)
         return account.get_overdraft_limit()
 
+    @transactional
     def set_overdraft_limit(self, account_id: UUID, amount: int) -> None:
         """Function used to set the new overdraft limit to the account
 
@@ -242,7 +1422,7 @@ class Bank(Application):
             account_id (UUID)
             amount (int)
         """
-        account = self.repository.get(account_id)
+        account = self._get_account(account_id)
         account.check_if_closed()
         account.set_overdraft_limit(amount)
-        self.save(account)
+        self._save(account)
@@ -0,0 +1,327 @@
+# coding=utf-8
+"""ASGI variant of the signup, login, account, deposit, transfer and
+withdraw endpoints of banking.api, on the same URLs and the same Bank.
+Serve it with uvicorn or hypercorn, the built-in server is a minimal
+one for tests and benchmarks.
+
+    uvicorn banking.asgi:app --port 8000
+    poetry run python -m banking.asgi --port 8000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from uuid import UUID
+
+from flask_jwt_extended import create_access_token, verify_jwt_in_request
+from flask_jwt_extended.config import config
+from werkzeug.exceptions import HTTPException
+
+from banking.api import (
+    IDEMPOTENCY_KEY_HEADER,
+    app as flask_app,
+    async_transfers,
+    balances,
+    bank,
+    call_idempotent,
+    token_cache,
+)
+from banking.utils.asgiserver import Receive, Send, start_server
+from banking.utils.error_handler import error_handler
+
+Data = typing.Any
+Result = typing.Tuple[typing.Dict[str, typing.Any], int]
+Handler = typing.Callable[[Data, typing.Optional[str]], Result]
+# Body, status and, for a replayed response, its extra headers.
+Response = typing.Tuple[typing.Any, ...]
+
+
+class Route(typing.NamedTuple):
+    """Bank work behind a method and path"""
+
+    handler: Handler
+    authenticated: bool
+    transactional: bool
+    idempotent: bool
+
+
+ROUTES: typing.Dict[typing.Tuple[str, str], Route] = {}
+
+# The Bank blocks on the event store, so it runs on these threads while
+# the event loop keeps serving every other connection.
+executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ASGI_EXECUTOR_WORKERS", "32")),
+    thread_name_prefix="bank",
+)
+
+with flask_app.app_context():
+    IDENTITY_CLAIM = config.identity_claim_key
+
+
+def route(
+    method: str,
+    path: str,
+    authenticated: bool = True,
+    transactional: bool = True,
+    idempotent: bool = False,
+) -> typing.Callable[[Handler], Handler]:
+    """Decorator used to serve a function on a method and path, with
+    the JSON body and the identity of the bearer token, answering the
+    retries of an idempotent route like banking.api.idempotent
+    """
+
+    def register(handler: Handler) -> Handler:
+        ROUTES[(method, f"/api/v1{path}")] = Route(
+            handler, authenticated, transactional, idempotent
+        )
+        return handler
+
+    return register
+
+
+@route("POST", "/signup", authenticated=False)
+def signup(data: Data, identity: typing.Optional[str]) -> Result:
+    """POST /api/v1/signup"""
+    account_id = bank().open_account(
+        data["full_name"], data["email_address"], data["password"]
+    )
+    return {"account_id": str(account_id)}, 201
+
+
+@route("POST", "/login", authenticated=False)
+def login(data: Data, identity: typing.Optional[str]) -> Result:
+    """POST /api/v1/login"""
+    account_id = bank().authenticate(data["email_address"], data["password"])
+    with flask_app.app_context():
+        access_token = create_access_token(identity=str(account_id))
+    return {"access_token": access_token}, 200
+
+
+@route("GET", "/account", transactional=False)
+def account(data: Data, identity: typing.Optional[str]) -> Result:
+    """GET /api/v1/account"""
+    summary = balances().get_summary(UUID(identity))
+    return {"balance": str(summary.balance), "identity": identity}, 200
+
+
+@route("POST", "/deposit", idempotent=True)
+def deposit(data: Data, identity: typing.Optional[str]) -> Result:
+    """POST /api/v1/deposit"""
+    bank().deposit_funds(UUID(identity), data["amount"])
+    return {"result": "success"}, 200
+
+
+@route("POST", "/transfer", idempotent=True)
+def transfer(data: Data, identity: typing.Optional[str]) -> Result:
+    """POST /api/v1/transfer"""
+    destination_id = UUID(data["destination_id"])
+    if async_transfers():
+        transfer_id = bank().request_transfer(
+            UUID(identity), destination_id, data["amount"]
+        )
+        return {"transfer_id": str(transfer_id), "status": "pending"}, 202
+    bank().transfer_funds(UUID(identity), destination_id, data["amount"])
+    return {"result": "success"}, 200
+
+
+@route("POST", "/withdraw", idempotent=True)
+def withdraw(data: Data, identity: typing.Optional[str]) -> Result:
+    """POST /api/v1/withdraw"""
+    bank().withdraw_funds(UUID(identity), data["amount"])
+    return {"result": "success"}, 200
+
+
+class HTTPError(Exception):
+    """Exception used to answer a request with an error response"""
+
+    def __init__(self, body: typing.Dict[str, typing.Any], status: int):
+        self.body = body
+        self.status = status
+        super().__init__(body)
+
+
+def authorize(authorization: str) -> str:
+    """Get the identity of a bearer token, from the token cache or
+    verified by flask_jwt_extended, with its error responses
+
+    Args:
+        authorization (str): value of the authorization header
+
+    Raises:
+        HTTPError
+
+    Returns:
+        str
+    """
+    cached = token_cache().get(authorization) if authorization else None
+    if cached is not None:
+        return cached[1][IDENTITY_CLAIM]
+
+    headers = {"Authorization": authorization} if authorization else {}
+    with flask_app.test_request_context(headers=headers):
+        try:
+            verified = verify_jwt_in_request()
+        except Exception as error:
+            response = flask_app.make_response(
+                flask_app.handle_user_exception(error)
+            )
+            raise HTTPError(response.get_json(), response.status_code)
+        assert verified is not None
+        token_cache().put(authorization, *verified)
+        return verified[1][IDENTITY_CLAIM]
+
+
+def run_idempotent(
+    handler: Handler,
+    scope: typing.Dict[str, typing.Any],
+    data: Data,
+    identity: typing.Optional[str],
+) -> Response:
+    """Run the handler of an idempotent route once per Idempotency-Key,
+    see banking.api.call_idempotent
+
+    Args:
+        handler (Handler)
+        scope (Dict[str, Any]): ASGI scope of the request
+        data (Any): JSON body
+        identity (str, optional)
+
+    Returns:
+        Tuple[Any, ...]: body, status and extra headers, if any
+    """
+    headers = dict(scope["headers"])
+    key = headers.get(IDEMPOTENCY_KEY_HEADER.lower().encode())
+    return call_idempotent(
+        partial(handler, data, identity),
+        UUID(identity),
+        key.decode() if key is not None else None,
+        scope["method"],
+        scope["path"],
+        data,
+    )
+
+
+def run_handler(
+    selected: Route,
+    scope: typing.Dict[str, typing.Any],
+    data: Data,
+    identity: typing.Optional[str],
+) -> Response:
+    """Run a handler with the error semantics of banking.api
+
+    Args:
+        selected (Route)
+        scope (Dict[str, Any]): ASGI scope of the request
+        data (Any): JSON body
+        identity (str, optional)
+
+    Returns:
+        Tuple[Any, ...]: body, status and extra headers, if any
+    """
+    handler: typing.Callable[..., Response] = selected.handler
+    if selected.idempotent:
+        handler = partial(run_idempotent, handler, scope)
+    if selected.transactional:
+        handler = partial(bank().run_unit_of_work, handler)
+    try:
+        return error_handler(handler)(data, identity)
+    except HTTPException as error:
+        return {"message": error.description}, error.code or 500
+
+
+async def app(
+    scope: typing.Dict[str, typing.Any], receive: Receive, send: Send
+) -> None:
+    """The ASGI application"""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            await send({"type": message["type"] + ".complete"})
+            if message["type"] == "lifespan.shutdown":
+                return
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+    try:
+        result = await handle(scope, body)
+    except HTTPError as error:
+        result = error.body, error.status
+    payload, status = result[:2]
+    headers = [(b"content-type", b"application/json")]
+    for name, value in (result[2] if len(result) > 2 else {}).items():
+        headers.append((name.lower().encode(), value.encode()))
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": headers,
+        }
+    )
+    await send(
+        {"type": "http.response.body", "body": json.dumps(payload).encode()}
+    )
+
+
+async def handle(
+    scope: typing.Dict[str, typing.Any], body: bytes
+) -> Response:
+    """Route a request and run its handler on the executor
+
+    Args:
+        scope (Dict[str, Any]): ASGI scope of the request
+        body (bytes)
+
+    Raises:
+        HTTPError
+
+    Returns:
+        Tuple[Any, ...]: body, status and extra headers, if any
+    """
+    selected = ROUTES.get((scope["method"], scope["path"]))
+    if selected is None:
+        if any(path == scope["path"] for _, path in ROUTES):
+            raise HTTPError({"message": "Method not allowed."}, 405)
+        raise HTTPError({"message": "Not found."}, 404)
+
+    identity = None
+    if selected.authenticated:
+        headers = dict(scope["headers"])
+        authorization = headers.get(b"authorization", b"").decode().strip()
+        identity = authorize(authorization)
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        raise HTTPError({"message": "Failed to decode JSON object."}, 400)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor, run_handler, selected, scope, data, identity
+    )
+
+
+def main(
+    argv: typing.Optional[typing.List[str]] = None,
+) -> None:  # pragma: no cover
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+
+    async def serve() -> None:
+        server = await start_server(app, args.host, args.port)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,14 @@
 # coding=utf-8
 
+import typing
 from hashlib import sha512
-from uuid import UUID
+from uuid import UUID, uuid5
 
 from eventsourcing.domain import Aggregate, event
 
 from banking.utils.custom_exceptions import (
     AccountClosedError,
     InsufficientFundsError,
-    BadCredentials,
 )
 
 
@@ -20,17 +20,47 @@ class Account(Aggregate):
     you get all events saved for the id of the
     individual model. This never saves itself,
     all saving happens in the Bank application.
+
+    Passwords are hashed by the Bank before they
+    reach the account, so events only carry the
+    hash. Events stored with the plain password
+    are upcast to its legacy SHA-512 hash.
     """
 
+    class Opened(Aggregate.Created):
+        full_name: str
+        email_address: str
+        hashed_password: str
+
+        class_version = 2
+
+        @staticmethod
+        def upcast_v1_v2(state: typing.Dict[str, typing.Any]) -> None:
+            password = state.pop("password")
+            state["hashed_password"] = sha512(password.encode()).hexdigest()
+
+    class PasswordChanged(Aggregate.Event):
+        new_hashed_password: str
+
+        class_version = 2
+
+        @staticmethod
+        def upcast_v1_v2(state: typing.Dict[str, typing.Any]) -> None:
+            password = state.pop("new_password")
+            state["new_hashed_password"] = sha512(
+                password.encode()
+            ).hexdigest()
+
     _id: UUID
+    shards = 0
 
-    @event("Opened")
+    @event(Opened)
     def __init__(
         self,
         id: UUID,
         full_name: str,
         email_address: str,
-        password: str,
+        hashed_password: str,
     ):
         """Constructor, create a new account
 
@@ -38,12 +68,12 @@ class Account(Aggregate):
             id (UUID)
             full_name (str)
             email_address (str)
-            password (str)
+            hashed_password (str): see banking.utils.passwords
         """
         self._id = id
         self.full_name = full_name
         self.email_address = email_address
-        self.hashed_password = sha512(password.encode("utf-8")).hexdigest()
+        self.hashed_password = hashed_password
         self.balance = 0
         self.is_closed = False
         self._overdraft_limit = 0
@@ -70,6 +100,22 @@ class Account(Aggregate):
             raise AssertionError("Overdraft limit cannot be negative")
         self._overdraft_limit = amount
 
+    @event("HotModeEnabled")
+    def enable_hot_mode(self, shards: int) -> None:
+        """Spread the credits of the account across sub-ledger shards
+
+        Args:
+            shards (int): number of shards, it can only grow
+
+        Raises:
+            ValueError
+        """
+        if shards < max(self.shards, 1):
+            raise ValueError(
+                f"Number of shards can't be less than {max(self.shards, 1)}"
+            )
+        self.shards = shards
+
     @event("Closed")
     def close_account(self) -> None:
         """Close an existing account"""
@@ -84,48 +130,54 @@ class Account(Aggregate):
         if self.is_closed:
             raise AccountClosedError(self._id)
 
-    @event("PasswordChanged")
-    def change_password(self, new_password: str) -> None:
+    @event(PasswordChanged)
+    def change_password(self, new_hashed_password: str) -> None:
         """Change the password to the account
 
         Args:
-            new_password (str)
+            new_hashed_password (str): see banking.utils.passwords
         """
-        new_hashed_password = sha512(new_password.encode()).hexdigest()
         self.hashed_password = new_hashed_password
 
-    def authenticate(self, email_address: str, password: str) -> bool:
-        """Function used to make the authentication of the account
+    @event("Debited")
+    def debit(self, amount_in_cents: int) -> None:
+        """aggregate to debit
 
         Args:
-            email_address (str)
-            password (str)
+            amount_in_cents (int)
 
         Raises:
-            BadCredentials
-
-        Returns:
-            bool
+            InsufficientFundsError
         """
-        hashed_password = sha512(password.encode()).hexdigest()
+        self._take(amount_in_cents)
 
-        if (
-            self.email_address != email_address
-            or self.hashed_password != hashed_password
-        ):
-            raise BadCredentials(email_address)
-        return True
-
-    @event("Debited")
-    def debit(self, amount_in_cents: int) -> None:
-        """aggregate to debit
+    @event("TransferRequested")
+    def request_transfer(
+        self, transfer_id: UUID, destination_id: UUID, amount_in_cents: int
+    ) -> None:
+        """Debit a transfer the Bank completes after the request
 
         Args:
+            transfer_id (UUID)
+            destination_id (UUID)
             amount_in_cents (int)
 
         Raises:
             InsufficientFundsError
         """
+        self._take(amount_in_cents)
+
+    @event("TransferRefunded")
+    def refund_transfer(self, transfer_id: UUID, amount_in_cents: int) -> None:
+        """Give back the amount of a transfer that failed
+
+        Args:
+            transfer_id (UUID)
+            amount_in_cents (int)
+        """
+        self.balance += amount_in_cents
+
+    def _take(self, amount_in_cents: int) -> None:
         if amount_in_cents < 0:
             raise ValueError("Amount to debit can't be less than 0")
 
@@ -142,3 +194,178 @@ class Account(Aggregate):
             amount_in_cents (int)
         """
         self.balance += amount_in_cents
+
+
+def shard_id_for(account_id: UUID, index: int) -> UUID:
+    """Id of a shard of a hot account
+
+    Args:
+        account_id (UUID)
+        index (int): number of the shard, from 0
+
+    Returns:
+        UUID
+    """
+    return uuid5(account_id, f"shard-{index}")
+
+
+class AccountShard(Aggregate):
+    """
+    This is a sub-ledger of a hot account, credits
+    to the account land on one of its shards, so
+    they bump the version of the shard instead of
+    the account and rarely conflict. The account
+    sweeps the balance of its shards when it needs
+    the funds.
+    """
+
+    _id: UUID
+
+    @event("Opened")
+    def __init__(self, id: UUID, account_id: UUID):
+        """Constructor, create a new shard
+
+        Args:
+            id (UUID)
+            account_id (UUID): owner of the shard
+        """
+        self._id = id
+        self.account_id = account_id
+        self.balance = 0
+
+    @event("Credited")
+    def credit(self, amount_in_cents: int) -> None:
+        """aggregate to get a credit
+
+        Args:
+            amount_in_cents (int)
+        """
+        self.balance += amount_in_cents
+
+    @event("Swept")
+    def sweep(self, amount_in_cents: int) -> None:
+        """Move funds out of the shard into its account
+
+        Args:
+            amount_in_cents (int)
+
+        Raises:
+            InsufficientFundsError
+        """
+        if amount_in_cents > self.balance:
+            raise InsufficientFundsError(self.balance, amount_in_cents)
+        self.balance -= amount_in_cents
+
+
+class Transfer(Aggregate):
+    """
+    This is a transfer requested on its source
+    account, which paid for it right away. The
+    Bank completes it by crediting the destination
+    when it processes the request, or fails it and
+    refunds the source.
+    """
+
+    _id: UUID
+
+    @event("Requested")
+    def __init__(
+        self,
+        id: UUID,
+        source_id: UUID,
+        destination_id: UUID,
+        amount_in_cents: int,
+    ):
+        """Constructor, create a pending transfer
+
+        Args:
+            id (UUID)
+            source_id (UUID)
+            destination_id (UUID)
+            amount_in_cents (int)
+        """
+        self._id = id
+        self.source_id = source_id
+        self.destination_id = destination_id
+        self.amount_in_cents = amount_in_cents
+        self.status = "pending"
+        self.error: typing.Optional[str] = None
+
+    @event("Completed")
+    def complete(self) -> None:
+        """The destination got the amount"""
+        self.status = "completed"
+
+    @event("Failed")
+    def fail(self, error: str) -> None:
+        """The destination can't get the amount, the source got it back
+
+        Args:
+            error (str)
+        """
+        self.status = "failed"
+        self.error = error
+
+
+def idempotency_id_for(account_id: UUID, key: str) -> UUID:
+    """Id of the response saved for an idempotency key of an account
+
+    Args:
+        account_id (UUID)
+        key (str): Idempotency-Key of the requests
+
+    Returns:
+        UUID
+    """
+    return uuid5(account_id, f"idempotency-{key}")
+
+
+class IdempotentResponse(Aggregate):
+    """
+    This is the response of a request made with an
+    idempotency key, saved with the changes of the
+    request, so a retry of the request gets it back
+    instead of applying the changes again. Once it
+    expires the key can be used again, which records
+    the response of the new request. Expired
+    responses stay in the store, nothing removes
+    them.
+    """
+
+    _id: UUID
+
+    @event("Recorded")
+    def __init__(
+        self,
+        id: UUID,
+        fingerprint: str,
+        body: typing.Dict[str, typing.Any],
+        status: int,
+    ):
+        """Constructor, record the response of a request
+
+        Args:
+            id (UUID): see idempotency_id_for
+            fingerprint (str): digest of the request
+            body (Dict[str, Any])
+            status (int)
+        """
+        self._id = id
+        self.fingerprint = fingerprint
+        self.body = body
+        self.status = status
+
+    @event("Replaced")
+    def replace(
+        self, fingerprint: str, body: typing.Dict[str, typing.Any], status: int
+    ) -> None:
+        """Record the response of a new request made with the key
+
+        Args:
+            fingerprint (str): digest of the request
+            body (Dict[str, Any])
+            status (int)
+        """
+        self.fingerprint = fingerprint
+        self.body = body
+        self.status = status
@@ -0,0 +1,143 @@
+# coding=utf-8
+
+import os
+import struct
+import threading
+import typing
+from uuid import NAMESPACE_URL, UUID, uuid5
+
+from eventsourcing.persistence import ApplicationRecorder
+from eventsourcing.utils import get_topic
+
+from banking.domainmodel import Account
+from banking.utils.bloomfilter import BloomFilter
+
+# Position in the notification log, number of hashes.
+HEADER = struct.Struct(">QI")
+
+
+def account_id_for(email_address: str) -> UUID:
+    """Id of the account owned by an email address
+
+    Args:
+        email_address (str)
+
+    Returns:
+        UUID
+    """
+    return uuid5(NAMESPACE_URL, email_address)
+
+
+class EmailIndex:
+    """
+    This is the index of the email addresses that
+    own an account. Account ids are derived from the
+    email address, so the index only has to answer
+    whether an id exists.
+
+    A bloom filter in memory answers "no" when the
+    log has not grown since it was last read, and a
+    "maybe" is confirmed by reading the first stored
+    event of the account, never by replaying it. The
+    filter is fed from the Opened notifications of
+    the Bank log, so accounts opened by any process
+    on the same store are found, and can be saved to
+    a file together with its position, so a restart
+    only scans newer events.
+    """
+
+    def __init__(
+        self,
+        recorder: ApplicationRecorder,
+        capacity: int = 1000000,
+        error_rate: float = 0.001,
+    ) -> None:
+        self.recorder = recorder
+        self.bloom_filter = BloomFilter(capacity, error_rate)
+        self.position = 0
+        self.topics = [get_topic(Account.Opened)]
+        self._lock = threading.Lock()
+
+    def add(self, account_id: UUID) -> None:
+        """Add the id of a newly opened account
+
+        Args:
+            account_id (UUID)
+        """
+        self.bloom_filter.add(account_id.bytes)
+
+    def lookup(self, email_address: str) -> typing.Optional[UUID]:
+        """Get the account id of an email address
+
+        Args:
+            email_address (str)
+
+        Returns:
+            Optional[UUID]: None if there is no account
+        """
+        account_id = account_id_for(email_address)
+        if account_id.bytes not in self.bloom_filter:
+            # Another process may have opened it since the last read.
+            self.catch_up()
+            if account_id.bytes not in self.bloom_filter:
+                return None
+        if not self.recorder.select_events(account_id, limit=1):
+            return None
+        return account_id
+
+    def catch_up(self, section_size: int = 1000) -> int:
+        """Add the accounts opened after the current position
+
+        Args:
+            section_size (int): notifications read per query
+
+        Returns:
+            int: number of accounts added
+        """
+        added = 0
+        with self._lock:
+            stop = self.recorder.max_notification_id()
+            while self.position < stop:
+                notifications = self.recorder.select_notifications(
+                    start=self.position + 1,
+                    limit=section_size,
+                    stop=stop,
+                    topics=self.topics,
+                )
+                for notification in notifications:
+                    self.add(notification.originator_id)
+                    added += 1
+                if len(notifications) < section_size:
+                    self.position = stop
+                else:
+                    self.position = notifications[-1].id
+        return added
+
+    def save(self, path: str) -> None:
+        """Write the filter and its position to a file
+
+        Args:
+            path (str)
+        """
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(HEADER.pack(self.position, self.bloom_filter.hashes))
+            file.write(self.bloom_filter.bits)
+        os.replace(temporary_path, path)
+
+    def load(self, path: str) -> bool:
+        """Read the filter and its position from a file, if it exists
+
+        Args:
+            path (str)
+
+        Returns:
+            bool: whether the file was read
+        """
+        if not os.path.exists(path):
+            return False
+        with open(path, "rb") as file:
+            position, hashes = HEADER.unpack(file.read(HEADER.size))
+            self.bloom_filter = BloomFilter.from_bytes(hashes, file.read())
+        self.position = position
+        return True
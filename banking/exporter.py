@@ -0,0 +1,202 @@
+# coding=utf-8
+"""Notification log exporter, streams every event of the Bank
+to a JSONL or CSV file, resuming from a saved position.
+
+    poetry run python -m banking.exporter events.jsonl
+    PERSISTENCE_MODULE=eventsourcing.sqlite SQLITE_DBNAME=mytest.db \\
+        poetry run python -m banking.exporter events.csv \\
+        --position-file events.pos --section-size 5000
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+import typing
+
+from eventsourcing.persistence import Notification
+
+from banking.applicationmodel import Bank
+
+COLUMNS = [
+    "id",
+    "originator_id",
+    "originator_version",
+    "topic",
+    "timestamp",
+    "state",
+]
+
+# Password hashes never leave the store.
+REDACTED_FIELDS = {"hashed_password", "new_hashed_password"}
+
+
+class ExportReport(typing.NamedTuple):
+    """Totals of an export"""
+
+    exported: int
+    position: int
+    seconds: float
+
+    @property
+    def rate(self) -> float:
+        """Events exported per second"""
+        return self.exported / self.seconds if self.seconds else 0.0
+
+
+def read_sections(
+    bank: Bank,
+    start: int = 1,
+    stop: typing.Optional[int] = None,
+    section_size: int = 1000,
+) -> typing.Iterator[typing.List[typing.Dict[str, typing.Any]]]:
+    """Lazily read the events of the notification log, one section
+    of at most section_size notifications at a time, so only one
+    section is held in memory
+
+    Args:
+        bank (Bank)
+        start (int): first notification id
+        stop (int, optional): last notification id
+        section_size (int)
+
+    Raises:
+        ValueError
+
+    Returns:
+        Iterator[List[Dict[str, Any]]]: a row of COLUMNS per event
+    """
+    if section_size < 1:
+        raise ValueError("Section size can't be less than 1")
+    while True:
+        notifications = bank.recorder.select_notifications(
+            start, section_size, stop=stop
+        )
+        if notifications:
+            yield [_to_row(bank, notice) for notice in notifications]
+        if len(notifications) < section_size:
+            return
+        start = notifications[-1].id + 1
+
+
+def _to_row(
+    bank: Bank, notification: Notification
+) -> typing.Dict[str, typing.Any]:
+    domain_event = bank.mapper.to_domain_event(notification)
+    state = {
+        key: value
+        for key, value in vars(domain_event).items()
+        if key not in REDACTED_FIELDS
+    }
+    return {
+        "id": notification.id,
+        "originator_id": str(state.pop("originator_id")),
+        "originator_version": state.pop("originator_version"),
+        "topic": notification.topic,
+        "timestamp": state.pop("timestamp").isoformat(),
+        "state": state,
+    }
+
+
+def export_events(
+    bank: Bank,
+    path: str,
+    file_format: str = "jsonl",
+    position_path: typing.Optional[str] = None,
+    section_size: int = 1000,
+    progress: typing.Optional[typing.Callable[[ExportReport], None]] = None,
+) -> ExportReport:
+    """Append the events of the notification log to a file, up to the
+    last event stored when the export starts. With a position file,
+    the id of the last event written is saved after each section and
+    the next export starts after it.
+
+    Args:
+        bank (Bank)
+        path (str)
+        file_format (str): "jsonl" or "csv"
+        position_path (str, optional)
+        section_size (int): notifications read per query
+        progress (Callable, optional): called with the totals after
+            each section
+
+    Raises:
+        ValueError
+
+    Returns:
+        ExportReport
+    """
+    if file_format not in ("jsonl", "csv"):
+        raise ValueError(f"Unknown file format: {file_format}")
+    position = 0
+    if position_path and os.path.exists(position_path):
+        with open(position_path) as position_file:
+            position = int(position_file.read().strip() or 0)
+    stop = bank.recorder.max_notification_id()
+
+    started = time.perf_counter()
+    exported = 0
+    with open(path, "a", newline="") as out:
+        writer = csv.DictWriter(out, COLUMNS)
+        if file_format == "csv" and out.tell() == 0:
+            writer.writeheader()
+        for rows in read_sections(bank, position + 1, stop, section_size):
+            for row in rows:
+                if file_format == "csv":
+                    state = json.dumps(row["state"], default=str)
+                    writer.writerow(dict(row, state=state))
+                else:
+                    out.write(json.dumps(row, default=str) + "\n")
+            exported += len(rows)
+            position = rows[-1]["id"]
+            out.flush()
+            if position_path:
+                _save_position(position_path, position)
+            if progress is not None:
+                seconds = time.perf_counter() - started
+                progress(ExportReport(exported, position, seconds))
+    return ExportReport(exported, position, time.perf_counter() - started)
+
+
+def _save_position(position_path: str, position: int) -> None:
+    temporary_path = position_path + ".tmp"
+    with open(temporary_path, "w") as position_file:
+        position_file.write(str(position))
+    os.replace(temporary_path, position_path)
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> ExportReport:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["jsonl", "csv"])
+    parser.add_argument("--position-file")
+    parser.add_argument("--section-size", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    file_format = args.format or args.path.rsplit(".", 1)[-1].lower()
+
+    def print_progress(report: ExportReport) -> None:
+        print(
+            f"exported={report.exported} position={report.position} "
+            f"rate={report.rate:.0f}/s",
+            flush=True,
+        )
+
+    # Exporting never checks a password, so no credential workers.
+    bank = Bank(env={Bank.CREDENTIAL_POOL_WORKERS: "0"})
+    report = export_events(
+        bank,
+        args.path,
+        file_format,
+        position_path=args.position_file,
+        section_size=args.section_size,
+        progress=print_progress,
+    )
+    bank.close()
+    print(f"done in {report.seconds:.2f}s")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+# coding=utf-8
+
+import typing
+from uuid import UUID
+
+from eventsourcing.application import (
+    Application,
+    NotificationLog,
+    ProcessingEvent,
+)
+from eventsourcing.domain import DomainEventProtocol
+from eventsourcing.persistence import Tracking, Transcoder
+from eventsourcing.system import Follower
+from eventsourcing.utils import Environment, EnvType
+
+from banking.domainmodel import Account, AccountShard
+from banking.transcoder import CompactTranscoder, TolerantZlibCompressor
+from banking.utils.custom_exceptions import AccountNotFoundError
+
+
+class AccountSummary(typing.NamedTuple):
+    """Row of the balances table"""
+
+    balance: int
+    is_closed: bool
+    overdraft_limit: int
+
+
+class AccountDelta(typing.NamedTuple):
+    """What a run of events did to an account"""
+
+    opened: bool
+    balance: int
+    is_closed: bool
+    overdraft_limit: typing.Optional[int]
+
+
+UNCHANGED = AccountDelta(
+    opened=False, balance=0, is_closed=False, overdraft_limit=None
+)
+
+
+def event_delta(
+    delta: AccountDelta, domain_event: typing.Any
+) -> typing.Optional[AccountDelta]:
+    """Add one event of an account to what its earlier events did
+
+    Args:
+        delta (AccountDelta): changes of the earlier events
+        domain_event (Any): event of the account or of one of its shards
+
+    Returns:
+        Optional[AccountDelta]: None if the event changes no row
+    """
+    if isinstance(domain_event, Account.Opened):
+        return AccountDelta(True, 0, False, 0)
+    if isinstance(
+        domain_event,
+        (Account.Credited, Account.TransferRefunded, AccountShard.Credited),
+    ):
+        return delta._replace(
+            balance=delta.balance + domain_event.amount_in_cents
+        )
+    if isinstance(
+        domain_event,
+        (Account.Debited, Account.TransferRequested, AccountShard.Swept),
+    ):
+        return delta._replace(
+            balance=delta.balance - domain_event.amount_in_cents
+        )
+    if isinstance(domain_event, Account.Closed):
+        return delta._replace(is_closed=True)
+    if isinstance(domain_event, Account.SetOverdraftLimit):
+        return delta._replace(overdraft_limit=domain_event.amount)
+    return None
+
+
+def apply_delta(
+    summary: typing.Optional[AccountSummary], delta: AccountDelta
+) -> typing.Optional[AccountSummary]:
+    """Apply the changes of a run of events to the row of an account
+
+    Args:
+        summary (Optional[AccountSummary]): current row, None if unknown
+        delta (AccountDelta)
+
+    Returns:
+        Optional[AccountSummary]: new row, None if the account is unknown
+    """
+    if delta.opened:
+        summary = AccountSummary(balance=0, is_closed=False, overdraft_limit=0)
+    if summary is None:
+        return None
+    return AccountSummary(
+        balance=summary.balance + delta.balance,
+        is_closed=summary.is_closed or delta.is_closed,
+        overdraft_limit=(
+            summary.overdraft_limit
+            if delta.overdraft_limit is None
+            else delta.overdraft_limit
+        ),
+    )
+
+
+def project_event(
+    summary: typing.Optional[AccountSummary], domain_event: typing.Any
+) -> typing.Optional[AccountSummary]:
+    """Evolve the summary of an account with one of its events
+
+    Args:
+        summary (Optional[AccountSummary]): current row, None if unknown
+        domain_event (Any): event of the account or of one of its shards
+
+    Returns:
+        Optional[AccountSummary]: new row, None if the account is unknown
+    """
+    delta = event_delta(UNCHANGED, domain_event)
+    if delta is None:
+        return summary
+    return apply_delta(summary, delta)
+
+
+class AccountBalances(Follower):
+    """
+    This is the balances read model, it follows
+    the notification log of the Bank and keeps an
+    account id -> balance/closed/overdraft table up
+    to date, so reading a balance is a keyed lookup
+    instead of an aggregate replay.
+
+    The table lives in memory, so the position in
+    the log is kept in memory as well, instead of
+    recording a tracking row per event, and the
+    projection catches up from the start of the
+    log whenever the process starts.
+
+    Events of the shards of a hot account go to the
+    row of the account that opened them.
+
+    Events of the Bank are read whatever transcoder
+    and compression it stores them with.
+    """
+
+    def __init__(self, env: typing.Optional[EnvType] = None) -> None:
+        super().__init__(env)
+        self.table: typing.Dict[UUID, AccountSummary] = {}
+        self.positions: typing.Dict[str, int] = {}
+        self.shard_owners: typing.Dict[UUID, UUID] = {}
+
+    def construct_env(
+        self, name: str, env: typing.Optional[EnvType] = None
+    ) -> Environment:
+        """Build the environment, keeping the projection off the disk
+
+        Args:
+            name (str): name of the application
+            env (EnvType, optional): explicit settings
+
+        Returns:
+            Environment
+        """
+        _env = super().construct_env(name, env)
+        _env[f"{self.name.upper()}_PERSISTENCE_MODULE"] = "eventsourcing.popo"
+        return _env
+
+    def construct_transcoder(self) -> Transcoder:
+        """Build a transcoder that reads compact and JSON states
+
+        Returns:
+            Transcoder
+        """
+        transcoder = CompactTranscoder()
+        self.register_transcodings(transcoder)
+        return transcoder
+
+    def follow(self, name: str, log: NotificationLog) -> None:
+        """Follow the log of an application, reading its event
+        states compressed or not
+
+        Args:
+            name (str): name of the followed application
+            log (NotificationLog)
+        """
+        super().follow(name, log)
+        self.mappers[name].compressor = TolerantZlibCompressor()
+
+    def pull_and_process(
+        self,
+        leader_name: str,
+        start: typing.Optional[int] = None,
+        stop: typing.Optional[int] = None,
+    ) -> None:
+        """Pull and project the new notifications of the leader
+
+        Args:
+            leader_name (str): name of the followed application
+            start (int, optional): first notification id to pull
+            stop (int, optional): last notification id to pull
+        """
+        if start is None:
+            start = self.positions.get(leader_name, 0) + 1
+        super().pull_and_process(leader_name, start=start, stop=stop)
+
+    def process_event(
+        self, domain_event: DomainEventProtocol, tracking: Tracking
+    ) -> None:
+        """Project one event and move the position past it
+
+        Args:
+            domain_event (DomainEventProtocol)
+            tracking (Tracking): position of the event in the leader log
+        """
+        with self.processing_lock:
+            self.policy(domain_event, ProcessingEvent(tracking))
+            self.positions[tracking.application_name] = (
+                tracking.notification_id
+            )
+
+    def policy(
+        self,
+        domain_event: DomainEventProtocol,
+        processing_event: ProcessingEvent,
+    ) -> None:
+        """Update the row of the account the event belongs to
+
+        Args:
+            domain_event (DomainEventProtocol)
+            processing_event (ProcessingEvent)
+        """
+        if isinstance(domain_event, AccountShard.Opened):
+            owner_id = domain_event.account_id
+            self.shard_owners[domain_event.originator_id] = owner_id
+            return
+        account_id = self.shard_owners.get(
+            domain_event.originator_id, domain_event.originator_id
+        )
+        summary = project_event(self.table.get(account_id), domain_event)
+        if summary is not None:
+            self.table[account_id] = summary
+
+    def get_summary(self, account_id: UUID) -> AccountSummary:
+        """Get the row of an account
+
+        Args:
+            account_id (UUID)
+
+        Raises:
+            AccountNotFoundError
+
+        Returns:
+            AccountSummary
+        """
+        try:
+            return self.table[account_id]
+        except KeyError:
+            raise AccountNotFoundError(f"Account with ID {account_id}")
+
+    def position(self, leader: Application) -> int:
+        """Id of the last notification of the leader projected so far
+
+        Args:
+            leader (Application): followed application
+
+        Returns:
+            int
+        """
+        return self.positions.get(leader.name, 0)
+
+    def lag(self, leader: Application) -> int:
+        """Number of notifications of the leader not projected yet
+
+        Args:
+            leader (Application): followed application
+
+        Returns:
+            int
+        """
+        head = leader.recorder.max_notification_id()
+        return max(head - self.position(leader), 0)
@@ -0,0 +1,344 @@
+# coding=utf-8
+"""Balances read model rebuild, projects ranges of the Bank
+notification log in a pool of processes and merges them in order.
+
+    poetry run python -m banking.rebuild --workers 0
+    PERSISTENCE_MODULE=eventsourcing.sqlite SQLITE_DBNAME=mytest.db \\
+        poetry run python -m banking.rebuild --workers 4 \\
+        --partition-size 100000 --checkpoint-dir rebuild
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import typing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from uuid import UUID
+
+from banking.applicationmodel import Bank
+from banking.domainmodel import AccountShard
+from banking.readmodel import (
+    UNCHANGED,
+    AccountBalances,
+    AccountDelta,
+    AccountSummary,
+    apply_delta,
+    event_delta,
+)
+
+# Bank of the store a worker process reads.
+_bank: typing.Optional[Bank] = None
+
+
+class Partition(typing.NamedTuple):
+    """Projection of a range of the notification log"""
+
+    events: int
+    shard_owners: typing.Dict[UUID, UUID]
+    deltas: typing.Dict[UUID, AccountDelta]
+
+
+class RebuildReport(typing.NamedTuple):
+    """Totals of a rebuild"""
+
+    events: int
+    partitions: int
+    seconds: float
+
+    @property
+    def rate(self) -> float:
+        """Events projected per second"""
+        return self.events / self.seconds if self.seconds else 0.0
+
+
+def project_range(
+    bank: Bank, start: int, stop: int, section_size: int = 1000
+) -> Partition:
+    """Project the notifications from start to stop on their own,
+    keeping balance changes as deltas so ranges can be merged
+
+    Args:
+        bank (Bank)
+        start (int): first notification id
+        stop (int): last notification id
+        section_size (int): notifications read per query
+
+    Returns:
+        Partition
+    """
+    events = 0
+    shard_owners: typing.Dict[UUID, UUID] = {}
+    deltas: typing.Dict[UUID, AccountDelta] = {}
+    while start <= stop:
+        notifications = bank.recorder.select_notifications(
+            start, section_size, stop=stop
+        )
+        for notification in notifications:
+            domain_event = bank.mapper.to_domain_event(notification)
+            originator_id = domain_event.originator_id
+            events += 1
+            if isinstance(domain_event, AccountShard.Opened):
+                shard_owners[originator_id] = domain_event.account_id
+                continue
+            delta = event_delta(
+                deltas.get(originator_id, UNCHANGED), domain_event
+            )
+            if delta is None:
+                continue
+            deltas[originator_id] = delta
+        if len(notifications) < section_size:
+            break
+        start = notifications[-1].id + 1
+    return Partition(events, shard_owners, deltas)
+
+
+def merge_partitions(
+    partitions: typing.Iterable[Partition],
+    table: typing.Optional[typing.Dict[UUID, AccountSummary]] = None,
+    shard_owners: typing.Optional[typing.Dict[UUID, UUID]] = None,
+) -> typing.Tuple[
+    typing.Dict[UUID, AccountSummary], typing.Dict[UUID, UUID]
+]:
+    """Apply partitions, in the order of their ranges, to a balances
+    table, giving the table a sequential projection would have
+
+    Args:
+        partitions (Iterable[Partition]): in log order
+        table (Dict[UUID, AccountSummary], optional): rows so far
+        shard_owners (Dict[UUID, UUID], optional): shards so far
+
+    Returns:
+        Tuple[Dict[UUID, AccountSummary], Dict[UUID, UUID]]
+    """
+    table = {} if table is None else table
+    shard_owners = {} if shard_owners is None else shard_owners
+    for partition in partitions:
+        shard_owners.update(partition.shard_owners)
+        # An account is opened before any other event of it or its
+        # shards, so openings are applied first.
+        for originator_id, delta in sorted(
+            partition.deltas.items(), key=lambda item: not item[1].opened
+        ):
+            account_id = shard_owners.get(originator_id, originator_id)
+            summary = apply_delta(table.get(account_id), delta)
+            if summary is not None:
+                table[account_id] = summary
+    return table, shard_owners
+
+
+def partition_ranges(
+    start: int, stop: int, partition_size: int
+) -> typing.List[typing.Tuple[int, int]]:
+    """Split notification ids from start to stop into ranges aligned
+    on partition_size, so a resumed rebuild finds the same ranges
+
+    Args:
+        start (int)
+        stop (int)
+        partition_size (int)
+
+    Raises:
+        ValueError
+
+    Returns:
+        List[Tuple[int, int]]
+    """
+    if partition_size < 1:
+        raise ValueError("Partition size can't be less than 1")
+    ranges = []
+    while start <= stop:
+        boundary = ((start - 1) // partition_size + 1) * partition_size
+        end = min(boundary, stop)
+        ranges.append((start, end))
+        start = end + 1
+    return ranges
+
+
+def rebuild_balances(
+    bank: Bank,
+    balances: AccountBalances,
+    workers: int = 0,
+    partition_size: int = 100000,
+    checkpoint_dir: typing.Optional[str] = None,
+    progress: typing.Optional[typing.Callable[[RebuildReport], None]] = None,
+) -> RebuildReport:
+    """Rebuild a balances read model from the start of the notification
+    log of the Bank to its head, ranges of partition_size
+    notifications are projected on workers processes and merged in
+    order. With a checkpoint directory, each projected range is saved
+    there and a later rebuild only projects the missing ones.
+
+    Args:
+        bank (Bank)
+        balances (AccountBalances): read model to fill, following the
+            Bank from the head afterwards
+        workers (int): processes, 0 projects in this process
+        partition_size (int)
+        checkpoint_dir (str, optional)
+        progress (Callable, optional): called with the totals after
+            each range
+
+    Raises:
+        ValueError
+
+    Returns:
+        RebuildReport
+    """
+    stop = bank.recorder.max_notification_id()
+    ranges = partition_ranges(1, stop, partition_size)
+    if checkpoint_dir:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    partitions: typing.Dict[typing.Tuple[int, int], Partition] = {}
+    missing = []
+    for notification_range in ranges:
+        path = _checkpoint_path(checkpoint_dir, notification_range)
+        if path and os.path.exists(path):
+            partitions[notification_range] = _load_partition(path)
+        else:
+            missing.append(notification_range)
+
+    started = time.perf_counter()
+    events = 0
+    for notification_range, partition in _project(bank, missing, workers):
+        partitions[notification_range] = partition
+        path = _checkpoint_path(checkpoint_dir, notification_range)
+        if path:
+            _save_partition(path, partition)
+        events += partition.events
+        if progress is not None:
+            seconds = time.perf_counter() - started
+            progress(RebuildReport(events, len(partitions), seconds))
+
+    with balances.processing_lock:
+        balances.table, balances.shard_owners = merge_partitions(
+            partitions[notification_range] for notification_range in ranges
+        )
+        balances.positions[bank.name] = stop
+    seconds = time.perf_counter() - started
+    return RebuildReport(events, len(partitions), seconds)
+
+
+def _project(
+    bank: Bank, ranges: typing.List[typing.Tuple[int, int]], workers: int
+) -> typing.Iterator[typing.Tuple[typing.Tuple[int, int], Partition]]:
+    """Project ranges, yielding each one as soon as it is done"""
+    if not workers:
+        for notification_range in ranges:
+            yield notification_range, project_range(bank, *notification_range)
+        return
+    # The workers open the store with the settings of the Bank.
+    env = dict(bank.env)
+    env[Bank.CREDENTIAL_POOL_WORKERS] = "0"
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_start_worker,
+        initargs=(env,),
+    ) as executor:
+        futures = {
+            executor.submit(_project_range, *notification_range): (
+                notification_range
+            )
+            for notification_range in ranges
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def _start_worker(env: typing.Mapping[str, str]) -> None:
+    """Open the Bank of a worker process"""
+    global _bank
+    _bank = Bank(env=dict(env))
+
+
+def _project_range(start: int, stop: int) -> Partition:
+    """Project a range of the notification log in a worker process"""
+    assert _bank is not None, "Not a worker process"
+    return project_range(_bank, start, stop)
+
+
+def _checkpoint_path(
+    checkpoint_dir: typing.Optional[str],
+    notification_range: typing.Tuple[int, int],
+) -> typing.Optional[str]:
+    if not checkpoint_dir:
+        return None
+    start, stop = notification_range
+    return os.path.join(checkpoint_dir, f"partition-{start}-{stop}.json")
+
+
+def _save_partition(path: str, partition: Partition) -> None:
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w") as partition_file:
+        json.dump(
+            {
+                "events": partition.events,
+                "shard_owners": {
+                    str(shard_id): str(owner_id)
+                    for shard_id, owner_id in partition.shard_owners.items()
+                },
+                "deltas": {
+                    str(originator_id): list(delta)
+                    for originator_id, delta in partition.deltas.items()
+                },
+            },
+            partition_file,
+        )
+    os.replace(temporary_path, path)
+
+
+def _load_partition(path: str) -> Partition:
+    with open(path) as partition_file:
+        data = json.load(partition_file)
+    return Partition(
+        events=data["events"],
+        shard_owners={
+            UUID(shard_id): UUID(owner_id)
+            for shard_id, owner_id in data["shard_owners"].items()
+        },
+        deltas={
+            UUID(originator_id): AccountDelta(*delta)
+            for originator_id, delta in data["deltas"].items()
+        },
+    )
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> RebuildReport:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--partition-size", type=int, default=100000)
+    parser.add_argument("--checkpoint-dir")
+    args = parser.parse_args(argv)
+
+    def print_progress(report: RebuildReport) -> None:
+        print(
+            f"events={report.events} partitions={report.partitions} "
+            f"rate={report.rate:.0f}/s",
+            flush=True,
+        )
+
+    # Rebuilding never checks a password, so no credential workers.
+    bank = Bank(env={Bank.CREDENTIAL_POOL_WORKERS: "0"})
+    balances = AccountBalances()
+    report = rebuild_balances(
+        bank,
+        balances,
+        workers=args.workers,
+        partition_size=args.partition_size,
+        checkpoint_dir=args.checkpoint_dir,
+        progress=print_progress,
+    )
+    bank.close()
+    total = sum(summary.balance for summary in balances.table.values())
+    print(
+        f"done in {report.seconds:.2f}s, {len(balances.table)} accounts "
+        f"holding {total}"
+    )
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# coding=utf-8
+"""Replay cost of the accounts of the Bank, loads every account from
+the store, without the aggregate cache, and lists the most expensive.
+
+    poetry run python -m banking.replayreport --top 20
+    PERSISTENCE_MODULE=eventsourcing.sqlite SQLITE_DBNAME=mytest.db \\
+        poetry run python -m banking.replayreport --top 20 --by seconds
+"""
+
+import argparse
+import typing
+from uuid import UUID
+
+from eventsourcing.utils import get_topic
+
+from banking.applicationmodel import Bank
+from banking.domainmodel import Account
+from banking.replaystats import (
+    SORT_KEYS,
+    TOP_SIZE,
+    AggregateReplays,
+    ReplayStats,
+)
+
+# Notifications read at a time when listing the accounts.
+SECTION_SIZE = 1000
+
+
+def account_ids(bank: Bank) -> typing.Iterator[UUID]:
+    """Ids of every account opened in the Bank, from its log
+
+    Args:
+        bank (Bank)
+
+    Returns:
+        Iterator[UUID]
+    """
+    topics = [get_topic(Account.Opened)]
+    start = 1
+    while True:
+        notifications = bank.recorder.select_notifications(
+            start, SECTION_SIZE, topics=topics
+        )
+        for notification in notifications:
+            yield notification.originator_id
+        if len(notifications) < SECTION_SIZE:
+            return
+        start = notifications[-1].id + 1
+
+
+def main(
+    argv: typing.Optional[typing.List[str]] = None,
+) -> typing.List[AggregateReplays]:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--by", choices=SORT_KEYS, default="events")
+    args = parser.parse_args(argv)
+
+    # Every load replays from the store, like the first one after a
+    # restart.
+    bank = Bank(
+        env={
+            Bank.AGGREGATE_CACHE_MAXSIZE: "",
+            Bank.CREDENTIAL_POOL_WORKERS: "0",
+        }
+    )
+    # Keep the --top most expensive accounts whatever the number of
+    # accounts loaded after them.
+    bank.replays = ReplayStats(
+        bank.replays.maxsize, top_size=max(args.top, TOP_SIZE)
+    )
+    for account_id in account_ids(bank):
+        bank.get_account(account_id)
+    top = bank.replays.top(args.top, args.by)
+    bank.close()
+
+    stats = bank.replays.stats()
+    print(
+        f"{stats['loads']} accounts, {stats['events']} events, "
+        f"{stats['events_per_load']:.1f} per load, "
+        f"{stats['snapshot_loads']} from snapshots, "
+        f"{stats['seconds']:.2f}s"
+    )
+    versions = stats["versions"].items()
+    print(
+        "versions: "
+        + ", ".join(f"{label}: {count}" for label, count in versions)
+    )
+    print(
+        f"{'account':>36} {'version':>8} {'events':>7} {'snapshot':>8} "
+        f"{'ms':>8} {'decode':>8}"
+    )
+    for replays in top:
+        snapshot = "yes" if replays.snapshot_loads else "no"
+        print(
+            f"{str(replays.aggregate_id):>36} {replays.version:>8} "
+            f"{replays.events:>7} {snapshot:>8} "
+            f"{replays.seconds * 1000:>8.2f} "
+            f"{replays.decode_seconds * 1000:>8.2f}"
+        )
+    return top
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+# coding=utf-8
+
+import heapq
+import threading
+import time
+import typing
+from collections import OrderedDict
+from uuid import UUID
+
+from eventsourcing.domain import DomainEventProtocol, Snapshot
+from eventsourcing.persistence import Mapper, StoredEvent
+
+# Upper bounds of the version distribution, the last bucket is open.
+VERSION_BUCKETS = (10, 100, 1000, 10000)
+
+SORT_KEYS = ("events", "seconds", "version", "loads")
+
+# Most expensive aggregates kept by each sort key.
+TOP_SIZE = 100
+
+
+class AggregateReplays(typing.NamedTuple):
+    """Replay cost of the loads of one aggregate"""
+
+    aggregate_id: UUID
+    loads: int
+    events: int
+    max_events: int
+    snapshot_loads: int
+    seconds: float
+    decode_seconds: float
+    version: int
+
+
+class _Load:
+    """Events decoded while a load runs on this thread"""
+
+    __slots__ = ("events", "snapshot", "full", "decode_seconds")
+
+    def __init__(self) -> None:
+        self.events = 0
+        self.snapshot = False
+        self.full = False
+        self.decode_seconds = 0.0
+
+
+_local = threading.local()
+
+
+class ReplayCountingMapper(Mapper):
+    """Mapper that counts, and times, the events it decodes for the
+    load running on the current thread (see ReplayStats.measure)
+    """
+
+    def to_domain_event(self, stored: StoredEvent) -> DomainEventProtocol:
+        """Decode a stored event
+
+        Args:
+            stored (StoredEvent)
+
+        Returns:
+            DomainEventProtocol
+        """
+        load: typing.Optional[_Load] = getattr(_local, "load", None)
+        if load is None:
+            return super().to_domain_event(stored)
+        started = time.perf_counter()
+        domain_event = super().to_domain_event(stored)
+        load.decode_seconds += time.perf_counter() - started
+        if isinstance(domain_event, Snapshot):
+            load.snapshot = True
+        else:
+            load.events += 1
+            load.full = load.full or domain_event.originator_version == 1
+        return domain_event
+
+
+class ReplayStats:
+    """
+    This records what the aggregate loads of the Bank
+    replay: events decoded, whether a snapshot was the
+    starting point, time spent decoding and loading
+    and the version reached. Totals cover every load,
+    per aggregate figures are kept for the maxsize
+    most recently loaded aggregates, and for the
+    top_size most expensive ones by each sort key,
+    however long ago they were loaded.
+
+    A load that starts from a snapshot or the first
+    event of its aggregate is a full load, the others
+    fast-forward a copy from the aggregate cache.
+    """
+
+    def __init__(
+        self, maxsize: int = 10000, top_size: int = TOP_SIZE
+    ) -> None:
+        self.maxsize = maxsize
+        self.top_size = top_size
+        self._aggregates: typing.OrderedDict[UUID, AggregateReplays]
+        self._aggregates = OrderedDict()
+        # Per sort key, the leading aggregates and a min-heap of their
+        # figures, with stale entries left behind by updates.
+        self._leaders: typing.Dict[
+            str, typing.Dict[UUID, AggregateReplays]
+        ] = {by: {} for by in SORT_KEYS}
+        self._heaps: typing.Dict[
+            str, typing.List[typing.Tuple[typing.Any, UUID]]
+        ] = {by: [] for by in SORT_KEYS}
+        self._totals = {
+            "loads": 0,
+            "full_loads": 0,
+            "snapshot_loads": 0,
+            "events": 0,
+        }
+        self._seconds = 0.0
+        self._lock = threading.Lock()
+
+    def measure(
+        self, aggregate_id: UUID, load: typing.Callable[[], typing.Any]
+    ) -> typing.Any:
+        """Load an aggregate and record what the load replayed
+
+        Args:
+            aggregate_id (UUID)
+            load (Callable[[], Any]): repository get of the aggregate
+
+        Returns:
+            Any: the aggregate
+        """
+        if getattr(_local, "load", None) is not None:
+            # Loads made while loading count for the outer one.
+            return load()
+        current = _local.load = _Load()
+        started = time.perf_counter()
+        try:
+            aggregate = load()
+        finally:
+            _local.load = None
+        self.record(
+            aggregate_id,
+            current.events,
+            current.snapshot,
+            current.full,
+            time.perf_counter() - started,
+            current.decode_seconds,
+            aggregate.version,
+        )
+        return aggregate
+
+    def record(
+        self,
+        aggregate_id: UUID,
+        events: int,
+        snapshot: bool,
+        full: bool,
+        seconds: float,
+        decode_seconds: float,
+        version: int,
+    ) -> None:
+        """Record one load
+
+        Args:
+            aggregate_id (UUID)
+            events (int): events replayed
+            snapshot (bool): started from a snapshot
+            full (bool): started from a snapshot or the first event
+            seconds (float): time to load
+            decode_seconds (float): part of it spent decoding
+            version (int): version of the loaded aggregate
+        """
+        with self._lock:
+            self._totals["loads"] += 1
+            self._totals["full_loads"] += full or snapshot
+            self._totals["snapshot_loads"] += snapshot
+            self._totals["events"] += events
+            self._seconds += seconds
+            if not self.maxsize:
+                return
+            previous = self._aggregates.pop(aggregate_id, None)
+            if previous is None:
+                previous = AggregateReplays(aggregate_id, 0, 0, 0, 0, 0, 0, 0)
+            replays = self._aggregates[aggregate_id] = AggregateReplays(
+                aggregate_id=aggregate_id,
+                loads=previous.loads + 1,
+                events=previous.events + events,
+                max_events=max(previous.max_events, events),
+                snapshot_loads=previous.snapshot_loads + snapshot,
+                seconds=previous.seconds + seconds,
+                decode_seconds=previous.decode_seconds + decode_seconds,
+                version=version,
+            )
+            if len(self._aggregates) > self.maxsize:
+                self._aggregates.popitem(last=False)
+            if self.top_size:
+                for by in SORT_KEYS:
+                    self._rank(by, replays)
+
+    def _rank(self, by: str, replays: AggregateReplays) -> None:
+        leaders, heap = self._leaders[by], self._heaps[by]
+        aggregate_id, value = replays.aggregate_id, getattr(replays, by)
+        current = leaders.get(aggregate_id)
+        if current is not None:
+            # Figures restart when an evicted aggregate loads again.
+            if value >= getattr(current, by):
+                leaders[aggregate_id] = replays
+                if value > getattr(current, by):
+                    heapq.heappush(heap, (value, aggregate_id))
+        elif len(leaders) < self.top_size:
+            leaders[aggregate_id] = replays
+            heapq.heappush(heap, (value, aggregate_id))
+        else:
+            while getattr(leaders[heap[0][1]], by) != heap[0][0]:
+                heapq.heappop(heap)
+            if value > heap[0][0]:
+                _, evicted = heapq.heapreplace(heap, (value, aggregate_id))
+                del leaders[evicted]
+                leaders[aggregate_id] = replays
+        if len(heap) > 2 * self.top_size:
+            # Drop the stale entries.
+            heap[:] = [
+                (getattr(leader, by), aggregate_id)
+                for aggregate_id, leader in leaders.items()
+            ]
+            heapq.heapify(heap)
+
+    def top(
+        self, n: int = 10, by: str = "events"
+    ) -> typing.List[AggregateReplays]:
+        """The aggregates that cost the most to load
+
+        Args:
+            n (int)
+            by (str): "events", "seconds", "version" or "loads"
+
+        Raises:
+            ValueError
+
+        Returns:
+            List[AggregateReplays]
+        """
+        if by not in SORT_KEYS:
+            raise ValueError(f"Can't sort replays by {by}")
+        with self._lock:
+            # A leader outranks the restarted figures of an aggregate
+            # loaded again after its eviction.
+            candidates = dict(self._aggregates)
+            for aggregate_id, leader in self._leaders[by].items():
+                recent = candidates.get(aggregate_id)
+                if recent is None or getattr(leader, by) > getattr(recent, by):
+                    candidates[aggregate_id] = leader
+        aggregates = list(candidates.values())
+        aggregates.sort(key=lambda replays: getattr(replays, by), reverse=True)
+        return aggregates[:n]
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        """Return the totals of every load and the distribution of the
+        versions of the tracked aggregates
+
+        Returns:
+            Dict[str, Any]
+        """
+        with self._lock:
+            stats: typing.Dict[str, typing.Any] = dict(self._totals)
+            stats["seconds"] = self._seconds
+            versions = [
+                replays.version for replays in self._aggregates.values()
+            ]
+        stats["events_per_load"] = (
+            stats["events"] / stats["loads"] if stats["loads"] else 0.0
+        )
+        labels = [f"<{bound}" for bound in VERSION_BUCKETS]
+        labels.append(f">={VERSION_BUCKETS[-1]}")
+        distribution = dict.fromkeys(labels, 0)
+        for version in versions:
+            index = sum(version >= bound for bound in VERSION_BUCKETS)
+            distribution[labels[index]] += 1
+        stats["versions"] = distribution
+        return stats
@@ -0,0 +1,486 @@
+# coding=utf-8
+
+import multiprocessing
+import os
+import threading
+import typing
+from concurrent.futures import Future, ProcessPoolExecutor
+from uuid import UUID
+
+from eventsourcing.application import AggregateNotFound
+from eventsourcing.system import SingleThreadedRunner, System
+
+from banking.applicationmodel import Bank, TransactionRecord, TransferResult
+from banking.emailindex import account_id_for
+from banking.readmodel import AccountBalances, AccountSummary
+from banking.utils.custom_exceptions import (
+    AccountClosedError,
+    TransactionError,
+)
+
+T = typing.TypeVar("T")
+
+SHARD_PLACEHOLDER = "{shard}"
+
+# Errors of a credit the destination shard rejected, so nothing of it
+# was saved and the debit can be given back.
+CREDIT_REJECTIONS = (AccountClosedError, AggregateNotFound, TransactionError)
+
+# Bank and balances read model of the shard a worker process owns.
+_runner: typing.Optional[SingleThreadedRunner] = None
+
+
+class InDoubtTransfer(typing.NamedTuple):
+    """Transfer across shards whose source was debited and whose
+    credit may or may not have been saved"""
+
+    source_id: UUID
+    destination_id: UUID
+    amount: int
+    error: str
+
+
+def shard_for(account_id: UUID, shards: int) -> int:
+    """Index of the shard that owns an account
+
+    Args:
+        account_id (UUID)
+        shards (int)
+
+    Returns:
+        int
+    """
+    return account_id.int % shards
+
+
+def shard_env(
+    env: typing.Mapping[str, str], index: int
+) -> typing.Dict[str, str]:
+    """Settings of a shard, every "{shard}" in the given settings and
+    in the process environment is replaced by the index of the shard,
+    so SQLITE_DBNAME=bank-{shard}.db gives each shard its own database.
+    Passwords are hashed in the shard process unless
+    CREDENTIAL_POOL_WORKERS says otherwise.
+
+    Args:
+        env (Mapping[str, str])
+        index (int)
+
+    Returns:
+        Dict[str, str]
+    """
+    merged = {Bank.CREDENTIAL_POOL_WORKERS: "0"}
+    merged.update(
+        (key, value)
+        for key, value in os.environ.items()
+        if SHARD_PLACEHOLDER in value
+    )
+    merged.update(env)
+    return {
+        key: value.replace(SHARD_PLACEHOLDER, str(index))
+        for key, value in merged.items()
+    }
+
+
+def _start_shard(env: typing.Mapping[str, str]) -> None:
+    """Start the Bank and balances read model of a worker process"""
+    global _runner
+    _runner = SingleThreadedRunner(
+        System(pipes=[[Bank, AccountBalances]]), env=dict(env)
+    )
+    _runner.start()
+    _runner.get(AccountBalances).pull_and_process(Bank.name)
+
+
+def _bank() -> Bank:
+    assert _runner is not None, "Not a shard process"
+    return _runner.get(Bank)
+
+
+def _balances() -> AccountBalances:
+    assert _runner is not None, "Not a shard process"
+    return _runner.get(AccountBalances)
+
+
+def _call(method: str, *args: typing.Any) -> typing.Any:
+    """Call a Bank method in the shard process"""
+    return getattr(_bank(), method)(*args)
+
+
+def _get_summary(account_id: UUID) -> AccountSummary:
+    """Read an account from the balances read model of the shard"""
+    return _balances().get_summary(account_id)
+
+
+def _projection() -> typing.Tuple[int, int]:
+    """Position and lag of the balances read model of the shard"""
+    return _balances().position(_bank()), _balances().lag(_bank())
+
+
+def _stop_shard() -> None:
+    """Close the Bank of the shard, saving its email index"""
+    _bank().close()
+
+
+class ShardedBank:
+    """
+    This partitions the accounts by the hash of their id
+    (see shard_for) across worker processes, each owning
+    its own Bank, store and balances read model, so the
+    domain logic of different accounts runs on as many
+    cores as there are shards. Every call is routed to
+    the shard that owns its account, and each shard runs
+    one call at a time.
+
+    A transfer between accounts of one shard runs there
+    in one unit of work. A transfer across shards runs
+    as a saga: the source shard debits, the destination
+    shard credits and, if the destination rejects the
+    credit, the source shard refunds the debit and the
+    error of the credit is raised. When the outcome of
+    the credit is unknown, like a worker that died after
+    saving it, nothing is refunded and the transfer is
+    kept in doubt (see in_doubt_transfers) for someone to
+    settle. The saga lives in the memory of the router,
+    so a router that dies between the debit and the
+    credit loses the amount in transit.
+
+    Requests with an Idempotency-Key are rejected, see
+    get_idempotent_response.
+
+    Settings of the shards come from the environment and
+    the given env, see shard_env.
+    """
+
+    def __init__(
+        self,
+        shards: int,
+        env: typing.Optional[typing.Mapping[str, str]] = None,
+    ) -> None:
+        if shards < 1:
+            raise ValueError("Shards can't be less than 1")
+        context = multiprocessing.get_context("spawn")
+        self.executors = [
+            ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=context,
+                initializer=_start_shard,
+                initargs=(shard_env(env or {}, index),),
+            )
+            for index in range(shards)
+        ]
+        self.balances = ShardedBalances(self)
+        self._stats_lock = threading.Lock()
+        self._transfer_stats = {
+            "local": 0,
+            "cross_shard": 0,
+            "compensated": 0,
+            "in_doubt": 0,
+        }
+        self._in_doubt: typing.List[InDoubtTransfer] = []
+
+    @property
+    def shards(self) -> int:
+        """Number of shards"""
+        return len(self.executors)
+
+    def submit(
+        self,
+        account_id: UUID,
+        func: typing.Callable[..., T],
+        *args: typing.Any,
+    ) -> "Future[T]":
+        """Run a function in the process of the shard of an account
+
+        Args:
+            account_id (UUID)
+            func (Callable): module level function of banking.sharding
+
+        Returns:
+            Future
+        """
+        index = shard_for(account_id, self.shards)
+        return self.executors[index].submit(func, *args)
+
+    def call(
+        self, account_id: UUID, method: str, *args: typing.Any
+    ) -> typing.Any:
+        """Call a Bank method on the shard of an account and wait for
+        its result, or its exception
+
+        Args:
+            account_id (UUID)
+            method (str)
+
+        Returns:
+            Any
+        """
+        return self.submit(account_id, _call, method, *args).result()
+
+    def run_unit_of_work(
+        self,
+        func: typing.Callable[..., T],
+        *args: typing.Any,
+        **kwargs: typing.Any,
+    ) -> T:
+        """Call func, each Bank call it makes runs in a unit of work of
+        its own shard
+
+        Args:
+            func (Callable)
+
+        Returns:
+            T: the result of func
+        """
+        return func(*args, **kwargs)
+
+    def get_account_id_by_email(self, email_address: str) -> UUID:
+        """See Bank.get_account_id_by_email"""
+        return account_id_for(email_address)
+
+    def open_account(
+        self, full_name: str, email_address: str, password: str
+    ) -> UUID:
+        """See Bank.open_account"""
+        return self.call(
+            account_id_for(email_address),
+            "open_account",
+            full_name,
+            email_address,
+            password,
+        )
+
+    def open_accounts(
+        self, applicants: typing.Iterable[typing.Tuple[str, str, str]]
+    ) -> typing.Tuple[typing.List[UUID], int]:
+        """See Bank.open_accounts, every shard opens its accounts at
+        the same time
+
+        Returns:
+            Tuple[List[UUID], int]: ids of the opened accounts, grouped
+                by shard, and number of duplicate emails skipped
+        """
+        batches: typing.Dict[int, typing.List[typing.Tuple[str, str, str]]]
+        batches = {}
+        for applicant in applicants:
+            index = shard_for(account_id_for(applicant[1]), self.shards)
+            batches.setdefault(index, []).append(applicant)
+        futures = [
+            self.executors[index].submit(_call, "open_accounts", batch)
+            for index, batch in sorted(batches.items())
+        ]
+        account_ids: typing.List[UUID] = []
+        duplicates = 0
+        for future in futures:
+            opened, skipped = future.result()
+            account_ids.extend(opened)
+            duplicates += skipped
+        return account_ids, duplicates
+
+    def authenticate(self, email_address: str, password: str) -> UUID:
+        """See Bank.authenticate"""
+        return self.call(
+            account_id_for(email_address),
+            "authenticate",
+            email_address,
+            password,
+        )
+
+    def close_account(self, account_id: UUID) -> None:
+        """See Bank.close_account"""
+        self.call(account_id, "close_account", account_id)
+
+    def get_balance(self, account_id: UUID) -> int:
+        """See Bank.get_balance"""
+        return self.call(account_id, "get_balance", account_id)
+
+    def get_transactions(
+        self,
+        account_id: UUID,
+        before: typing.Optional[int] = None,
+        limit: int = 50,
+    ) -> typing.Tuple[typing.List[TransactionRecord], typing.Optional[int]]:
+        """See Bank.get_transactions"""
+        return self.call(
+            account_id, "get_transactions", account_id, before, limit
+        )
+
+    def deposit_funds(self, account_id: UUID, amount: int) -> None:
+        """See Bank.deposit_funds"""
+        self.call(account_id, "deposit_funds", account_id, amount)
+
+    def withdraw_funds(self, account_id: UUID, amount: int) -> None:
+        """See Bank.withdraw_funds"""
+        self.call(account_id, "withdraw_funds", account_id, amount)
+
+    def transfer_funds(
+        self,
+        source_account_id: UUID,
+        destination_account_id: UUID,
+        amount: int,
+    ) -> None:
+        """Function used to transfer cash from your account to other,
+        in a saga when the accounts live on different shards
+
+        Args:
+            source_account_id (UUID)
+            destination_account_id (UUID)
+            amount (int)
+
+        Raises:
+            TransactionError
+        """
+        if source_account_id == destination_account_id:
+            raise TransactionError("Cannot transfer to the same account")
+        source = shard_for(source_account_id, self.shards)
+        if source == shard_for(destination_account_id, self.shards):
+            self.call(
+                source_account_id,
+                "transfer_funds",
+                source_account_id,
+                destination_account_id,
+                amount,
+            )
+            self._count("local")
+            return
+
+        self._count("cross_shard")
+        self.call(
+            source_account_id, "withdraw_funds", source_account_id, amount
+        )
+        try:
+            self.deposit_funds(destination_account_id, amount)
+        except CREDIT_REJECTIONS:
+            self.call(
+                source_account_id, "refund_funds", source_account_id, amount
+            )
+            self._count("compensated")
+            raise
+        except Exception as error:
+            # The credit may have been saved, a refund could create money.
+            with self._stats_lock:
+                self._in_doubt.append(
+                    InDoubtTransfer(
+                        source_account_id,
+                        destination_account_id,
+                        amount,
+                        repr(error),
+                    )
+                )
+            self._count("in_doubt")
+            raise
+
+    def transfer_funds_batch(
+        self,
+        transfers: typing.Sequence[typing.Tuple[UUID, UUID, int]],
+        atomic: bool = True,
+    ) -> typing.List[TransferResult]:
+        """See Bank.transfer_funds_batch. A batch runs on one shard
+        when all of its accounts live there, otherwise each transfer
+        runs on its own, which can't be all-or-nothing.
+
+        Raises:
+            TransactionError
+
+        Returns:
+            List[TransferResult]
+        """
+        shards = {
+            shard_for(account_id, self.shards)
+            for transfer in transfers
+            for account_id in transfer[:2]
+        }
+        if len(shards) <= 1:
+            account_id = transfers[0][0] if transfers else UUID(int=0)
+            return self.call(
+                account_id, "transfer_funds_batch", transfers, atomic
+            )
+        if atomic:
+            raise TransactionError(
+                "Atomic batches can't span accounts of different shards"
+            )
+        results = []
+        for transfer in transfers:
+            try:
+                self.transfer_funds(*transfer)
+            except Exception as error:
+                results.append(TransferResult("failed", str(error)))
+            else:
+                results.append(TransferResult("success"))
+        return results
+
+    def get_idempotent_response(
+        self, account_id: UUID, key: str, fingerprint: str
+    ) -> typing.Optional[typing.Tuple[typing.Dict[str, typing.Any], int]]:
+        """Reject idempotency keys: the lookup, the changes and the save
+        of a request would be separate shard calls, so concurrent
+        retries could apply the changes twice
+
+        Raises:
+            TransactionError
+        """
+        raise TransactionError(
+            "Idempotency-Key is not supported on a sharded Bank"
+        )
+
+    def transfer_stats(self) -> typing.Dict[str, int]:
+        """Return how many transfers ran on one shard, how many ran
+        across shards and how many of those were compensated or left
+        in doubt
+
+        Returns:
+            Dict[str, int]
+        """
+        with self._stats_lock:
+            return dict(self._transfer_stats)
+
+    def in_doubt_transfers(self) -> typing.List[InDoubtTransfer]:
+        """Return the transfers across shards whose source was debited
+        and whose credit failed with an unknown outcome, they were not
+        refunded
+
+        Returns:
+            List[InDoubtTransfer]
+        """
+        with self._stats_lock:
+            return list(self._in_doubt)
+
+    def _count(self, counter: str) -> None:
+        with self._stats_lock:
+            self._transfer_stats[counter] += 1
+
+    def close(self) -> None:
+        """Close the Bank of every shard and stop the workers"""
+        for future in [
+            executor.submit(_stop_shard) for executor in self.executors
+        ]:
+            future.result()
+        for executor in self.executors:
+            executor.shutdown()
+
+
+class ShardedBalances:
+    """The balances read models of the shards of a ShardedBank, read
+    like a single AccountBalances
+    """
+
+    def __init__(self, bank: ShardedBank) -> None:
+        self.bank = bank
+
+    def get_summary(self, account_id: UUID) -> AccountSummary:
+        """See AccountBalances.get_summary"""
+        return self.bank.submit(account_id, _get_summary, account_id).result()
+
+    def position(self, leader: typing.Any = None) -> int:
+        """Sum of the positions of the shards in their Bank logs"""
+        return sum(position for position, _ in self._projections())
+
+    def lag(self, leader: typing.Any = None) -> int:
+        """Sum of the events the shards have not projected yet"""
+        return sum(lag for _, lag in self._projections())
+
+    def _projections(self) -> typing.List[typing.Tuple[int, int]]:
+        futures = [
+            executor.submit(_projection) for executor in self.bank.executors
+        ]
+        return [future.result() for future in futures]
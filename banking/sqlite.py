@@ -0,0 +1,350 @@
+# coding=utf-8
+"""SQLite persistence tuned for the threaded API, select it with
+PERSISTENCE_MODULE=banking.sqlite instead of eventsourcing.sqlite
+"""
+
+import sqlite3
+import threading
+import time
+import typing
+
+import eventsourcing.sqlite as sqlite
+from eventsourcing.persistence import (
+    IntegrityError,
+    PersistenceError,
+    ProcessRecorder,
+    StoredEvent,
+)
+from eventsourcing.utils import Environment
+
+SYNCHRONOUS_LEVELS = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+
+class TunedSQLiteConnectionPool(sqlite.SQLiteConnectionPool):
+    """Connection pool that sets the pragmas of the profile on every
+    connection it opens"""
+
+    def __init__(
+        self, pragmas: typing.Dict[str, str], **kwargs: typing.Any
+    ) -> None:
+        self.pragmas = pragmas
+        super().__init__(**kwargs)
+
+    def _create_connection(self) -> sqlite.SQLiteConnection:
+        connection = super()._create_connection()
+        for name, value in self.pragmas.items():
+            connection._sqlite_conn.execute(f"PRAGMA {name}={value}")
+        return connection
+
+
+class TunedSQLiteDatastore(sqlite.SQLiteDatastore):
+    """Datastore on a TunedSQLiteConnectionPool"""
+
+    def __init__(
+        self, pragmas: typing.Dict[str, str], **kwargs: typing.Any
+    ) -> None:
+        super().__init__(**kwargs)
+        # The plain pool of the parent never opened a connection.
+        self.pool = TunedSQLiteConnectionPool(pragmas, **kwargs)
+
+
+class _Write:
+    """Events of one save, waiting for the group commit"""
+
+    __slots__ = ("stored_events", "kwargs", "done", "result", "error")
+
+    def __init__(
+        self,
+        stored_events: typing.List[StoredEvent],
+        kwargs: typing.Dict[str, typing.Any],
+    ) -> None:
+        self.stored_events = stored_events
+        self.kwargs = kwargs
+        self.done = threading.Event()
+        self.result: typing.Optional[typing.Sequence[int]] = None
+        self.error: typing.Optional[BaseException] = None
+
+
+class GroupCommitSQLiteProcessRecorder(sqlite.SQLiteProcessRecorder):
+    """
+    This is the recorder of the Bank with group commit,
+    saves from concurrent threads are handed to one
+    writer thread that inserts up to max_size of them
+    in a single transaction, each in a savepoint of
+    its own. A save that conflicts rolls back to its
+    savepoint and raises in its caller only, the rest
+    of the group still commits.
+
+    The writer takes whatever saves queued while the
+    previous transaction committed, waiting window
+    seconds for more first when window is positive.
+    Callers return once the transaction is committed,
+    so a save is as durable as without group commit.
+
+    Should the writer stop, the saves still queued
+    fail with a PersistenceError and the next ones
+    are committed on their own.
+    """
+
+    def __init__(
+        self,
+        datastore: sqlite.SQLiteDatastore,
+        events_table_name: str = "stored_events",
+        max_size: int = 64,
+        window: float = 0.0,
+    ) -> None:
+        super().__init__(datastore, events_table_name)
+        self.max_size = max_size
+        self.window = window
+        self._queue: typing.List[_Write] = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._writer = threading.Thread(
+            target=self._run, name="group-commit", daemon=True
+        )
+        self._writer.start()
+
+    def insert_events(
+        self, stored_events: typing.List[StoredEvent], **kwargs: typing.Any
+    ) -> typing.Optional[typing.Sequence[int]]:
+        """Insert the events of a save in the next group commit
+
+        Args:
+            stored_events (List[StoredEvent])
+
+        Raises:
+            IntegrityError: the save lost a version conflict
+            PersistenceError
+
+        Returns:
+            Optional[Sequence[int]]: notification ids of the events
+        """
+        write = _Write(stored_events, kwargs)
+        with self._condition:
+            if self._closed:
+                return super().insert_events(stored_events, **kwargs)
+            self._queue.append(write)
+            self._condition.notify()
+        write.done.wait()
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def close(self) -> None:
+        """Commit the queued saves and stop the writer thread"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._writer.join()
+
+    def _run(self) -> None:
+        try:
+            while True:
+                with self._condition:
+                    while not self._queue and not self._closed:
+                        self._condition.wait()
+                    if not self._queue:
+                        return
+                if self.window:
+                    time.sleep(self.window)
+                with self._condition:
+                    batch = self._queue[: self.max_size]
+                    del self._queue[: self.max_size]
+                self._commit(batch)
+        finally:
+            with self._condition:
+                self._closed = True
+                pending, self._queue = self._queue, []
+            for write in pending:
+                write.error = PersistenceError("Group commit writer stopped")
+                write.done.set()
+
+    def _commit(self, batch: typing.List[_Write]) -> None:
+        try:
+            with self.datastore.transaction(commit=True) as c:
+                for write in batch:
+                    c.execute("SAVEPOINT write")
+                    try:
+                        write.result = self._insert_events(
+                            c, write.stored_events, **write.kwargs
+                        )
+                    except sqlite3.IntegrityError as e:
+                        c.execute("ROLLBACK TO write")
+                        write.error = IntegrityError(e)
+                    c.execute("RELEASE write")
+        except BaseException as e:
+            # Nothing of the group was committed.
+            error = e
+            if not isinstance(e, Exception):
+                error = PersistenceError("Group commit was interrupted")
+            for write in batch:
+                write.result, write.error = None, write.error or error
+            if error is not e:
+                raise
+        finally:
+            for write in batch:
+                write.done.set()
+
+
+class Factory(sqlite.Factory):
+    """
+    This is the eventsourcing SQLite factory with a
+    profile for the Bank: WAL journaling, synchronous
+    SQLITE_SYNCHRONOUS (FULL syncs the WAL on every
+    commit, NORMAL only at checkpoints, so it is faster
+    but can lose the last commits on a power loss),
+    SQLITE_MMAP_SIZE bytes of memory
+    mapped reads, a page cache of SQLITE_CACHE_SIZE
+    (pages, or KiB when negative) and writers waiting
+    SQLITE_LOCK_TIMEOUT seconds for a lock.
+
+    Writers take turns on one connection, readers get
+    one of SQLITE_POOL_SIZE pooled connections, plus
+    up to SQLITE_MAX_OVERFLOW more under load, and
+    wait at most SQLITE_POOL_TIMEOUT seconds for it.
+
+    Saves are group committed (see
+    GroupCommitSQLiteProcessRecorder), at most
+    SQLITE_GROUP_COMMIT_SIZE per transaction (0 commits
+    every save on its own), waiting
+    SQLITE_GROUP_COMMIT_WINDOW milliseconds for more.
+
+    Settings are validated, and the pragmas checked on
+    a first connection, when the Bank starts.
+    """
+
+    SQLITE_SYNCHRONOUS = "SQLITE_SYNCHRONOUS"
+    SQLITE_MMAP_SIZE = "SQLITE_MMAP_SIZE"
+    SQLITE_CACHE_SIZE = "SQLITE_CACHE_SIZE"
+    SQLITE_POOL_SIZE = "SQLITE_POOL_SIZE"
+    SQLITE_MAX_OVERFLOW = "SQLITE_MAX_OVERFLOW"
+    SQLITE_POOL_TIMEOUT = "SQLITE_POOL_TIMEOUT"
+    SQLITE_GROUP_COMMIT_SIZE = "SQLITE_GROUP_COMMIT_SIZE"
+    SQLITE_GROUP_COMMIT_WINDOW = "SQLITE_GROUP_COMMIT_WINDOW"
+
+    defaults = {
+        SQLITE_SYNCHRONOUS: "FULL",
+        SQLITE_MMAP_SIZE: "268435456",
+        SQLITE_CACHE_SIZE: "-65536",
+        sqlite.Factory.SQLITE_LOCK_TIMEOUT: "5",
+        SQLITE_POOL_SIZE: "8",
+        SQLITE_MAX_OVERFLOW: "8",
+        SQLITE_POOL_TIMEOUT: "5",
+        SQLITE_GROUP_COMMIT_SIZE: "64",
+        SQLITE_GROUP_COMMIT_WINDOW: "0",
+    }
+
+    def __init__(self, env: Environment) -> None:
+        super().__init__(env)
+        synchronous = self._setting(self.SQLITE_SYNCHRONOUS).upper()
+        if synchronous not in SYNCHRONOUS_LEVELS:
+            raise EnvironmentError(
+                f"SQLite environment value for key "
+                f"'{self.SQLITE_SYNCHRONOUS}' is invalid, expected one "
+                f"of {', '.join(SYNCHRONOUS_LEVELS)}: '{synchronous}'"
+            )
+        pragmas = {
+            "synchronous": synchronous,
+            "mmap_size": str(self._int_setting(self.SQLITE_MMAP_SIZE, 0)),
+            "cache_size": str(self._int_setting(self.SQLITE_CACHE_SIZE)),
+        }
+        # The plain datastore of the parent never opened a connection.
+        self.datastore.close()
+        self.datastore = TunedSQLiteDatastore(
+            pragmas,
+            db_name=self.env.get(self.SQLITE_DBNAME),
+            lock_timeout=self._int_setting(self.SQLITE_LOCK_TIMEOUT, 1),
+            pool_size=self._int_setting(self.SQLITE_POOL_SIZE, 1),
+            max_overflow=self._int_setting(self.SQLITE_MAX_OVERFLOW, 0),
+            pool_timeout=self._float_setting(self.SQLITE_POOL_TIMEOUT),
+        )
+        self.group_commit_size = self._int_setting(
+            self.SQLITE_GROUP_COMMIT_SIZE, 0
+        )
+        self.group_commit_window = (
+            self._float_setting(self.SQLITE_GROUP_COMMIT_WINDOW, zero=True)
+            / 1000
+        )
+        self._group_recorders: typing.List[
+            GroupCommitSQLiteProcessRecorder
+        ] = []
+        self._check_pragmas(pragmas)
+
+    def process_recorder(self) -> ProcessRecorder:
+        """Build the process recorder, group committing when
+        SQLITE_GROUP_COMMIT_SIZE is positive
+
+        Returns:
+            ProcessRecorder
+        """
+        if not self.group_commit_size:
+            return super().process_recorder()
+        recorder = GroupCommitSQLiteProcessRecorder(
+            datastore=self.datastore,
+            max_size=self.group_commit_size,
+            window=self.group_commit_window,
+        )
+        if self.env_create_table():
+            recorder.create_table()
+        self._group_recorders.append(recorder)
+        return recorder
+
+    def close(self) -> None:
+        """Stop the group commits, then close the connections"""
+        for recorder in self._group_recorders:
+            recorder.close()
+        super().close()
+
+    def _setting(self, key: str) -> str:
+        return (self.env.get(key) or "").strip() or self.defaults[key]
+
+    def _int_setting(
+        self, key: str, minimum: typing.Optional[int] = None
+    ) -> int:
+        value = self._setting(key)
+        expected = "an int" if minimum is None else f"an int >= {minimum}"
+        number: typing.Optional[int]
+        try:
+            number = int(value)
+        except ValueError:
+            number = None
+        if number is None or (minimum is not None and number < minimum):
+            raise EnvironmentError(
+                f"SQLite environment value for key '{key}' is invalid, "
+                f"expected {expected}: '{value}'"
+            )
+        return number
+
+    def _float_setting(self, key: str, zero: bool = False) -> float:
+        value = self._setting(key)
+        expected = "a number >= 0" if zero else "a positive number"
+        try:
+            number = float(value)
+        except ValueError:
+            number = -1.0
+        if not number >= 0 or not (zero or number):
+            raise EnvironmentError(
+                f"SQLite environment value for key '{key}' is invalid, "
+                f"expected {expected}: '{value}'"
+            )
+        return number
+
+    def _check_pragmas(self, pragmas: typing.Dict[str, str]) -> None:
+        """Open a first connection and check that SQLite applied the
+        journal mode and synchronous level
+
+        Raises:
+            EnvironmentError
+        """
+        level = SYNCHRONOUS_LEVELS.index(pragmas["synchronous"])
+        expected: typing.Dict[str, typing.Any] = {"synchronous": level}
+        if not self.datastore.pool.is_sqlite_memory_mode:
+            expected["journal_mode"] = "wal"
+        with self.datastore.get_connection(commit=False) as connection:
+            cursor = connection._sqlite_conn.cursor()
+            for name, value in expected.items():
+                actual = cursor.execute(f"PRAGMA {name}").fetchone()[0]
+                if actual != value:
+                    raise EnvironmentError(
+                        f"SQLite {name} is {actual}, expected {value}"
+                    )
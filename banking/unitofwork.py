@@ -0,0 +1,103 @@
+# coding=utf-8
+
+import typing
+from uuid import UUID
+
+from eventsourcing.application import Repository
+from eventsourcing.domain import Aggregate
+
+from banking.utils.concurrency import StripedLock
+from banking.utils.custom_exceptions import AccountBusyError
+
+
+class UnitOfWork:
+    """
+    This is the identity map of a request, every
+    aggregate is loaded from the repository once
+    and the same object is handed to every Bank
+    method that asks for it again. Aggregates
+    saved during the unit of work are collected
+    and committed together when it ends.
+
+    With striped locks, the lock of every loaded
+    aggregate is held until the unit of work is
+    released. Locks are taken in load order, so
+    waiting longer than lock_timeout raises
+    AccountBusyError instead of risking a deadlock.
+    """
+
+    def __init__(
+        self,
+        repository: Repository,
+        locks: typing.Optional[StripedLock] = None,
+        lock_timeout: float = 1.0,
+    ) -> None:
+        self.repository = repository
+        self.locks = locks
+        self.lock_timeout = lock_timeout
+        self.held_stripes: typing.Set[int] = set()
+        self.loaded: typing.Dict[UUID, Aggregate] = {}
+        self.pending: typing.Dict[UUID, Aggregate] = {}
+        self.loads = 0
+        self.loads_avoided = 0
+
+    def get(self, aggregate_id: UUID) -> typing.Any:
+        """Get an aggregate, loading it only the first time
+
+        Args:
+            aggregate_id (UUID)
+
+        Raises:
+            AggregateNotFound
+            AccountBusyError
+
+        Returns:
+            Any: the aggregate
+        """
+        try:
+            aggregate = self.loaded[aggregate_id]
+        except KeyError:
+            self._lock(aggregate_id)
+            aggregate = self.repository.get(aggregate_id)
+            self.loaded[aggregate_id] = aggregate
+            self.loads += 1
+        else:
+            self.loads_avoided += 1
+        return aggregate
+
+    def add(self, *aggregates: Aggregate) -> None:
+        """Register aggregates to be saved at commit
+
+        Args:
+            aggregates (Aggregate)
+        """
+        for aggregate in aggregates:
+            self.loaded[aggregate.id] = aggregate
+            self.pending[aggregate.id] = aggregate
+
+    def forget(self, *aggregate_ids: UUID) -> None:
+        """Drop aggregates from the identity map and the pending saves
+
+        Args:
+            aggregate_ids (UUID)
+        """
+        for aggregate_id in aggregate_ids:
+            self.loaded.pop(aggregate_id, None)
+            self.pending.pop(aggregate_id, None)
+
+    def release(self) -> None:
+        """Release every lock held by the unit of work"""
+        if self.locks is not None:
+            for stripe in self.held_stripes:
+                self.locks.release(stripe)
+        self.held_stripes.clear()
+
+    def _lock(self, aggregate_id: UUID) -> None:
+        if self.locks is None:
+            return
+        stripe = self.locks.stripe(aggregate_id)
+        if stripe in self.held_stripes:
+            return
+        if not self.locks.acquire(stripe, self.lock_timeout):
+            raise AccountBusyError(aggregate_id)
+        self.held_stripes.add(stripe)
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import typing
+from functools import partial
+from http import HTTPStatus
+from urllib.parse import unquote
+
+Message = typing.Dict[str, typing.Any]
+Receive = typing.Callable[[], typing.Awaitable[Message]]
+Send = typing.Callable[[Message], typing.Awaitable[None]]
+ASGIApp = typing.Callable[
+    [typing.Dict[str, typing.Any], Receive, Send], typing.Awaitable[None]
+]
+
+MAX_HEADER_LINES = 100
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class RequestRejected(Exception):
+    """Exception used to answer a request the server can't read with
+    an error status, and close its connection"""
+
+    def __init__(self, status: int) -> None:
+        self.status = status
+        super().__init__(status)
+
+
+async def start_server(
+    app: ASGIApp, host: str = "127.0.0.1", port: int = 8000
+) -> asyncio.AbstractServer:
+    """Serve an ASGI app over HTTP/1.1 with keep-alive connections.
+    This is a minimal server for tests and benchmarks: bodies need a
+    Content-Length of at most MAX_BODY_SIZE bytes, and any
+    Transfer-Encoding is rejected with a 501. Serve the app with
+    uvicorn or hypercorn in production.
+
+    Args:
+        app (ASGIApp)
+        host (str)
+        port (int): 0 picks a free port
+
+    Returns:
+        asyncio.AbstractServer
+    """
+    return await asyncio.start_server(
+        partial(handle_connection, app), host, port, backlog=4096
+    )
+
+
+async def handle_connection(
+    app: ASGIApp,
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+) -> None:
+    """Answer the requests of a connection until the client closes it
+    or asks to
+
+    Args:
+        app (ASGIApp)
+        reader (asyncio.StreamReader)
+        writer (asyncio.StreamWriter)
+    """
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            try:
+                method, target, version, headers = await _read_head(
+                    reader, request_line
+                )
+                length = _content_length(headers)
+            except RequestRejected as rejected:
+                await _write(
+                    writer, rejected.status, [], b"", keep_alive=False
+                )
+                break
+            body = await reader.readexactly(length)
+            connection = dict(headers).get(b"connection", b"").lower()
+            keep_alive = (
+                connection != b"close"
+                if version == "HTTP/1.1"
+                else connection == b"keep-alive"
+            )
+            path, _, query = target.partition("?")
+            scope = {
+                "type": "http",
+                "asgi": {"version": "3.0"},
+                "http_version": version[5:],
+                "method": method,
+                "scheme": "http",
+                "path": unquote(path),
+                "raw_path": path.encode(),
+                "query_string": query.encode(),
+                "root_path": "",
+                "headers": headers,
+                "server": writer.get_extra_info("sockname")[:2],
+                "client": writer.get_extra_info("peername")[:2],
+            }
+            try:
+                status, response_headers, response_body = await _call(
+                    app, scope, body
+                )
+            except Exception:
+                logging.exception("ASGI app failed")
+                await _write(writer, 500, [], b"", keep_alive=False)
+                break
+            await _write(
+                writer, status, response_headers, response_body, keep_alive
+            )
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _read_head(
+    reader: asyncio.StreamReader, request_line: bytes
+) -> typing.Tuple[str, str, str, typing.List[typing.Tuple[bytes, bytes]]]:
+    """Method, target, HTTP version and headers of a request
+
+    Raises:
+        RequestRejected: 400 when malformed
+    """
+    try:
+        method, target, version = (
+            request_line.decode("latin-1").rstrip("\r\n").split(" ")
+        )
+        return method, target, version, await _read_headers(reader)
+    except ValueError:
+        raise RequestRejected(400)
+
+
+async def _read_headers(
+    reader: asyncio.StreamReader,
+) -> typing.List[typing.Tuple[bytes, bytes]]:
+    headers = []
+    for _ in range(MAX_HEADER_LINES):
+        line = await reader.readline()
+        if not line.strip():
+            return headers
+        name, separator, value = line.partition(b":")
+        if not separator:
+            raise ValueError("Malformed header")
+        headers.append((name.strip().lower(), value.strip()))
+    raise ValueError("Too many headers")
+
+
+def _content_length(headers: typing.List[typing.Tuple[bytes, bytes]]) -> int:
+    """Length of the body of a request
+
+    Raises:
+        RequestRejected: 501 for any Transfer-Encoding, 413 for a body
+            over MAX_BODY_SIZE, 400 for a malformed or repeated length
+    """
+    if any(name == b"transfer-encoding" for name, _ in headers):
+        raise RequestRejected(501)
+    lengths = [value for name, value in headers if name == b"content-length"]
+    if not lengths:
+        return 0
+    if len(lengths) > 1 or not lengths[0].isdigit():
+        raise RequestRejected(400)
+    length = int(lengths[0])
+    if length > MAX_BODY_SIZE:
+        raise RequestRejected(413)
+    return length
+
+
+async def _call(
+    app: ASGIApp, scope: typing.Dict[str, typing.Any], body: bytes
+) -> typing.Tuple[int, typing.List[typing.Tuple[bytes, bytes]], bytes]:
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    response: Message = {"status": 500, "headers": []}
+    chunks: typing.List[bytes] = []
+
+    async def receive() -> Message:
+        return messages.pop() if messages else {"type": "http.disconnect"}
+
+    async def send(message: Message) -> None:
+        if message["type"] == "http.response.start":
+            response.update(message)
+        else:
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return response["status"], response["headers"], b"".join(chunks)
+
+
+async def _write(
+    writer: asyncio.StreamWriter,
+    status: int,
+    headers: typing.List[typing.Tuple[bytes, bytes]],
+    body: bytes,
+    keep_alive: bool,
+) -> None:
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}".encode()]
+    lines += [
+        name + b": " + value
+        for name, value in headers
+        if name.lower() not in (b"content-length", b"connection")
+    ]
+    lines.append(b"Content-Length: %d" % len(body))
+    lines.append(b"Connection: " + (b"keep-alive" if keep_alive else b"close"))
+    writer.write(b"\r\n".join(lines) + b"\r\n\r\n" + body)
+    await writer.drain()
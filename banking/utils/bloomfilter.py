@@ -0,0 +1,63 @@
+import math
+from hashlib import blake2b
+from threading import Lock
+from typing import Iterator
+
+
+class BloomFilter:
+    """Probabilistic set of byte strings, it never gives false
+    negatives and gives false positives at about error_rate
+    while holding no more than capacity keys
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001) -> None:
+        if capacity < 1:
+            raise ValueError("Capacity can't be less than 1")
+        if not 0 < error_rate < 1:
+            raise ValueError("Error rate must be between 0 and 1")
+        size = -capacity * math.log(error_rate) / math.log(2) ** 2
+        self.size = max(8, int(math.ceil(size / 8)) * 8)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(self.size // 8)
+        self._lock = Lock()
+
+    @classmethod
+    def from_bytes(cls, hashes: int, bits: bytes) -> "BloomFilter":
+        """Restore a filter saved with its hashes and bits
+
+        Args:
+            hashes (int): number of hash functions
+            bits (bytes)
+
+        Returns:
+            BloomFilter
+        """
+        bloom_filter = cls.__new__(cls)
+        bloom_filter.size = len(bits) * 8
+        bloom_filter.hashes = hashes
+        bloom_filter.bits = bytearray(bits)
+        bloom_filter._lock = Lock()
+        return bloom_filter
+
+    def _positions(self, key: bytes) -> Iterator[int]:
+        digest = blake2b(key, digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "big")
+        second = int.from_bytes(digest[8:], "big") | 1
+        for number in range(self.hashes):
+            yield (first + number * second) % self.size
+
+    def add(self, key: bytes) -> None:
+        """Add a key to the filter
+
+        Args:
+            key (bytes)
+        """
+        with self._lock:
+            for position in self._positions(key):
+                self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: bytes) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
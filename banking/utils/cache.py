@@ -0,0 +1,153 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Optional,
+    OrderedDict as OrderedDictType,
+    Tuple,
+    TypeVar,
+)
+
+from eventsourcing.application import LRUCache
+
+S = TypeVar("S")
+T = TypeVar("T")
+
+
+class CountingLRUCache(LRUCache[S, T]):
+    """LRU cache that keeps hit, miss and eviction counters"""
+
+    def __init__(self, maxsize: int) -> None:
+        super().__init__(maxsize)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._counters_lock = Lock()
+
+    def get(self, key: S, evict: bool = False) -> T:
+        """Return the cached value, counting the lookup as a hit or miss
+
+        Args:
+            key (S)
+            evict (bool): remove the entry instead of refreshing it
+
+        Raises:
+            KeyError
+
+        Returns:
+            T
+        """
+        try:
+            value = super().get(key, evict=evict)
+        except KeyError:
+            with self._counters_lock:
+                self.misses += 1
+            raise
+        if not evict:
+            with self._counters_lock:
+                self.hits += 1
+        return value
+
+    def put(self, key: S, value: T) -> Optional[Any]:
+        """Store a value, counting the least recently used entry
+        it pushes out as an eviction
+
+        Args:
+            key (S)
+            value (T)
+
+        Returns:
+            Optional[Any]: evicted key and value
+        """
+        evicted = super().put(key, value)
+        if evicted[0] is not None:
+            with self._counters_lock:
+                self.evictions += 1
+        return evicted
+
+    def stats(self) -> Dict[str, int]:
+        """Return the counters and the current size of the cache"""
+        with self._counters_lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self.cache),
+                "maxsize": self.maxsize,
+            }
+
+
+class ExpiringLRUCache(Generic[S, T]):
+    """LRU cache of values that expire at a time of the clock, with
+    hit, miss, eviction and expiration counters"""
+
+    def __init__(
+        self, maxsize: int = 10000, clock: Callable[[], float] = time.time
+    ) -> None:
+        self.maxsize = maxsize
+        self.clock = clock
+        self._entries: OrderedDictType[S, Tuple[float, T]] = OrderedDict()
+        self._lock = Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+        }
+
+    def get(
+        self, key: S, is_stale: Optional[Callable[[T], bool]] = None
+    ) -> Optional[T]:
+        """Return the cached value, refreshing it, unless it expired
+
+        Args:
+            key (S)
+            is_stale (Callable[[T], bool], optional): drop the value
+                as if it expired when true
+
+        Returns:
+            Optional[T]: None unless cached and unexpired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            expires, value = entry
+            if expires <= self.clock() or (is_stale and is_stale(value)):
+                del self._entries[key]
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def put(self, key: S, expires: float, value: T) -> None:
+        """Cache a value until it expires, evicting the least recently
+        used ones beyond maxsize
+
+        Args:
+            key (S)
+            expires (float): time of the clock
+            value (T)
+        """
+        if self.maxsize < 1 or expires <= self.clock():
+            return
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Return the counters and the number of cached values"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        return stats
@@ -0,0 +1,61 @@
+import random
+from threading import Lock
+from typing import List
+from uuid import UUID
+
+
+class StripedLock:
+    """Fixed set of locks shared by hashing the account id,
+    so writers to the same account are serialized without
+    keeping a lock per account
+    """
+
+    def __init__(self, stripes: int) -> None:
+        if stripes < 1:
+            raise ValueError("Lock stripes can't be less than 1")
+        self.locks: List[Lock] = [Lock() for _ in range(stripes)]
+
+    def stripe(self, account_id: UUID) -> int:
+        """Index of the lock guarding an account
+
+        Args:
+            account_id (UUID)
+
+        Returns:
+            int
+        """
+        return account_id.int % len(self.locks)
+
+    def acquire(self, stripe: int, timeout: float) -> bool:
+        """Acquire a lock, giving up after timeout seconds
+
+        Args:
+            stripe (int)
+            timeout (float)
+
+        Returns:
+            bool: whether the lock was acquired
+        """
+        return self.locks[stripe].acquire(timeout=timeout)
+
+    def release(self, stripe: int) -> None:
+        """Release a lock
+
+        Args:
+            stripe (int)
+        """
+        self.locks[stripe].release()
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff with full jitter
+
+    Args:
+        attempt (int): number of the failed attempt, from 1
+        base (float): delay after the first attempt, in seconds
+        cap (float): longest delay, in seconds
+
+    Returns:
+        float
+    """
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
@@ -1,5 +1,9 @@
+import typing
 from uuid import UUID
 
+# The exceptions rebuild from their own arguments when unpickled, so
+# they cross process boundaries (see banking.sharding) intact.
+
 
 class TransactionError(Exception):
     """Exception used when any transfer fails"""
@@ -15,6 +19,9 @@ class AccountClosedError(Exception):
         self.account_id = account_id
         super().__init__(f"Account with ID {account_id} is closed")
 
+    def __reduce__(self) -> typing.Tuple[typing.Any, ...]:
+        return type(self), (self.account_id,)
+
 
 class InsufficientFundsError(Exception):
     """Exception used when the account does not have sufficient founds"""
@@ -27,6 +34,9 @@ class InsufficientFundsError(Exception):
             f"but the requested withdrawal amount is {withdrawal_amount}"
         )
 
+    def __reduce__(self) -> typing.Tuple[typing.Any, ...]:
+        return type(self), (self.current_balance, self.withdrawal_amount)
+
 
 class BadCredentials(Exception):
     """Exception used when the login fails"""
@@ -35,6 +45,9 @@ class BadCredentials(Exception):
         self.email_address = email_address
         super().__init__(f"Bad credentials for email address: {email_address}")
 
+    def __reduce__(self) -> typing.Tuple[typing.Any, ...]:
+        return type(self), (self.email_address,)
+
 
 class AccountNotFoundError(Exception):
     """Exception used when the account is not in the system"""
@@ -44,3 +57,68 @@ class AccountNotFoundError(Exception):
         super().__init__(
             f"Account not found for email address: {email_address}"
         )
+
+    def __reduce__(self) -> typing.Tuple[typing.Any, ...]:
+        return type(self), (self.email_address,)
+
+
+class AccountAlreadyExistsError(Exception):
+    """Exception used when the email already owns an account"""
+
+    def __init__(self, email_address: str) -> None:
+        self.email_address = email_address
+        super().__init__(
+            f"Account already exists for email address: {email_address}"
+        )
+
+    def __reduce__(self) -> typing.Tuple[typing.Any, ...]:
+        return type(self), (self.email_address,)
+
+
+class TransferNotFoundError(Exception):
+    """Exception used when the transfer is not in the system"""
+
+    def __init__(self, transfer_id: UUID) -> None:
+        self.transfer_id = transfer_id
+        super().__init__(f"Transfer with ID {transfer_id} not found")
+
+    def __reduce__(self) -> typing.Tuple[typing.Any, ...]:
+        return type(self), (self.transfer_id,)
+
+
+class AccountBusyError(TransactionError):
+    """Exception used when another request holds the account for too long"""
+
+    def __init__(self, account_id: UUID) -> None:
+        self.account_id = account_id
+        super().__init__(f"Account with ID {account_id} is busy")
+
+    def __reduce__(self) -> typing.Tuple[typing.Any, ...]:
+        return type(self), (self.account_id,)
+
+
+class CredentialPoolBusyError(Exception):
+    """Exception used when passwords can't be checked fast enough"""
+
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+
+
+class TransferPipelineError(Exception):
+    """Exception used when requested transfers can't be completed"""
+
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+
+
+class IdempotencyKeyReusedError(TransactionError):
+    """Exception used when an idempotency key comes with another request"""
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+        super().__init__(
+            f"Idempotency key {key} was used for a different request"
+        )
+
+    def __reduce__(self) -> typing.Tuple[typing.Any, ...]:
+        return type(self), (self.key,)
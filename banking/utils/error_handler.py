@@ -3,25 +3,56 @@ from functools import wraps
 from werkzeug.exceptions import BadRequest
 from eventsourcing.application import AggregateNotFound
 
-from banking.utils.custom_exceptions import BadCredentials, TransactionError
+from banking.utils import metrics
+from banking.utils.custom_exceptions import (
+    AccountAlreadyExistsError,
+    AccountNotFoundError,
+    BadCredentials,
+    CredentialPoolBusyError,
+    TransactionError,
+    TransferNotFoundError,
+    TransferPipelineError,
+)
 
 
 def error_handler(func):
     """Decorator used to wrap all the logic inside a try/except block
-    to not reapt try/except blocks in the code
+    to not reapt try/except blocks in the code, it labels the request
+    with its outcome and times it as the handler phase (see metrics)
     """
 
     @wraps(func)
     def wrapper(*args, **kwargs):
-        try:
-            return func(*args, **kwargs)
-        except AggregateNotFound:
-            return {"error": "Account not found."}, 404
-        except BadCredentials as bad_credentials:
-            return {"error": f"{str(bad_credentials)}"}, 401
-        except TransactionError as transaction_error:
-            return {"error": str(transaction_error)}, 400
-        except Exception as exception:
-            raise BadRequest(description=str(exception))
+        with metrics.phase("handler"):
+            try:
+                result = func(*args, **kwargs)
+            except (AggregateNotFound, AccountNotFoundError):
+                result = {"error": "Account not found."}, 404
+                outcome = "not_found"
+            except TransferNotFoundError:
+                result = {"error": "Transfer not found."}, 404
+                outcome = "not_found"
+            except AccountAlreadyExistsError as already_exists:
+                result = {"error": str(already_exists)}, 409
+                outcome = "conflict"
+            except BadCredentials as bad_credentials:
+                result = {"error": f"{str(bad_credentials)}"}, 401
+                outcome = "bad_credentials"
+            except CredentialPoolBusyError as busy:
+                result = {"error": str(busy)}, 503
+                outcome = "busy"
+            except TransferPipelineError as unavailable:
+                result = {"error": str(unavailable)}, 503
+                outcome = "unavailable"
+            except TransactionError as transaction_error:
+                result = {"error": str(transaction_error)}, 400
+                outcome = "rejected"
+            except Exception as exception:
+                metrics.set_outcome("bad_request")
+                raise BadRequest(description=str(exception))
+            else:
+                outcome = "success"
+        metrics.set_outcome(outcome)
+        return result
 
     return wrapper
@@ -0,0 +1,17 @@
+import typing
+from uuid import UUID
+
+from banking.utils.cache import ExpiringLRUCache
+
+Response = typing.Tuple[str, typing.Dict[str, typing.Any], int]
+
+
+class IdempotencyCache(ExpiringLRUCache[UUID, Response]):
+    """LRU cache of the responses saved for idempotency keys, keyed by
+    the id of their IdempotentResponse, so a retried request is
+    answered without loading anything. An entry expires when its
+    response does.
+
+    Only this cache is bounded, the IdempotentResponse aggregates
+    saved in the store are never removed.
+    """
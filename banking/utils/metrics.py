@@ -0,0 +1,251 @@
+import bisect
+import threading
+import time
+import typing
+
+# Upper bounds in seconds, from a cached read to a slow replay.
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    """Prometheus histogram with a fixed set of label names, an
+    observation is a bisect and two updates under a lock
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: typing.Sequence[str],
+        buckets: typing.Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Label values -> count per bucket, the last one is +Inf.
+        self._counts: typing.Dict[typing.Tuple[str, ...], typing.List[int]]
+        self._counts = {}
+        self._sums: typing.Dict[typing.Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        """Record a value
+
+        Args:
+            value (float)
+            labelvalues (str): one per label name
+
+        Raises:
+            ValueError
+        """
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}")
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(labelvalues)
+            if counts is None:
+                counts = self._counts[labelvalues] = [0] * (
+                    len(self.buckets) + 1
+                )
+            counts[index] += 1
+            self._sums[labelvalues] = self._sums.get(labelvalues, 0.0) + value
+
+    def count(self, *labelvalues: str) -> int:
+        """Number of values recorded with the given labels"""
+        with self._lock:
+            return sum(self._counts.get(labelvalues, ()))
+
+    def render(self) -> typing.List[str]:
+        """Lines of the histogram in the Prometheus text format
+
+        Returns:
+            List[str]
+        """
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = [
+                (labelvalues, list(counts), self._sums[labelvalues])
+                for labelvalues, counts in self._counts.items()
+            ]
+        for labelvalues, counts, total in sorted(series):
+            labels = ",".join(
+                f'{name}="{_escape(value)}"'
+                for name, value in zip(self.labelnames, labelvalues)
+            )
+            prefix = f"{labels}," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets + (None,), counts):
+                cumulative += count
+                le = "+Inf" if bound is None else repr(float(bound))
+                lines.append(
+                    f'{self.name}_bucket{{{prefix}le="{le}"}} {cumulative}'
+                )
+            lines.append(f"{self.name}_sum{{{labels}}} {total!r}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class Registry:
+    """The histograms served together on /metrics"""
+
+    def __init__(self) -> None:
+        self.histograms: typing.List[Histogram] = []
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: typing.Sequence[str],
+        buckets: typing.Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """Create and register a histogram
+
+        Returns:
+            Histogram
+        """
+        histogram = Histogram(name, documentation, labelnames, buckets)
+        self.histograms.append(histogram)
+        return histogram
+
+    def render(self) -> str:
+        """Every histogram in the Prometheus text format
+
+        Returns:
+            str
+        """
+        return "".join(
+            line + "\n"
+            for histogram in self.histograms
+            for line in histogram.render()
+        )
+
+
+REGISTRY = Registry()
+REQUEST_SECONDS = REGISTRY.histogram(
+    "banking_request_duration_seconds",
+    "Time to serve a request, by endpoint and outcome.",
+    ("endpoint", "outcome"),
+)
+PHASE_SECONDS = REGISTRY.histogram(
+    "banking_request_phase_seconds",
+    "Time a request spent in jwt verification, aggregate loads, saves, "
+    "the rest of its handler and the framework.",
+    ("endpoint", "phase"),
+)
+
+
+class RequestTimer:
+    """Phases of the request being served by a thread"""
+
+    def __init__(self, endpoint: str) -> None:
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.phases: typing.Dict[str, float] = {}
+        self.outcome: typing.Optional[str] = None
+
+
+_local = threading.local()
+
+
+def start_request(endpoint: str) -> None:
+    """Time the request this thread starts serving
+
+    Args:
+        endpoint (str): route of the request
+    """
+    _local.timer = RequestTimer(endpoint)
+
+
+def current_request() -> typing.Optional[RequestTimer]:
+    """The timer of the request of this thread, None outside requests"""
+    return getattr(_local, "timer", None)
+
+
+class phase:
+    """Context manager that adds the time spent in its block to a
+    phase of the request of this thread, nothing is timed outside
+    requests. A class rather than a generator, it is on every hot path.
+
+    Args:
+        name (str): "jwt", "load", "save" or "handler"
+    """
+
+    __slots__ = ("name", "timer", "started")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.timer = getattr(_local, "timer", None)
+        if self.timer is not None:
+            self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info: typing.Any) -> None:
+        if self.timer is not None:
+            elapsed = time.perf_counter() - self.started
+            phases = self.timer.phases
+            phases[self.name] = phases.get(self.name, 0.0) + elapsed
+
+
+def set_outcome(outcome: str) -> None:
+    """Label the request of this thread with an outcome
+
+    Args:
+        outcome (str)
+    """
+    timer = current_request()
+    if timer is not None:
+        timer.outcome = outcome
+
+
+def finish_request(status: int) -> None:
+    """Record the request of this thread in the histograms. Loads and
+    saves run inside the handler and are taken out of its time, the
+    rest of the request is the framework's.
+
+    Args:
+        status (int): status code, gives the outcome when no handler
+            decided one
+    """
+    timer = current_request()
+    if timer is None:
+        return
+    _local.timer = None
+    total = time.perf_counter() - timer.started
+    phases = dict(timer.phases)
+    handler = phases.get("handler", 0.0)
+    framework = total - handler - phases.get("jwt", 0.0)
+    if "handler" in phases:
+        phases["handler"] = max(
+            handler - phases.get("load", 0.0) - phases.get("save", 0.0), 0.0
+        )
+    phases["framework"] = max(framework, 0.0)
+    outcome = timer.outcome
+    if outcome is None:
+        outcome = "success" if status < 400 else f"http_{status}"
+    REQUEST_SECONDS.observe(total, timer.endpoint, outcome)
+    for name, seconds in phases.items():
+        PHASE_SECONDS.observe(seconds, timer.endpoint, name)
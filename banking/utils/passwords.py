@@ -0,0 +1,235 @@
+import hmac
+import os
+import threading
+import typing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from hashlib import pbkdf2_hmac, sha512
+
+from banking.utils.custom_exceptions import CredentialPoolBusyError
+
+ALGORITHM = "pbkdf2_sha256"
+SALT_SIZE = 16
+
+T = typing.TypeVar("T")
+
+
+def hash_password(password: str, iterations: int) -> str:
+    """Hash a password with PBKDF2-SHA256 and a random salt
+
+    Args:
+        password (str)
+        iterations (int): cost of the hash
+
+    Returns:
+        str: algorithm, iterations, salt and hash joined by "$"
+    """
+    salt = os.urandom(SALT_SIZE)
+    digest = pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return f"{ALGORITHM}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(password: str, hashed_password: str) -> bool:
+    """Check a password against a PBKDF2 hash, or against the
+    unsalted SHA-512 hash of the accounts opened before PBKDF2
+
+    Args:
+        password (str)
+        hashed_password (str)
+
+    Returns:
+        bool
+    """
+    if "$" not in hashed_password:
+        digest = sha512(password.encode()).hexdigest()
+        return hmac.compare_digest(digest, hashed_password)
+    algorithm, iterations, salt, expected = hashed_password.split("$")
+    if algorithm != ALGORITHM:
+        return False
+    digest = pbkdf2_hmac(
+        "sha256", password.encode(), bytes.fromhex(salt), int(iterations)
+    )
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+def needs_rehash(hashed_password: str, iterations: int) -> bool:
+    """Whether a hash is legacy SHA-512 or has another cost
+
+    Args:
+        hashed_password (str)
+        iterations (int): current cost
+
+    Returns:
+        bool
+    """
+    return not hashed_password.startswith(f"{ALGORITHM}${iterations}$")
+
+
+class CredentialPool:
+    """Runs password hashing and verification on a pool of worker
+    processes, so an expensive hash never holds the GIL of the
+    request threads. At most max_pending calls are queued or
+    running, more are rejected at once, and a call waits at most
+    timeout seconds for its result. Without workers the calls run
+    in the calling thread. The workers start with the first call
+    that needs them, so a pool that never hashes costs nothing.
+    When a worker dies, the calls it breaks are rejected and the
+    next call starts new workers.
+    """
+
+    def __init__(
+        self,
+        iterations: int,
+        workers: int = 0,
+        max_pending: int = 64,
+        timeout: float = 5.0,
+    ) -> None:
+        if iterations < 1:
+            raise ValueError("Hash iterations can't be less than 1")
+        if workers < 0:
+            raise ValueError("Workers can't be less than 0")
+        if max_pending < 1:
+            raise ValueError("Max pending can't be less than 1")
+        self.iterations = iterations
+        self.workers = workers
+        self.timeout = timeout
+        self.executor: typing.Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._stats_lock = threading.Lock()
+        self._stats = {"calls": 0, "rejected": 0, "timeouts": 0}
+
+    def hash(self, password: str) -> str:
+        """Hash a password at the configured cost
+
+        Args:
+            password (str)
+
+        Raises:
+            CredentialPoolBusyError
+
+        Returns:
+            str
+        """
+        return self._call(hash_password, password, self.iterations)
+
+    def hash_many(self, passwords: typing.List[str]) -> typing.List[str]:
+        """Hash many passwords, spread across the workers. This is
+        meant for bulk imports, so it waits for the workers instead
+        of counting against max_pending or timing out.
+
+        Args:
+            passwords (List[str])
+
+        Returns:
+            List[str]
+        """
+        iterations = [self.iterations] * len(passwords)
+        executor = self._executor()
+        if executor is None:
+            return list(map(hash_password, passwords, iterations))
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        try:
+            return list(
+                executor.map(
+                    hash_password, passwords, iterations, chunksize=chunksize
+                )
+            )
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise
+
+    def verify(self, password: str, hashed_password: str) -> bool:
+        """Check a password against its hash
+
+        Args:
+            password (str)
+            hashed_password (str)
+
+        Raises:
+            CredentialPoolBusyError
+
+        Returns:
+            bool
+        """
+        return self._call(verify_password, password, hashed_password)
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        """Whether a hash should be replaced by one at the configured cost
+
+        Args:
+            hashed_password (str)
+
+        Returns:
+            bool
+        """
+        return needs_rehash(hashed_password, self.iterations)
+
+    def stats(self) -> typing.Dict[str, int]:
+        """Return how many calls ran, were rejected or timed out
+
+        Returns:
+            Dict[str, int]
+        """
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def shutdown(self) -> None:
+        """Stop the worker processes, if they started"""
+        with self._executor_lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    def _call(self, func: typing.Callable[..., T], *args: typing.Any) -> T:
+        if not self._slots.acquire(blocking=False):
+            self._count("rejected")
+            raise CredentialPoolBusyError("Too many logins in progress")
+        self._count("calls")
+        executor = self._executor()
+        if executor is None:
+            try:
+                return func(*args)
+            finally:
+                self._slots.release()
+
+        try:
+            future: Future = executor.submit(func, *args)
+        except BaseException as error:
+            self._slots.release()
+            if isinstance(error, BrokenProcessPool):
+                self._discard(executor)
+                raise CredentialPoolBusyError("Login workers restarted")
+            raise
+        # The slot is freed when the work is done, not when the
+        # caller stops waiting, so the bound holds on timeouts.
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            self._count("timeouts")
+            raise CredentialPoolBusyError("Login timed out") from None
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise CredentialPoolBusyError("Login workers restarted")
+
+    def _executor(self) -> typing.Optional[ProcessPoolExecutor]:
+        if not self.workers:
+            return None
+        with self._executor_lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self.executor
+
+    def _discard(self, executor: ProcessPoolExecutor) -> None:
+        """Drop a broken executor, so the next call starts new workers"""
+        with self._executor_lock:
+            if self.executor is executor:
+                self.executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _count(self, counter: str) -> None:
+        with self._stats_lock:
+            self._stats[counter] += 1
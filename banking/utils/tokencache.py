@@ -0,0 +1,128 @@
+import math
+import threading
+import time
+import typing
+from hashlib import sha256
+
+from banking.utils.cache import ExpiringLRUCache
+
+Claims = typing.Dict[str, typing.Any]
+
+
+class TokenCache:
+    """LRU cache of the header and claims of verified JWTs, keyed by
+    the SHA-256 digest of the token, so a token reused by a client is
+    only decoded and verified once. An entry expires at the exp claim
+    of its token, or max_ttl seconds after it was cached if sooner.
+
+    Revoked tokens (by jti) and every token of a revoked identity
+    issued up to its revocation are never served from the cache, and
+    is_revoked is meant to back the blocklist of the JWT manager, so
+    they are rejected when decoded as well.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 10000,
+        max_ttl: float = 300.0,
+        identity_claim: str = "sub",
+        clock: typing.Callable[[], float] = time.time,
+    ) -> None:
+        self.maxsize = maxsize
+        self.max_ttl = max_ttl
+        self.identity_claim = identity_claim
+        self.clock = clock
+        self._entries: ExpiringLRUCache[
+            bytes, typing.Tuple[Claims, Claims]
+        ] = ExpiringLRUCache(maxsize, clock)
+        self._revoked_tokens: typing.Dict[str, float] = {}
+        self._revoked_identities: typing.Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self, token: str
+    ) -> typing.Optional[typing.Tuple[Claims, Claims]]:
+        """Get the header and claims of a token verified before
+
+        Args:
+            token (str)
+
+        Returns:
+            Optional[Tuple[Dict, Dict]]: None unless cached, unexpired
+                and not revoked
+        """
+        return self._entries.get(
+            sha256(token.encode()).digest(),
+            is_stale=lambda entry: self.is_revoked(entry[1]),
+        )
+
+    def put(self, token: str, header: Claims, claims: Claims) -> None:
+        """Cache the header and claims of a verified token
+
+        Args:
+            token (str)
+            header (Dict)
+            claims (Dict)
+        """
+        expires = min(
+            claims.get("exp", math.inf), self.clock() + self.max_ttl
+        )
+        self._entries.put(
+            sha256(token.encode()).digest(), expires, (header, claims)
+        )
+
+    def revoke(self, claims: Claims) -> None:
+        """Revoke a token until it expires
+
+        Args:
+            claims (Dict): claims of the token, with its jti
+        """
+        now = self.clock()
+        with self._lock:
+            self._revoked_tokens = {
+                jti: expires
+                for jti, expires in self._revoked_tokens.items()
+                if expires > now
+            }
+            self._revoked_tokens[claims["jti"]] = claims.get("exp", math.inf)
+
+    def revoke_identity(self, identity: str) -> None:
+        """Revoke every token issued to an identity so far
+
+        Args:
+            identity (str)
+        """
+        with self._lock:
+            self._revoked_identities[identity] = self.clock()
+
+    def is_revoked(self, claims: Claims) -> bool:
+        """Whether a token was revoked
+
+        Args:
+            claims (Dict)
+
+        Returns:
+            bool
+        """
+        with self._lock:
+            return self._is_revoked(claims)
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        """Return hit, miss, eviction and expiration counters, the
+        hit rate and the number of cached tokens
+
+        Returns:
+            Dict[str, Any]
+        """
+        stats: typing.Dict[str, typing.Any] = self._entries.stats()
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _is_revoked(self, claims: Claims) -> bool:
+        if claims.get("jti") in self._revoked_tokens:
+            return True
+        revoked_at = self._revoked_identities.get(
+            claims.get(self.identity_claim)
+        )
+        return revoked_at is not None and claims.get("iat", 0) <= revoked_at
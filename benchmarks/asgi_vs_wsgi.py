@@ -0,0 +1,163 @@
+# coding=utf-8
+"""Compare the Flask API on the threaded werkzeug server, which closes
+every connection after its response, with the ASGI app on the asyncio
+server, which keeps connections alive.
+
+    poetry run python -m benchmarks.asgi_vs_wsgi
+    poetry run python -m benchmarks.asgi_vs_wsgi --connections 256 \\
+        --requests 20
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import threading
+import time
+import typing
+
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+
+from werkzeug.serving import make_server  # noqa: E402
+
+from banking.api import app as flask_app  # noqa: E402
+from banking.asgi import app as asgi_app  # noqa: E402
+from banking.utils.asgiserver import start_server  # noqa: E402
+
+
+def login() -> str:
+    """Open an account with funds and return a token of it"""
+    client = flask_app.test_client()
+    credentials = {
+        "email_address": "benchmark@example.com",
+        "password": "benchmark",
+    }
+    client.post("/api/v1/signup", json=dict(credentials, full_name="Bench"))
+    response = client.post("/api/v1/login", json=credentials)
+    token = response.get_json()["access_token"]
+    client.post(
+        "/api/v1/deposit",
+        json={"amount": 1000000},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    return token
+
+
+def serve_wsgi() -> typing.Tuple[int, typing.Callable[[], None]]:
+    """Serve the Flask API on a thread per connection"""
+    server = make_server("127.0.0.1", 0, flask_app, threaded=True)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_port, server.shutdown
+
+
+def serve_asgi() -> typing.Tuple[int, typing.Callable[[], None]]:
+    """Serve the ASGI app on an event loop of its own thread"""
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(start_server(asgi_app, port=0))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return server.sockets[0].getsockname()[1], server.close
+
+
+async def client(
+    port: int, token: str, path: str, requests: int, keep_alive: bool
+) -> typing.List[float]:
+    """Send requests, over one connection if kept alive, and time them"""
+    method = "POST" if path.endswith("deposit") else "GET"
+    body = b'{"amount": 1}' if method == "POST" else b""
+    request = (
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n"
+        f"Authorization: Bearer {token}\r\n"
+        f"Content-Type: application/json\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n"
+    ).encode() + body
+    latencies = []
+    connection = None
+    for _ in range(requests):
+        started = time.perf_counter()
+        if connection is None:
+            connection = await asyncio.open_connection("127.0.0.1", port)
+        reader, writer = connection
+        writer.write(request)
+        length = 0
+        assert (await reader.readline()).split()[1] == b"200"
+        while True:
+            line = await reader.readline()
+            if line == b"\r\n":
+                break
+            name, _, value = line.partition(b":")
+            if name.lower() == b"content-length":
+                length = int(value)
+        await reader.readexactly(length)
+        latencies.append(time.perf_counter() - started)
+        if not keep_alive:
+            writer.close()
+            connection = None
+    if connection is not None:
+        connection[1].close()
+    return latencies
+
+
+async def run(
+    port: int,
+    token: str,
+    path: str,
+    connections: int,
+    requests: int,
+    keep_alive: bool,
+) -> typing.Tuple[float, float, float]:
+    """Run the clients concurrently
+
+    Returns:
+        Tuple[float, float, float]: requests per second, p50 and p99
+            latencies in milliseconds
+    """
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(
+            client(port, token, path, requests, keep_alive)
+            for _ in range(connections)
+        )
+    )
+    seconds = time.perf_counter() - started
+    latencies = sorted(latency for result in results for latency in result)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return (
+        len(latencies) / seconds,
+        statistics.median(latencies) * 1000,
+        p99 * 1000,
+    )
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    token = login()
+    servers = {"wsgi": serve_wsgi(), "asgi": serve_asgi()}
+    print(f"{'server':>6} {'endpoint':>8} {'req/s':>8} {'p50':>7} {'p99':>7}")
+    for endpoint in ("account", "deposit"):
+        for name, (port, _) in servers.items():
+            rate, p50, p99 = asyncio.run(
+                run(
+                    port,
+                    token,
+                    f"/api/v1/{endpoint}",
+                    args.connections,
+                    args.requests,
+                    keep_alive=name == "asgi",
+                )
+            )
+            print(
+                f"{name:>6} {endpoint:>8} {rate:>8.0f} "
+                f"{p50:>6.1f}ms {p99:>6.1f}ms"
+            )
+    for _, stop in servers.values():
+        stop()
+
+
+if __name__ == "__main__":
+    main()
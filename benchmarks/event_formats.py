@@ -0,0 +1,81 @@
+# coding=utf-8
+"""Measure the stored size and the encode/decode time of Bank events
+with each event transcoder and compression.
+
+    poetry run python -m benchmarks.event_formats
+    poetry run python -m benchmarks.event_formats --events 100000
+"""
+
+import argparse
+import time
+import typing
+import uuid
+
+from banking.applicationmodel import Bank
+from banking.domainmodel import Account
+
+FORMATS = (
+    ("json", "none"),
+    ("json", "zlib"),
+    ("compact", "none"),
+    ("compact", "zlib"),
+)
+
+
+def make_events(length: int) -> typing.List[typing.Any]:
+    """Events of an account opened and then credited and debited
+
+    Args:
+        length (int): number of events
+
+    Returns:
+        List[DomainEventProtocol]
+    """
+    account = Account(
+        uuid.uuid4(), "Bench", "bench@example.com", "bench-password"
+    )
+    for number in range(1, length):
+        if number % 2:
+            account.credit(number * 100)
+        else:
+            account.debit(number)
+    return list(account.collect_events())
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    events = make_events(args.events)
+    print(
+        f"{'transcoder':>10} {'compression':>11} {'bytes/event':>11} "
+        f"{'encode (us)':>11} {'decode (us)':>11}"
+    )
+    for transcoder, compression in FORMATS:
+        mapper = Bank(
+            env={
+                "EVENT_TRANSCODER": transcoder,
+                "EVENT_COMPRESSION": compression,
+            }
+        ).mapper
+
+        started = time.perf_counter()
+        stored_events = [mapper.to_stored_event(event) for event in events]
+        encode = (time.perf_counter() - started) / len(events)
+
+        started = time.perf_counter()
+        for stored_event in stored_events:
+            mapper.to_domain_event(stored_event)
+        decode = (time.perf_counter() - started) / len(events)
+
+        size = sum(len(stored.state) for stored in stored_events)
+        print(
+            f"{transcoder:>10} {compression:>11} "
+            f"{size / len(events):>11.1f} "
+            f"{encode * 1e6:>11.2f} {decode * 1e6:>11.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# coding=utf-8
+"""Measure the throughput and peak memory of exporting the notification
+log of a Bank stored in SQLite, at larger and larger stores.
+
+    poetry run python -m benchmarks.export_log
+    poetry run python -m benchmarks.export_log --events 10000 100000 \\
+        --format csv
+"""
+
+import argparse
+import os
+import tempfile
+import tracemalloc
+import typing
+
+from banking.applicationmodel import Bank
+from banking.exporter import export_events
+
+STORE_SIZES = (1000, 10000, 50000)
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--events", type=int, nargs="+", default=list(STORE_SIZES)
+    )
+    parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    parser.add_argument("--section-size", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    print(f"{'events':>8} {'events/s':>9} {'peak':>9}")
+    for events in args.events:
+        with tempfile.TemporaryDirectory() as directory:
+            bank = Bank(
+                env={
+                    "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+                    "SQLITE_DBNAME": os.path.join(directory, "bank.db"),
+                    "PASSWORD_HASH_ITERATIONS": "1000",
+                    "CREDENTIAL_POOL_WORKERS": "0",
+                }
+            )
+            account_id = bank.open_account("A", "a@example.com", "secret")
+            with bank.unit_of_work():
+                for _ in range(events - 1):
+                    bank.deposit_funds(account_id, 1)
+            tracemalloc.start()
+            report = export_events(
+                bank,
+                os.path.join(directory, f"events.{args.format}"),
+                args.format,
+                section_size=args.section_size,
+            )
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            bank.close()
+        print(
+            f"{report.exported:>8} {report.rate:>9.0f} "
+            f"{peak / 1024 / 1024:>7.1f}MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
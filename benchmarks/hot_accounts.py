@@ -0,0 +1,91 @@
+# coding=utf-8
+"""Measure concurrent credit throughput on a single account as the
+number of its shards grows (0 is a regular account).
+
+    poetry run python -m benchmarks.hot_accounts
+    poetry run python -m benchmarks.hot_accounts --threads 16 --shards 0 8
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+import typing
+
+from banking.applicationmodel import Bank
+
+SHARD_COUNTS = (0, 2, 4, 8, 16)
+
+
+def run_credits(
+    bank: Bank, account_id: typing.Any, threads: int, credits: int
+) -> float:
+    """Seconds taken by `threads` threads crediting the account
+    `credits` times each
+
+    Args:
+        bank (Bank)
+        account_id (UUID)
+        threads (int)
+        credits (int)
+
+    Returns:
+        float
+    """
+
+    def credit() -> None:
+        for _ in range(credits):
+            bank.deposit_funds(account_id, 1)
+
+    workers = [threading.Thread(target=credit) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - started
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--credits", type=int, default=200)
+    parser.add_argument(
+        "--shards", type=int, nargs="+", default=list(SHARD_COUNTS)
+    )
+    args = parser.parse_args(argv)
+
+    print(
+        f"{'shards':>6} {'credits/s':>10} {'conflicts':>10} "
+        f"{'failures':>9} {'balance ok':>10}"
+    )
+    for shards in args.shards:
+        with tempfile.TemporaryDirectory() as directory:
+            bank = Bank(
+                env={
+                    "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+                    "SQLITE_DBNAME": os.path.join(directory, "bench.db"),
+                    "CONFLICT_RETRY_ATTEMPTS": "50",
+                }
+            )
+            account_id = bank.open_account(
+                "Merchant", "merchant@example.com", "merchant"
+            )
+            if shards:
+                bank.enable_hot_mode(account_id, shards)
+            seconds = run_credits(
+                bank, account_id, args.threads, args.credits
+            )
+            stats = bank.concurrency_stats()
+            expected = args.threads * args.credits - stats["failures"]
+            print(
+                f"{shards:>6} {args.threads * args.credits / seconds:>10.0f}"
+                f" {stats['conflicts']:>10} {stats['failures']:>9}"
+                f" {str(bank.get_balance(account_id) == expected):>10}"
+            )
+            bank.close()
+
+
+if __name__ == "__main__":
+    main()
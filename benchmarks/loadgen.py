@@ -0,0 +1,416 @@
+# coding=utf-8
+"""Replay a mix of signup, login, deposit, transfer, withdraw and account
+requests against the API, in this process through the Flask test client
+or over HTTP, then check that no money was created or lost.
+
+    poetry run python -m benchmarks.loadgen
+    poetry run python -m benchmarks.loadgen --url http://127.0.0.1:5000 \\
+        --users 200 --concurrency 32 --duration 30 --think-time 0.05 \\
+        --mix deposit=3,transfer=4,withdraw=2,account=4,login=1
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import typing
+import urllib.parse
+import uuid
+
+# Settings of the API when it runs in this process.
+os.environ.setdefault("JWT_SECRET_KEY", "loadgen")
+os.environ.setdefault("PASSWORD_HASH_ITERATIONS", "1000")
+os.environ.setdefault("CREDENTIAL_POOL_WORKERS", "0")
+
+ACTIONS = ("deposit", "transfer", "withdraw", "account", "login")
+DEFAULT_MIX = "deposit=3,transfer=4,withdraw=2,account=4,login=1"
+INITIAL_DEPOSIT = 10000
+
+Response = typing.Tuple[int, typing.Dict[str, typing.Any]]
+
+
+class InProcessClient:
+    """Requests through the Flask test client of banking.api"""
+
+    def __init__(self) -> None:
+        # Importing the API starts its Bank, which --url doesn't need.
+        from banking.api import app
+
+        self.client = app.test_client()
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: typing.Optional[typing.Dict[str, typing.Any]] = None,
+        token: typing.Optional[str] = None,
+    ) -> Response:
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        response = self.client.open(
+            path, method=method, json=body, headers=headers
+        )
+        return response.status_code, response.get_json(silent=True) or {}
+
+
+class HttpClient:
+    """Requests over one keep-alive connection, reopened whenever the
+    server closes it"""
+
+    def __init__(self, url: str) -> None:
+        parsed = urllib.parse.urlsplit(url)
+        self.connection = http.client.HTTPConnection(
+            parsed.hostname or "127.0.0.1", parsed.port or 80, timeout=30
+        )
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: typing.Optional[typing.Dict[str, typing.Any]] = None,
+        token: typing.Optional[str] = None,
+    ) -> Response:
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        payload = json.dumps(body) if body is not None else None
+        try:
+            self.connection.request(method, path, payload, headers)
+            response = self.connection.getresponse()
+        except (http.client.HTTPException, OSError):
+            self.connection.close()
+            raise
+        data = response.read()
+        return response.status, json.loads(data) if data else {}
+
+
+class User(typing.NamedTuple):
+    email_address: str
+    password: str
+    account_id: str
+    token: str
+
+
+class Recorder:
+    """Latencies and outcomes per endpoint, requests per second, and
+    the money the requests that succeeded moved into the bank"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.latencies: typing.Dict[str, typing.List[float]] = {}
+        self.outcomes: typing.Dict[str, typing.Dict[str, int]] = {}
+        self.timeline: typing.Dict[int, int] = {}
+        self.net_deposits = 0
+        self.unknown_amounts = 0
+
+    def call(
+        self,
+        client: typing.Any,
+        endpoint: str,
+        method: str,
+        path: str,
+        body: typing.Optional[typing.Dict[str, typing.Any]] = None,
+        token: typing.Optional[str] = None,
+    ) -> typing.Optional[Response]:
+        """Send a request and record it, None if it raised"""
+        started = time.perf_counter()
+        try:
+            response: typing.Optional[Response] = client.request(
+                method, path, body, token
+            )
+        except Exception:
+            response = None
+        latency = time.perf_counter() - started
+        if response is None or response[0] >= 500:
+            outcome = "errors"
+        elif response[0] >= 400:
+            outcome = "rejected"
+        else:
+            outcome = "ok"
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(latency)
+            outcomes = self.outcomes.setdefault(
+                endpoint, {"ok": 0, "rejected": 0, "errors": 0}
+            )
+            outcomes[outcome] += 1
+            second = int(time.perf_counter() - self.started)
+            self.timeline[second] = self.timeline.get(second, 0) + 1
+            if endpoint in ("deposit", "withdraw") and body is not None:
+                amount = body["amount"]
+                if endpoint == "withdraw":
+                    amount = -amount
+                if outcome == "ok":
+                    self.net_deposits += amount
+                elif outcome == "errors":
+                    # The bank may or may not have applied it.
+                    self.unknown_amounts += abs(amount)
+        return response
+
+
+def run_workers(count: int, target: typing.Callable[[int], None]) -> None:
+    workers = [
+        threading.Thread(target=target, args=(index,))
+        for index in range(count)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def sign_up(
+    make_client: typing.Callable[[], typing.Any],
+    recorder: Recorder,
+    users: int,
+    concurrency: int,
+) -> typing.List[User]:
+    """Sign up, log in and fund `users` users on `concurrency` threads"""
+    run_id = uuid.uuid4().hex[:8]
+    signed_up: typing.List[User] = []
+    lock = threading.Lock()
+
+    def work(index: int) -> None:
+        client = make_client()
+        for number in range(index, users, concurrency):
+            email_address = f"load-{run_id}-{number}@example.com"
+            credentials = {"email_address": email_address, "password": "x"}
+            response = recorder.call(
+                client,
+                "signup",
+                "POST",
+                "/api/v1/signup",
+                dict(credentials, full_name=f"Load {number}"),
+            )
+            if not response or response[0] != 201:
+                continue
+            account_id = response[1]["account_id"]
+            response = recorder.call(
+                client, "login", "POST", "/api/v1/login", credentials
+            )
+            if not response or response[0] != 200:
+                continue
+            token = response[1]["access_token"]
+            recorder.call(
+                client,
+                "deposit",
+                "POST",
+                "/api/v1/deposit",
+                {"amount": INITIAL_DEPOSIT},
+                token,
+            )
+            with lock:
+                signed_up.append(User(email_address, "x", account_id, token))
+
+    run_workers(concurrency, work)
+    return signed_up
+
+
+def apply_load(
+    make_client: typing.Callable[[], typing.Any],
+    recorder: Recorder,
+    users: typing.List[User],
+    concurrency: int,
+    duration: float,
+    think_time: float,
+    mix: typing.Dict[str, int],
+    seed: int,
+) -> None:
+    """Send requests of the mix for users picked at random, from
+    `concurrency` threads, until `duration` seconds have passed"""
+    deadline = time.perf_counter() + duration
+    actions, weights = list(mix), list(mix.values())
+
+    def work(index: int) -> None:
+        client = make_client()
+        rng = random.Random(seed + index)
+        tokens = {}
+        while time.perf_counter() < deadline:
+            user = rng.choice(users)
+            token = tokens.get(user.account_id, user.token)
+            action = rng.choices(actions, weights)[0]
+            amount = rng.randint(1, 100)
+            if action == "account":
+                recorder.call(
+                    client, action, "GET", "/api/v1/account", None, token
+                )
+            elif action == "login":
+                response = recorder.call(
+                    client,
+                    action,
+                    "POST",
+                    "/api/v1/login",
+                    {
+                        "email_address": user.email_address,
+                        "password": user.password,
+                    },
+                )
+                if response and response[0] == 200:
+                    tokens[user.account_id] = response[1]["access_token"]
+            elif action == "transfer":
+                destination = rng.choice(
+                    [other for other in users if other is not user]
+                )
+                recorder.call(
+                    client,
+                    action,
+                    "POST",
+                    "/api/v1/transfer",
+                    {
+                        "destination_id": destination.account_id,
+                        "amount": amount,
+                    },
+                    token,
+                )
+            else:
+                recorder.call(
+                    client,
+                    action,
+                    "POST",
+                    f"/api/v1/{action}",
+                    {"amount": amount},
+                    token,
+                )
+            if think_time:
+                time.sleep(rng.expovariate(1 / think_time))
+
+    run_workers(concurrency, work)
+
+
+def total_balance(client: typing.Any, users: typing.List[User]) -> int:
+    """Sum of the balances of the users, as the API reports them"""
+    total = 0
+    for user in users:
+        status, data = client.request(
+            "GET", "/api/v1/account", None, user.token
+        )
+        if status != 200:
+            raise RuntimeError(f"GET /api/v1/account answered {status}")
+        total += int(data["balance"])
+    return total
+
+
+def check_money(
+    client: typing.Any,
+    recorder: Recorder,
+    users: typing.List[User],
+    settle: float,
+) -> typing.Tuple[bool, int]:
+    """Whether the balances of the users add up to what the successful
+    deposits and withdrawals moved, waiting up to `settle` seconds for
+    pending transfers and read models to catch up
+
+    Returns:
+        Tuple[bool, int]: the check and the total of the balances
+    """
+    deadline = time.perf_counter() + settle
+    while True:
+        total = total_balance(client, users)
+        difference = abs(total - recorder.net_deposits)
+        if difference <= recorder.unknown_amounts:
+            return True, total
+        if time.perf_counter() >= deadline:
+            return False, total
+        time.sleep(0.1)
+
+
+def parse_mix(mix: str) -> typing.Dict[str, int]:
+    weights = {}
+    for item in mix.split(","):
+        action, _, weight = item.partition("=")
+        if action not in ACTIONS:
+            raise argparse.ArgumentTypeError(f"Unknown action: {action}")
+        weights[action] = int(weight or 1)
+    return weights
+
+
+def report(recorder: Recorder, seconds: float) -> None:
+    print(
+        f"{'endpoint':>10} {'count':>7} {'ok':>7} {'rejected':>8} "
+        f"{'errors':>6} {'p50':>8} {'p95':>8} {'p99':>8}"
+    )
+    for endpoint, latencies in sorted(recorder.latencies.items()):
+        latencies.sort()
+        outcomes = recorder.outcomes[endpoint]
+
+        def percentile(fraction: float) -> float:
+            index = min(len(latencies) - 1, int(len(latencies) * fraction))
+            return latencies[index] * 1000
+
+        print(
+            f"{endpoint:>10} {len(latencies):>7} {outcomes['ok']:>7} "
+            f"{outcomes['rejected']:>8} {outcomes['errors']:>6} "
+            f"{statistics.median(latencies) * 1000:>6.2f}ms "
+            f"{percentile(0.95):>6.2f}ms {percentile(0.99):>6.2f}ms"
+        )
+    requests = sum(recorder.timeline.values())
+    print(f"\n{requests} requests, {requests / seconds:.0f} req/s overall")
+    timeline = [
+        str(recorder.timeline.get(second, 0))
+        for second in range(max(recorder.timeline, default=-1) + 1)
+    ]
+    print("req/s by second: " + " ".join(timeline))
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--url", help="base URL of a running API, in this process if unset"
+    )
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument(
+        "--think-time",
+        type=float,
+        default=0.0,
+        help="mean seconds a user waits between requests",
+    )
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=10.0,
+        help="seconds to wait for pending transfers before the check",
+    )
+    args = parser.parse_args(argv)
+
+    def make_client() -> typing.Any:
+        return HttpClient(args.url) if args.url else InProcessClient()
+
+    recorder = Recorder()
+    users = sign_up(make_client, recorder, args.users, args.concurrency)
+    if len(users) < 2:
+        sys.exit("Fewer than two users signed up")
+    apply_load(
+        make_client,
+        recorder,
+        users,
+        args.concurrency,
+        args.duration,
+        args.think_time,
+        args.mix,
+        args.seed,
+    )
+    report(recorder, time.perf_counter() - recorder.started)
+
+    conserved, total = check_money(
+        make_client(), recorder, users, args.settle
+    )
+    print(
+        f"money: balances {total}, deposits - withdrawals "
+        f"{recorder.net_deposits}, unknown outcomes "
+        f"{recorder.unknown_amounts}: {'OK' if conserved else 'MISMATCH'}"
+    )
+    errors = sum(o["errors"] for o in recorder.outcomes.values())
+    if not conserved or errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
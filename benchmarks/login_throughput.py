@@ -0,0 +1,113 @@
+# coding=utf-8
+"""Measure login throughput at each password hash cost, inline and on
+the credential pool, and the deposits that run alongside the logins.
+
+    poetry run python -m benchmarks.login_throughput
+    poetry run python -m benchmarks.login_throughput --workers 4 \\
+        --iterations 100000 600000
+"""
+
+import argparse
+import threading
+import time
+import typing
+
+from banking.applicationmodel import Bank
+from banking.utils.custom_exceptions import CredentialPoolBusyError
+
+HASH_ITERATIONS = (10000, 100000, 600000)
+
+
+def run(
+    bank: Bank, threads: int, logins: int
+) -> typing.Tuple[float, int, int, int]:
+    """Log in from `threads` threads `logins` times each while
+    another thread keeps depositing
+
+    Args:
+        bank (Bank)
+        threads (int)
+        logins (int)
+
+    Returns:
+        Tuple[float, int, int, int]: seconds, logins, rejected logins
+            and deposits
+    """
+    bank.open_accounts(
+        [
+            (f"User {number}", f"user{number}@example.com", "secret")
+            for number in range(threads)
+        ]
+    )
+    merchant = bank.open_account("Merchant", "merchant@example.com", "x")
+    counts = {"logins": 0, "rejected": 0, "deposits": 0}
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def login(number: int) -> None:
+        for _ in range(logins):
+            try:
+                bank.authenticate(f"user{number}@example.com", "secret")
+                counter = "logins"
+            except CredentialPoolBusyError:
+                counter = "rejected"
+            with lock:
+                counts[counter] += 1
+
+    def deposit() -> None:
+        while not done.is_set():
+            bank.deposit_funds(merchant, 1)
+            counts["deposits"] += 1
+
+    depositor = threading.Thread(target=deposit)
+    workers = [
+        threading.Thread(target=login, args=(number,))
+        for number in range(threads)
+    ]
+    started = time.perf_counter()
+    depositor.start()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    seconds = time.perf_counter() - started
+    done.set()
+    depositor.join()
+    return seconds, counts["logins"], counts["rejected"], counts["deposits"]
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--logins", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument(
+        "--iterations", type=int, nargs="+", default=list(HASH_ITERATIONS)
+    )
+    args = parser.parse_args(argv)
+
+    print(
+        f"{'iterations':>10} {'workers':>7} {'logins/s':>9} "
+        f"{'rejected':>8} {'deposits/s':>10}"
+    )
+    for iterations in args.iterations:
+        for workers in (0, args.workers):
+            bank = Bank(
+                env={
+                    "PASSWORD_HASH_ITERATIONS": str(iterations),
+                    "CREDENTIAL_POOL_WORKERS": str(workers),
+                    "CREDENTIAL_POOL_TIMEOUT": "60",
+                }
+            )
+            seconds, logins, rejected, deposits = run(
+                bank, args.threads, args.logins
+            )
+            bank.close()
+            print(
+                f"{iterations:>10} {workers:>7} {logins / seconds:>9.1f} "
+                f"{rejected:>8} {deposits / seconds:>10.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# coding=utf-8
+"""Measure the overhead of the request timings and histograms of
+banking.utils.metrics on the Flask API, with METRICS_ENABLED on and off.
+
+    poetry run python -m benchmarks.metrics_overhead
+    poetry run python -m benchmarks.metrics_overhead --requests 5000
+"""
+
+import argparse
+import os
+import statistics
+import time
+import typing
+
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+os.environ.setdefault("PASSWORD_HASH_ITERATIONS", "1000")
+
+from banking import api  # noqa: E402
+
+
+def median_latency(
+    request: typing.Callable[[], typing.Any], requests: int
+) -> float:
+    """Median latency of `requests` calls, in microseconds"""
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        request()
+        latencies.append(time.perf_counter() - started)
+    return statistics.median(latencies) * 1000000
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    client = api.app.test_client()
+    credentials = {"email_address": "bench@example.com", "password": "x"}
+    client.post("/api/v1/signup", json=dict(credentials, full_name="Bench"))
+    token = client.post("/api/v1/login", json=credentials).get_json()[
+        "access_token"
+    ]
+    headers = {"Authorization": f"Bearer {token}"}
+    cases = {
+        "GET /account": lambda: client.get(
+            "/api/v1/account", headers=headers
+        ),
+        "POST /deposit": lambda: client.post(
+            "/api/v1/deposit", json={"amount": 1}, headers=headers
+        ),
+    }
+
+    print(f"{'request':>14} {'off':>9} {'on':>9} {'overhead':>9}")
+    for name, request in cases.items():
+        # Alternate on and off so drift affects both the same.
+        timings: typing.Dict[bool, typing.List[float]] = {
+            False: [],
+            True: [],
+        }
+        for _ in range(args.rounds):
+            for enabled in (False, True):
+                api._metrics_enabled = enabled
+                timings[enabled].append(median_latency(request, args.requests))
+        off, on = min(timings[False]), min(timings[True])
+        print(
+            f"{name:>14} {off:>7.1f}us {on:>7.1f}us "
+            f"{on - off:>+7.1f}us ({(on - off) / off * 100:+.1f}%)"
+        )
+
+
+if __name__ == "__main__":
+    main()
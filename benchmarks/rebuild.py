@@ -0,0 +1,80 @@
+# coding=utf-8
+"""Measure the time to rebuild the balances read model of a Bank stored
+in SQLite against the number of worker processes.
+
+    poetry run python -m benchmarks.rebuild
+    poetry run python -m benchmarks.rebuild --events 1000000 \\
+        --workers 0 1 2 4 8
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import typing
+
+from banking.applicationmodel import Bank
+from banking.readmodel import AccountBalances
+from banking.rebuild import rebuild_balances
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=200000)
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--partition-size", type=int, default=10000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[0, 1, 2, os.cpu_count() or 1],
+    )
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        bank = Bank(
+            env={
+                "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+                "SQLITE_DBNAME": os.path.join(directory, "bank.db"),
+                "PASSWORD_HASH_ITERATIONS": "1000",
+                "CREDENTIAL_POOL_WORKERS": "0",
+            }
+        )
+        account_ids = bank.open_accounts(
+            [
+                (f"User {number}", f"user{number}@example.com", "secret")
+                for number in range(args.accounts)
+            ]
+        )[0]
+        with bank.unit_of_work():
+            for number in range(args.events - args.accounts):
+                bank.deposit_funds(account_ids[number % args.accounts], 1)
+
+        started = time.perf_counter()
+        balances = AccountBalances()
+        balances.follow(bank.name, bank.notification_log)
+        balances.pull_and_process(bank.name)
+        sequential = time.perf_counter() - started
+        print(f"cores: {os.cpu_count()}")
+        print(f"{'workers':>10} {'seconds':>8} {'events/s':>9}")
+        print(
+            f"{'follower':>10} {sequential:>8.2f} "
+            f"{args.events / sequential:>9.0f}"
+        )
+        for workers in sorted(set(args.workers)):
+            rebuilt = AccountBalances()
+            report = rebuild_balances(
+                bank,
+                rebuilt,
+                workers=workers,
+                partition_size=args.partition_size,
+            )
+            assert rebuilt.table == balances.table
+            print(
+                f"{workers:>10} {report.seconds:>8.2f} {report.rate:>9.0f}"
+            )
+        bank.close()
+
+
+if __name__ == "__main__":
+    main()
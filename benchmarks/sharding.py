@@ -0,0 +1,96 @@
+# coding=utf-8
+"""Measure deposit and transfer throughput of the Bank in this process
+against a ShardedBank at each number of shards.
+
+    poetry run python -m benchmarks.sharding
+    poetry run python -m benchmarks.sharding --shards 1 2 4 8 \\
+        --threads 32
+"""
+
+import argparse
+import os
+import random
+import threading
+import time
+import typing
+from uuid import UUID
+
+from banking.applicationmodel import Bank
+from banking.sharding import ShardedBank
+
+
+def run(
+    bank: typing.Any, threads: int, operations: int, accounts: int
+) -> typing.Tuple[float, int]:
+    """Deposit into and transfer between random accounts from
+    `threads` threads, `operations` times each
+
+    Args:
+        bank (Bank or ShardedBank)
+        threads (int)
+        operations (int)
+        accounts (int)
+
+    Returns:
+        Tuple[float, int]: seconds and failed operations
+    """
+    account_ids: typing.List[UUID] = bank.open_accounts(
+        [
+            (f"User {number}", f"user{number}@example.com", "secret")
+            for number in range(accounts)
+        ]
+    )[0]
+    failures = [0]
+    lock = threading.Lock()
+
+    def work() -> None:
+        for number in range(operations):
+            source, destination = random.sample(account_ids, 2)
+            try:
+                if number % 2:
+                    bank.transfer_funds(source, destination, 1)
+                else:
+                    bank.deposit_funds(source, 10)
+            except Exception:
+                with lock:
+                    failures[0] += 1
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - started, failures[0]
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--operations", type=int, default=200)
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument(
+        "--shards", type=int, nargs="+", default=[1, 2, os.cpu_count() or 1]
+    )
+    args = parser.parse_args(argv)
+    env = {"PASSWORD_HASH_ITERATIONS": "1000", "CREDENTIAL_POOL_WORKERS": "0"}
+
+    print(f"cores: {os.cpu_count()}")
+    print(f"{'bank':>12} {'ops/s':>8} {'failed':>6}")
+    bank: typing.Any = Bank(env=env)
+    seconds, failures = run(bank, args.threads, args.operations, args.accounts)
+    bank.close()
+    total = args.threads * args.operations
+    print(f"{'in-process':>12} {total / seconds:>8.0f} {failures:>6}")
+    for shards in sorted(set(args.shards)):
+        bank = ShardedBank(shards, env=env)
+        seconds, failures = run(
+            bank, args.threads, args.operations, args.accounts
+        )
+        bank.close()
+        name = f"{shards} shards"
+        print(f"{name:>12} {total / seconds:>8.0f} {failures:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# coding=utf-8
+"""Measure Bank.get_account latency as the history of an account grows,
+with and without Account snapshotting.
+
+    poetry run python -m benchmarks.snapshotting
+    PERSISTENCE_MODULE=eventsourcing.sqlite SQLITE_DBNAME=bench.db \\
+        poetry run python -m benchmarks.snapshotting
+"""
+
+import argparse
+import time
+import typing
+
+from banking.applicationmodel import Bank
+
+HISTORY_LENGTHS = (10, 100, 1000, 10000, 100000)
+SAVE_BATCH_SIZE = 1000
+
+
+def build_history(bank: Bank, email_address: str, length: int) -> typing.Any:
+    """Open an account and credit it until it has `length` events
+
+    Args:
+        bank (Bank)
+        email_address (str)
+        length (int)
+
+    Returns:
+        UUID
+    """
+    account_id = bank.open_account("Bench", email_address, "bench")
+    account = bank.get_account(account_id)
+    for number in range(1, length):
+        account.credit(1)
+        if number % SAVE_BATCH_SIZE == 0:
+            bank.save(account)
+    bank.save(account)
+    return account_id
+
+
+def time_loads(bank: Bank, account_id: typing.Any, repeat: int) -> float:
+    """Average seconds taken by Bank.get_account
+
+    Args:
+        bank (Bank)
+        account_id (UUID)
+        repeat (int)
+
+    Returns:
+        float
+    """
+    started = time.perf_counter()
+    for _ in range(repeat):
+        bank.get_account(account_id)
+    return (time.perf_counter() - started) / repeat
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--interval", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--lengths", type=int, nargs="+", default=list(HISTORY_LENGTHS)
+    )
+    args = parser.parse_args(argv)
+
+    print(f"{'events':>8} {'no snapshots (ms)':>18} {'snapshots (ms)':>15}")
+    for length in args.lengths:
+        results = []
+        for interval in (0, args.interval):
+            bank = Bank(env={"ACCOUNT_SNAPSHOTTING_INTERVAL": str(interval)})
+            email_address = f"bench-{length}-{interval}@example.com"
+            account_id = build_history(bank, email_address, length)
+            results.append(time_loads(bank, account_id, args.repeat) * 1000)
+            bank.close()
+        print(f"{length:>8} {results[0]:>18.3f} {results[1]:>15.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# coding=utf-8
+"""Measure deposit and transfer throughput on the default eventsourcing
+SQLite persistence against the tuned banking.sqlite profile, with and
+without group commit.
+
+    poetry run python -m benchmarks.sqlite_profile
+    poetry run python -m benchmarks.sqlite_profile --threads 1 8 32 \\
+        --operations 500 --synchronous NORMAL --window 2
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+import typing
+
+from banking.applicationmodel import Bank
+
+PROFILES = {
+    "default": {"PERSISTENCE_MODULE": "eventsourcing.sqlite"},
+    "tuned": {
+        "PERSISTENCE_MODULE": "banking.sqlite",
+        "SQLITE_GROUP_COMMIT_SIZE": "0",
+    },
+    "group": {"PERSISTENCE_MODULE": "banking.sqlite"},
+}
+THREADS = (1, 8)
+
+
+def run_threads(
+    threads: int, operations: int, work: typing.Callable[[int], None]
+) -> float:
+    """Operations per second of `threads` threads calling work(thread)
+    `operations` times each"""
+
+    def run(thread: int) -> None:
+        for _ in range(operations):
+            work(thread)
+
+    workers = [
+        threading.Thread(target=run, args=(thread,))
+        for thread in range(threads)
+    ]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return threads * operations / (time.perf_counter() - started)
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--threads", type=int, nargs="+", default=list(THREADS)
+    )
+    parser.add_argument("--operations", type=int, default=300)
+    parser.add_argument(
+        "--synchronous",
+        default="FULL",
+        help="SQLITE_SYNCHRONOUS of the tuned profiles",
+    )
+    parser.add_argument(
+        "--window",
+        default="0",
+        help="SQLITE_GROUP_COMMIT_WINDOW in milliseconds",
+    )
+    args = parser.parse_args(argv)
+
+    print(
+        f"{'profile':>8} {'threads':>7} {'deposits/s':>11} "
+        f"{'transfers/s':>12} {'conflicts':>10}"
+    )
+    for threads in args.threads:
+        for profile, settings in PROFILES.items():
+            with tempfile.TemporaryDirectory() as directory:
+                bank = Bank(
+                    env=dict(
+                        settings,
+                        SQLITE_SYNCHRONOUS=args.synchronous,
+                        SQLITE_GROUP_COMMIT_WINDOW=args.window,
+                        SQLITE_DBNAME=os.path.join(directory, "bench.db"),
+                        PASSWORD_HASH_ITERATIONS="1",
+                        CREDENTIAL_POOL_WORKERS="0",
+                        CONFLICT_RETRY_ATTEMPTS="50",
+                    )
+                )
+                # Each thread moves money between two accounts of its own.
+                accounts = [
+                    (
+                        bank.open_account("A", f"a{n}@example.com", "a"),
+                        bank.open_account("B", f"b{n}@example.com", "b"),
+                    )
+                    for n in range(threads)
+                ]
+                deposits = run_threads(
+                    threads,
+                    args.operations,
+                    lambda thread: bank.deposit_funds(accounts[thread][0], 1),
+                )
+                transfers = run_threads(
+                    threads,
+                    args.operations,
+                    lambda thread: bank.transfer_funds(
+                        accounts[thread][0], accounts[thread][1], 1
+                    ),
+                )
+                print(
+                    f"{profile:>8} {threads:>7} {deposits:>11.0f} "
+                    f"{transfers:>12.0f} "
+                    f"{bank.concurrency_stats()['conflicts']:>10}"
+                )
+                bank.close()
+
+
+if __name__ == "__main__":
+    main()
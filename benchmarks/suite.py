@@ -0,0 +1,376 @@
+# coding=utf-8
+"""Run the Bank and HTTP API benchmark suite on the in-memory and SQLite
+stores, sweeping account history length and concurrency, and write the
+results as JSON to compare them with the results of another commit.
+
+    poetry run python -m benchmarks.suite --output results.json
+    poetry run python -m benchmarks.suite --quick --output new.json \\
+        --compare results.json --threshold 10
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import typing
+from uuid import UUID
+
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+
+from banking import api  # noqa: E402
+from banking.applicationmodel import Bank  # noqa: E402
+
+PERSISTENCE_MODULES = {
+    "popo": "eventsourcing.popo",
+    "sqlite": "eventsourcing.sqlite",
+}
+HISTORY_LENGTHS = (10, 1000)
+THREADS = (1, 8)
+SETTINGS = {
+    "PASSWORD_HASH_ITERATIONS": "1000",
+    "CREDENTIAL_POOL_WORKERS": "0",
+}
+
+Result = typing.Dict[str, typing.Any]
+
+
+def measure(
+    work: typing.Callable[[int, int], typing.Any],
+    threads: int,
+    operations: int,
+    rounds: int = 3,
+) -> typing.Dict[str, float]:
+    """Call work(thread, number) `operations` times on each of
+    `threads` threads, after one untimed call per thread, and keep the
+    round with the lowest median so one noisy round does not count as
+    a regression
+
+    Args:
+        work (Callable[[int, int], Any]): number is unique per thread
+        threads (int)
+        operations (int)
+        rounds (int)
+
+    Returns:
+        Dict[str, float]: throughput and latency percentiles in ms
+    """
+    best: typing.Dict[str, float] = {}
+    for round_number in range(rounds):
+        latencies: typing.List[float] = []
+        lock = threading.Lock()
+        first = round_number * (operations + 1)
+
+        def run(thread: int) -> None:
+            work(thread, first)
+            own = []
+            for number in range(first + 1, first + 1 + operations):
+                started = time.perf_counter()
+                work(thread, number)
+                own.append(time.perf_counter() - started)
+            with lock:
+                latencies.extend(own)
+
+        workers = [
+            threading.Thread(target=run, args=(thread,))
+            for thread in range(threads)
+        ]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        seconds = time.perf_counter() - started
+        latencies.sort()
+
+        def percentile(fraction: float) -> float:
+            index = min(len(latencies) - 1, int(len(latencies) * fraction))
+            return round(latencies[index] * 1000, 4)
+
+        stats = {
+            "ops_per_second": round(len(latencies) / seconds, 1),
+            "p50_ms": round(statistics.median(latencies) * 1000, 4),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+        }
+        if not best or stats["p50_ms"] < best["p50_ms"]:
+            best = stats
+    return best
+
+
+def open_with_history(
+    bank: typing.Any, email_address: str, history: int
+) -> UUID:
+    """Open an account with `history` events and enough funds"""
+    account_id = bank.open_account("Bench", email_address, "bench")
+    with bank.unit_of_work():
+        for _ in range(history - 1):
+            bank.deposit_funds(account_id, 100)
+    return account_id
+
+
+def bank_cases(
+    bank: Bank, history: int, threads: int, operations: int
+) -> typing.Iterator[typing.Tuple[str, typing.Dict[str, float]]]:
+    """Benchmark the Bank methods on accounts with `history` events,
+    each thread working on accounts of its own"""
+    prefix = f"h{history}-t{threads}"
+    sources = [
+        open_with_history(bank, f"{prefix}-{thread}@example.com", history)
+        for thread in range(threads)
+    ]
+    destinations = [
+        bank.open_account("Bench", f"{prefix}-{thread}-to@example.com", "x")
+        for thread in range(threads)
+    ]
+
+    yield "bank.open_account", measure(
+        lambda thread, number: bank.open_account(
+            "Bench", f"{prefix}-{thread}-{number}@example.com", "bench"
+        ),
+        threads,
+        operations,
+    )
+    yield "bank.deposit_funds", measure(
+        lambda thread, _: bank.deposit_funds(sources[thread], 100),
+        threads,
+        operations,
+    )
+    yield "bank.withdraw_funds", measure(
+        lambda thread, _: bank.withdraw_funds(sources[thread], 1),
+        threads,
+        operations,
+    )
+    yield "bank.transfer_funds", measure(
+        lambda thread, _: bank.transfer_funds(
+            sources[thread], destinations[thread], 1
+        ),
+        threads,
+        operations,
+    )
+    yield "bank.get_account", measure(
+        lambda thread, _: bank.get_account(sources[thread]),
+        threads,
+        operations,
+    )
+
+
+def api_cases(
+    bank: Bank, history: int, threads: int, operations: int
+) -> typing.Iterator[typing.Tuple[str, typing.Dict[str, float]]]:
+    """Benchmark the HTTP API through the Flask test client, in this
+    process, on accounts with `history` events"""
+    prefix = f"api-h{history}-t{threads}"
+    client = api.app.test_client()
+    headers = []
+    for thread in range(threads):
+        email_address = f"{prefix}-{thread}@example.com"
+        open_with_history(bank, email_address, history)
+        response = client.post(
+            "/api/v1/login",
+            json={"email_address": email_address, "password": "bench"},
+        )
+        token = response.get_json()["access_token"]
+        headers.append({"Authorization": f"Bearer {token}"})
+
+    def request(method: str, path: str, **kwargs: typing.Any) -> None:
+        response = client.open(path, method=method, **kwargs)
+        assert response.status_code < 300, response.get_data(as_text=True)
+
+    yield "api.account", measure(
+        lambda thread, _: request(
+            "GET", "/api/v1/account", headers=headers[thread]
+        ),
+        threads,
+        operations,
+    )
+    yield "api.deposit", measure(
+        lambda thread, _: request(
+            "POST",
+            "/api/v1/deposit",
+            json={"amount": 100},
+            headers=headers[thread],
+        ),
+        threads,
+        operations,
+    )
+
+
+def run_suite(
+    persistence: typing.Iterable[str],
+    histories: typing.Iterable[int],
+    threads: typing.Iterable[int],
+    operations: int,
+) -> typing.List[Result]:
+    """Run every case of the suite, on a new store per persistence
+    module
+
+    Returns:
+        List[Result]
+    """
+    results = []
+    for name in persistence:
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(
+                SETTINGS,
+                PERSISTENCE_MODULE=PERSISTENCE_MODULES[name],
+                SQLITE_DBNAME=os.path.join(directory, "bank.db"),
+            )
+            # The API reads its settings from the environment.
+            saved = {key: os.environ.get(key) for key in env}
+            os.environ.update(env)
+            bank, balances = api.start_bank()
+            api._bank, api._balances = bank, balances
+            try:
+                for history in histories:
+                    for count in threads:
+                        params = {
+                            "persistence": name,
+                            "history": history,
+                            "threads": count,
+                        }
+                        for cases in (bank_cases, api_cases):
+                            for case, stats in cases(
+                                bank, history, count, operations
+                            ):
+                                result = dict(params, case=case, **stats)
+                                print(format_result(result), flush=True)
+                                results.append(result)
+            finally:
+                bank.close()
+                for key, value in saved.items():
+                    if value is None:
+                        os.environ.pop(key)
+                    else:
+                        os.environ[key] = value
+    return results
+
+
+def result_key(result: Result) -> str:
+    """Name of a result, the same across runs of the suite"""
+    return (
+        f"{result['case']}[{result['persistence']}"
+        f",h={result['history']},t={result['threads']}]"
+    )
+
+
+def format_result(result: Result) -> str:
+    return (
+        f"{result_key(result):<44} {result['ops_per_second']:>9.0f}/s "
+        f"p50={result['p50_ms']:.3f}ms p99={result['p99_ms']:.3f}ms"
+    )
+
+
+def compare(
+    baseline: typing.List[Result],
+    results: typing.List[Result],
+    threshold: float,
+) -> typing.List[str]:
+    """Print the change of the median latency of every result against
+    the baseline and return the keys of the results slower by more than
+    `threshold` percent
+
+    Args:
+        baseline (List[Result])
+        results (List[Result])
+        threshold (float): percent
+
+    Returns:
+        List[str]
+    """
+    before = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        key = result_key(result)
+        if key not in before:
+            continue
+        old, new = before[key]["p50_ms"], result["p50_ms"]
+        change = (new - old) / old * 100 if old else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(key)
+            flag = "  REGRESSION"
+        print(
+            f"{key:<44} {old:>8.3f}ms -> {new:>8.3f}ms {change:+6.1f}%{flag}"
+        )
+    return regressions
+
+
+def metadata() -> typing.Dict[str, typing.Any]:
+    """Where and on what the suite ran"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--persistence",
+        nargs="+",
+        choices=sorted(PERSISTENCE_MODULES),
+        default=sorted(PERSISTENCE_MODULES),
+    )
+    parser.add_argument(
+        "--history", type=int, nargs="+", default=list(HISTORY_LENGTHS)
+    )
+    parser.add_argument(
+        "--threads", type=int, nargs="+", default=list(THREADS)
+    )
+    parser.add_argument("--operations", type=int, default=200)
+    parser.add_argument(
+        "--quick",
+        action="store_true",
+        help="one history length, one thread and 50 operations",
+    )
+    parser.add_argument("--output")
+    parser.add_argument("--compare", help="results of an earlier run")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10.0,
+        help="percent of median latency counted as a regression",
+    )
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.history, args.threads = args.history[:1], [1]
+        args.operations = 50
+
+    results = run_suite(
+        args.persistence, args.history, args.threads, args.operations
+    )
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(
+                {"metadata": metadata(), "results": results},
+                output,
+                indent=2,
+            )
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        print(f"against {baseline['metadata']['commit']}")
+        if compare(baseline["results"], results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
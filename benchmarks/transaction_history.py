@@ -0,0 +1,68 @@
+# coding=utf-8
+"""Measure the latency of the first page of transactions of accounts
+with longer and longer histories, stored in SQLite, against loading
+the account.
+
+    poetry run python -m benchmarks.transaction_history
+    poetry run python -m benchmarks.transaction_history --events 1000 \\
+        100000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import typing
+
+from banking.applicationmodel import Bank
+
+HISTORY_LENGTHS = (100, 1000, 10000)
+
+
+def timed(func: typing.Callable[[], typing.Any], repeat: int) -> float:
+    """Best time of `repeat` calls, in milliseconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--events", type=int, nargs="+", default=list(HISTORY_LENGTHS)
+    )
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    print(f"{'events':>8} {'page':>9} {'load':>9}")
+    for events in args.events:
+        with tempfile.TemporaryDirectory() as directory:
+            bank = Bank(
+                env={
+                    "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+                    "SQLITE_DBNAME": os.path.join(directory, "bank.db"),
+                    "ACCOUNT_SNAPSHOTTING_INTERVAL": "0",
+                    "AGGREGATE_CACHE_MAXSIZE": "",
+                    "PASSWORD_HASH_ITERATIONS": "1000",
+                    "CREDENTIAL_POOL_WORKERS": "0",
+                }
+            )
+            account_id = bank.open_account("A", "a@example.com", "secret")
+            with bank.unit_of_work():
+                for _ in range(events):
+                    bank.deposit_funds(account_id, 1)
+            page = timed(
+                lambda: bank.get_transactions(account_id, limit=args.limit),
+                args.repeat,
+            )
+            load = timed(lambda: bank.get_account(account_id), args.repeat)
+            bank.close()
+        print(f"{events:>8} {page:>7.2f}ms {load:>7.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
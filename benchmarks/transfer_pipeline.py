@@ -0,0 +1,104 @@
+# coding=utf-8
+"""Measure the latency of transfers into one busy account, completed
+in the request against requested and completed by the Bank pipeline.
+
+    poetry run python -m benchmarks.transfer_pipeline
+    poetry run python -m benchmarks.transfer_pipeline --threads 32 \\
+        --transfers 100
+"""
+
+import argparse
+import os
+import statistics
+import threading
+import time
+import typing
+
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+os.environ.setdefault("PASSWORD_HASH_ITERATIONS", "1000")
+os.environ.setdefault("CREDENTIAL_POOL_WORKERS", "0")
+
+from banking.api import start_bank  # noqa: E402
+from banking.applicationmodel import Bank  # noqa: E402
+
+
+def run(
+    bank: Bank, threads: int, transfers: int, pipeline: bool
+) -> typing.Tuple[float, typing.List[float], float]:
+    """Transfer from `threads` accounts into one merchant account,
+    `transfers` times each
+
+    Args:
+        bank (Bank)
+        threads (int)
+        transfers (int)
+        pipeline (bool): request the transfers instead
+
+    Returns:
+        Tuple[float, List[float], float]: seconds, latency of each
+            request and seconds until the merchant got every credit
+    """
+    sources = bank.open_accounts(
+        [
+            (f"User {number}", f"user{number}@example.com", "secret")
+            for number in range(threads)
+        ]
+    )[0]
+    merchant = bank.open_account("Merchant", "merchant@example.com", "x")
+    for source in sources:
+        bank.deposit_funds(source, transfers)
+    latencies: typing.List[float] = []
+    lock = threading.Lock()
+
+    def work(source: typing.Any) -> None:
+        for _ in range(transfers):
+            started = time.perf_counter()
+            if pipeline:
+                bank.request_transfer(source, merchant, 1)
+            else:
+                bank.transfer_funds(source, merchant, 1)
+            latency = time.perf_counter() - started
+            with lock:
+                latencies.append(latency)
+
+    workers = [
+        threading.Thread(target=work, args=(source,)) for source in sources
+    ]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    seconds = time.perf_counter() - started
+    while bank.get_balance(merchant) < threads * transfers:
+        time.sleep(0.001)
+    return seconds, sorted(latencies), time.perf_counter() - started
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--transfers", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    print(
+        f"{'mode':>8} {'req/s':>7} {'p50':>8} {'p99':>8} "
+        f"{'settled':>8} {'conflicts':>9}"
+    )
+    for pipeline in (False, True):
+        bank, _ = start_bank(async_transfers=pipeline)
+        seconds, latencies, settled = run(
+            bank, args.threads, args.transfers, pipeline
+        )
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        mode = "pipeline" if pipeline else "sync"
+        print(
+            f"{mode:>8} {len(latencies) / seconds:>7.0f} "
+            f"{statistics.median(latencies) * 1000:>6.2f}ms "
+            f"{p99 * 1000:>6.2f}ms {settled:>7.2f}s "
+            f"{bank.concurrency_stats()['conflicts']:>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -74,6 +74,20 @@ echo $RESULT
 exit 1
 fi
 
+echo Batch transfer 1 dollar twice to Bob:
+
+BATCH='{"transfers": [{"amount": 1, "destination_id": "'$BOB'"}, {"amount": 1, "destination_id": "'$BOB'"}]}'
+RESULT=$(curl -s -H "Content-Type: application/json" -X POST http://localhost:5000/api/v1/transfers/batch -H "Authorization: Bearer $ALICETOKEN" -d "$BATCH" | jq -r ".committed")
+
+if [ "$RESULT" = "true" ]
+then
+echo Success batch transfer
+else
+echo $RESULT
+echo Batch Transfer Failed
+exit 1
+fi
+
 echo Withdraw 10 dollars on Alice account:
 
 ALICEDEPOSIT=$(curl -s -H "Content-Type: application/json" -X POST http://localhost:5000/api/v1/withdraw -H "Authorization: Bearer $ALICETOKEN" -d '{"amount": 10}' | jq -r ".result")
@@ -1,3 +1,10 @@
+import os
+
+# Cheap password hashes in the calling thread keep the tests fast,
+# the credential pool has its own tests.
+os.environ.setdefault("PASSWORD_HASH_ITERATIONS", "1000")
+os.environ.setdefault("CREDENTIAL_POOL_WORKERS", "0")
+
 import pytest
 from flask_jwt_extended import create_access_token
 
@@ -1,8 +1,13 @@
 import json
+import time
 from uuid import uuid4
 
-from banking.api import app
+import pytest
+
+from banking import api
+from banking.api import app, start_bank, token_cache
 from banking.applicationmodel import Bank
+from banking.utils import metrics
 
 
 def test_signup():
@@ -38,6 +43,7 @@ def test_signup():
         "/api/v1/account", headers={"Authorization": f"Bearer {bearer_token}"}
     )
     assert response_account.status_code == 200
+    assert response_account.json["balance"] == "0"
 
     # Deposit Request
     data_deposit = {"amount": 500}
@@ -61,6 +67,12 @@ def test_signup():
     assert response_withdraw.status_code == 200
     assert response_withdraw.json["result"] == "success"
 
+    # Account Request reads the balances read model
+    response_account = client.get(
+        "/api/v1/account", headers={"Authorization": f"Bearer {bearer_token}"}
+    )
+    assert response_account.json["balance"] == "450"
+
     # Transfer Request
     data_user_to_transfer = {
         "full_name": "Test User Dest",
@@ -86,3 +98,314 @@ def test_signup():
     )
     assert response_transfer.status_code == 200
     assert response_transfer.json["result"] == "success"
+
+
+def test_signup_existing_account(client):
+    data = {
+        "full_name": "Twice",
+        "email_address": "twice@example.com",
+        "password": "testpass",
+    }
+    response = client.post("/api/v1/signup", json=data)
+    assert response.status_code == 201
+    response = client.post("/api/v1/signup", json=data)
+    assert response.status_code == 409
+    assert "twice@example.com" in response.json["error"]
+
+
+def test_account_not_found(access_token):
+    client = app.test_client()
+    response_account = client.get(
+        "/api/v1/account", headers={"Authorization": f"Bearer {access_token}"}
+    )
+    assert response_account.status_code == 404
+    assert response_account.json["error"] == "Account not found."
+
+
+def test_balances_projection(access_token):
+    client = app.test_client()
+    response = client.get("/api/v1/projections/balances")
+    assert response.status_code == 401
+
+    response = client.get(
+        "/api/v1/projections/balances",
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    assert response.status_code == 200
+    assert response.json["lag"] == 0
+    assert response.json["position"] >= 0
+
+
+def _signup_and_login(client, email_address):
+    response_signup = client.post(
+        "/api/v1/signup",
+        data=json.dumps(
+            {
+                "full_name": email_address,
+                "email_address": email_address,
+                "password": "testpass",
+            }
+        ),
+        content_type="application/json",
+    )
+    response_login = client.post(
+        "/api/v1/login",
+        data=json.dumps(
+            {"email_address": email_address, "password": "testpass"}
+        ),
+        content_type="application/json",
+    )
+    return (
+        response_signup.json["account_id"],
+        response_login.json["access_token"],
+    )
+
+
+def test_transfer_batch():
+    client = app.test_client()
+    _, bearer_token = _signup_and_login(client, "payroll@test.com")
+    employee_id, _ = _signup_and_login(client, "employee@test.com")
+    headers = {"Authorization": f"Bearer {bearer_token}"}
+    client.post(
+        "/api/v1/deposit",
+        data=json.dumps({"amount": 100}),
+        content_type="application/json",
+        headers=headers,
+    )
+
+    def post_batch(amounts, mode="atomic"):
+        return client.post(
+            "/api/v1/transfers/batch",
+            data=json.dumps(
+                {
+                    "mode": mode,
+                    "transfers": [
+                        {"destination_id": employee_id, "amount": amount}
+                        for amount in amounts
+                    ],
+                }
+            ),
+            content_type="application/json",
+            headers=headers,
+        )
+
+    response = post_batch([60, 60])
+    assert response.status_code == 400
+    assert response.json["committed"] is False
+    assert response.json["results"][0] == {"status": "aborted", "error": None}
+
+    response = post_batch([60, 60], mode="best_effort")
+    assert response.status_code == 200
+    assert response.json["committed"] is True
+    assert [r["status"] for r in response.json["results"]] == [
+        "success",
+        "failed",
+    ]
+
+    response = post_batch([1], mode="unknown")
+    assert response.status_code == 400
+
+
+def test_token_cache_and_logout():
+    client = app.test_client()
+    account_id, token = _signup_and_login(client, "cache@example.com")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    # Only the first request decodes the token.
+    hits = token_cache().stats()["hits"]
+    for _ in range(3):
+        response = client.get("/api/v1/account", headers=headers)
+        assert response.status_code == 200
+        assert response.json["identity"] == account_id
+    assert token_cache().stats()["hits"] == hits + 2
+
+    response = client.post("/api/v1/logout", headers=headers)
+    assert response.status_code == 200
+    response = client.get("/api/v1/account", headers=headers)
+    assert response.status_code == 401
+
+    # Every token of a revoked identity is rejected.
+    response = client.post(
+        "/api/v1/login",
+        data=json.dumps(
+            {"email_address": "cache@example.com", "password": "testpass"}
+        ),
+        content_type="application/json",
+    )
+    headers = {"Authorization": f"Bearer {response.json['access_token']}"}
+    assert client.get("/api/v1/account", headers=headers).status_code == 200
+    token_cache().revoke_identity(account_id)
+    assert client.get("/api/v1/account", headers=headers).status_code == 401
+
+    response = client.get("/api/v1/account")
+    assert response.status_code == 401
+
+
+def test_async_transfers(monkeypatch):
+    with pytest.raises(ValueError):
+        start_bank(1, async_transfers=True)
+    bank, balances = start_bank(async_transfers=True)
+    monkeypatch.setattr(api, "_bank", bank)
+    monkeypatch.setattr(api, "_balances", balances)
+    monkeypatch.setattr(api, "_async_transfers", True)
+    client = app.test_client()
+    _, bearer_token = _signup_and_login(client, "async@test.com")
+    destination_id, other_token = _signup_and_login(client, "later@test.com")
+    headers = {"Authorization": f"Bearer {bearer_token}"}
+    client.post(
+        "/api/v1/deposit",
+        data=json.dumps({"amount": 100}),
+        content_type="application/json",
+        headers=headers,
+    )
+
+    response = client.post(
+        "/api/v1/transfer",
+        data=json.dumps({"destination_id": destination_id, "amount": 60}),
+        content_type="application/json",
+        headers=headers,
+    )
+    assert response.status_code == 202
+    assert response.json["status"] == "pending"
+    status_url = f"/api/v1/transfers/{response.json['transfer_id']}"
+
+    # The Bank completes the transfer on a thread of its own.
+    deadline = time.monotonic() + 5
+    while True:
+        response = client.get(status_url, headers=headers)
+        if response.json["status"] != "pending":
+            break
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert response.status_code == 200
+    assert response.json["status"] == "completed"
+    assert response.json["amount"] == 60
+    assert response.json["error"] is None
+    response = client.get(
+        "/api/v1/account", headers={"Authorization": f"Bearer {other_token}"}
+    )
+    assert response.json["balance"] == "60"
+
+    # Only the source sees the transfer.
+    response = client.get(
+        status_url, headers={"Authorization": f"Bearer {other_token}"}
+    )
+    assert response.status_code == 404
+    assert response.json == {"error": "Transfer not found."}
+
+
+def test_account_transactions():
+    client = app.test_client()
+    _, bearer_token = _signup_and_login(client, "history@test.com")
+    headers = {"Authorization": f"Bearer {bearer_token}"}
+    for amount in (10, 20, 30):
+        client.post(
+            "/api/v1/deposit",
+            data=json.dumps({"amount": amount}),
+            content_type="application/json",
+            headers=headers,
+        )
+
+    response = client.get(
+        "/api/v1/account/transactions?limit=2", headers=headers
+    )
+    assert response.status_code == 200
+    assert [item["amount"] for item in response.json["transactions"]] == [
+        30,
+        20,
+    ]
+    assert response.json["transactions"][0]["type"] == "credit"
+    assert response.json["transactions"][0]["transfer_id"] is None
+    cursor = response.json["next_cursor"]
+    response = client.get(
+        f"/api/v1/account/transactions?limit=2&cursor={cursor}",
+        headers=headers,
+    )
+    assert [item["amount"] for item in response.json["transactions"]] == [10]
+    assert response.json["next_cursor"] is None
+
+    for query in ("limit=0", "limit=201", "limit=x", "cursor=!", "cursor=eA"):
+        response = client.get(
+            f"/api/v1/account/transactions?{query}", headers=headers
+        )
+        assert response.status_code == 400
+
+
+def test_metrics(monkeypatch):
+    client = app.test_client()
+    account_id, bearer_token = _signup_and_login(client, "metrics@test.com")
+    headers = {"Authorization": f"Bearer {bearer_token}"}
+    for data in ({"amount": 10}, {}):
+        client.post("/api/v1/deposit", json=data, headers=headers)
+    client.post(
+        "/api/v1/transfer",
+        json={"destination_id": account_id, "amount": 1},
+        headers=headers,
+    )
+    client.get("/api/v1/account", headers={"Authorization": "Bearer x"})
+    client.get("/api/v1/missing")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert "# TYPE banking_request_duration_seconds histogram" in (
+        response.get_data(as_text=True)
+    )
+    count = metrics.REQUEST_SECONDS.count
+    assert count("/api/v1/deposit", "success") >= 1
+    assert count("/api/v1/deposit", "bad_request") >= 1
+    assert count("/api/v1/transfer", "rejected") >= 1
+    assert count("/api/v1/account", "http_422") >= 1
+    assert count("unmatched", "http_404") >= 1
+    for phase in ("jwt", "load", "save", "handler", "framework"):
+        assert metrics.PHASE_SECONDS.count("/api/v1/deposit", phase) >= 1
+
+    # Nothing is recorded with METRICS_ENABLED off.
+    monkeypatch.setattr(api, "_metrics_enabled", False)
+    before = count("/metrics", "success")
+    client.get("/metrics")
+    assert count("/metrics", "success") == before
+
+
+def test_idempotency_key(monkeypatch):
+    client = app.test_client()
+    _, token = _signup_and_login(client, "retry@example.com")
+    destination_id, _ = _signup_and_login(client, "retry-to@example.com")
+
+    def post(path, body, key):
+        headers = {"Authorization": f"Bearer {token}"}
+        if key is not None:
+            headers["Idempotency-Key"] = key
+        return client.post(path, json=body, headers=headers)
+
+    response = post("/api/v1/deposit", {"amount": 500}, "deposit-1")
+    assert response.status_code == 200
+    assert "Idempotent-Replayed" not in response.headers
+
+    # Retries get the saved response without loading the account.
+    bank = api.bank()
+    monkeypatch.setattr(bank.repository, "get", None)
+    for _ in range(2):
+        response = post("/api/v1/deposit", {"amount": 500}, "deposit-1")
+        assert response.status_code == 200
+        assert response.json == {"result": "success"}
+        assert response.headers["Idempotent-Replayed"] == "true"
+    monkeypatch.undo()
+
+    body = {"destination_id": destination_id, "amount": 100}
+    for _ in range(2):
+        assert post("/api/v1/transfer", body, "transfer-1").status_code == 200
+    assert post("/api/v1/withdraw", {"amount": 50}, "w-1").status_code == 200
+    assert post("/api/v1/withdraw", {"amount": 50}, "w-1").status_code == 200
+    response = client.get(
+        "/api/v1/account", headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.json["balance"] == "350"
+
+    # A key belongs to one request, failures aren't saved.
+    assert post("/api/v1/deposit", {"amount": 1}, "w-1").status_code == 400
+    response = post("/api/v1/withdraw", {"amount": 10**9}, "w-2")
+    assert response.status_code == 400
+    assert post("/api/v1/deposit", {"amount": 1}, "").status_code == 400
+    assert post("/api/v1/deposit", {"amount": 1}, "k" * 256).status_code == 400
+    assert post("/api/v1/deposit", {"amount": 1}, None).status_code == 200
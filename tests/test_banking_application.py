@@ -1,20 +1,41 @@
 # coding=utf-8
 
+import json
+import threading
+import time
 import typing
-from uuid import UUID
+from datetime import datetime, timezone
+from hashlib import sha512
+from uuid import UUID, uuid4
 
 import pytest
 from werkzeug.exceptions import BadRequest
 from eventsourcing.application import AggregateNotFound
+from eventsourcing.persistence import RecordConflictError, StoredEvent
+from eventsourcing.utils import get_topic
 
 
 from banking.applicationmodel import Bank, AccountNotFoundError
+from banking.domainmodel import (
+    Account,
+    AccountShard,
+    idempotency_id_for,
+    shard_id_for,
+)
+from banking.utils.cache import CountingLRUCache
+from banking.utils.concurrency import StripedLock, backoff_delay
 from banking.utils.error_handler import error_handler
 from banking.utils.custom_exceptions import (
+    AccountAlreadyExistsError,
+    AccountBusyError,
     AccountClosedError,
     InsufficientFundsError,
     BadCredentials,
+    CredentialPoolBusyError,
+    IdempotencyKeyReusedError,
     TransactionError,
+    TransferNotFoundError,
+    TransferPipelineError,
 )
 
 
@@ -331,6 +352,18 @@ def test_error_handler_decorator():
     def raise_transaction_error():
         raise TransactionError("Transaction error.")
 
+    @error_handler
+    def raise_credential_pool_busy():
+        raise CredentialPoolBusyError("Too many logins in progress")
+
+    @error_handler
+    def raise_transfer_not_found():
+        raise TransferNotFoundError(uuid4())
+
+    @error_handler
+    def raise_transfer_pipeline_error():
+        raise TransferPipelineError("Transfers are unavailable")
+
     @error_handler
     def raise_generic_exception():
         raise Exception("Generic exception.")
@@ -352,6 +385,628 @@ def test_error_handler_decorator():
     assert response == {"error": "Transaction error."}
     assert status_code == 400
 
+    # Test CredentialPoolBusyError handling
+    response, status_code = raise_credential_pool_busy()
+    assert response == {"error": "Too many logins in progress"}
+    assert status_code == 503
+
+    # Test TransferNotFoundError handling
+    response, status_code = raise_transfer_not_found()
+    assert response == {"error": "Transfer not found."}
+    assert status_code == 404
+
+    # Test TransferPipelineError handling
+    response, status_code = raise_transfer_pipeline_error()
+    assert response == {"error": "Transfers are unavailable"}
+    assert status_code == 503
+
     # Test generic Exception handling
     with pytest.raises(BadRequest):
         raise_generic_exception()
+
+
+def test_snapshotting() -> None:
+    app = Bank(env={"ACCOUNT_SNAPSHOTTING_INTERVAL": "2"})
+
+    alice = _create_alice_with_200(app)
+    app.withdraw_funds(account_id=alice, amount=5000)
+
+    # Snapshots are taken at versions 2 and 4.
+    assert app.snapshots is not None
+    snapshots = list(app.snapshots.get(alice))
+    assertEqual([s.originator_version for s in snapshots], [2, 4])
+
+    # Loading starts from the latest snapshot.
+    assertEqual(app.get_balance(alice), 15000)
+    assertEqual(app.get_account(alice).version, 4)
+
+
+def test_snapshotting_disabled() -> None:
+    app = Bank(env={"ACCOUNT_SNAPSHOTTING_INTERVAL": "0"})
+    alice = _create_alice_with_200(app)
+
+    assert app.snapshots is None
+    assertEqual(app.get_balance(alice), 20000)
+
+    with pytest.raises(ValueError):
+        Bank(env={"ACCOUNT_SNAPSHOTTING_INTERVAL": "-1"})
+
+
+def test_aggregate_cache() -> None:
+    app = Bank(env={"AGGREGATE_CACHE_MAXSIZE": "1"})
+
+    alice = _create_alice_with_200(app)
+    assertEqual(app.get_balance(alice), 20000)
+    assertEqual(app.cache_stats()["hits"] > 0, True)
+
+    # Opening bob pushes alice out of the cache.
+    bob = _create_bob(app)
+    assertEqual(app.cache_stats()["evictions"], 1)
+    assertEqual(app.get_balance(alice), 20000)
+    assertEqual(app.cache_stats()["size"], 1)
+    assertEqual(app.get_balance(bob), 200)
+
+    # Misses are counted before the aggregate is replayed.
+    misses = app.cache_stats()["misses"]
+    app.get_balance(alice)
+    assertEqual(app.cache_stats()["misses"], misses + 1)
+
+
+def test_aggregate_cache_disabled() -> None:
+    app = Bank(env={"AGGREGATE_CACHE_MAXSIZE": ""})
+    alice = _create_alice_with_200(app)
+
+    assert app.repository.cache is None
+    assertEqual(app.cache_stats(), {})
+    assertEqual(app.get_balance(alice), 20000)
+
+
+def test_aggregate_cache_is_never_stale(tmp_path: typing.Any) -> None:
+    env = {
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+    }
+    app = Bank(env=env)
+    alice = _create_alice_with_200(app)
+    assertEqual(app.get_balance(alice), 20000)
+
+    # Another writer on the same store.
+    Bank(env=env).withdraw_funds(account_id=alice, amount=5000)
+
+    assertEqual(app.get_balance(alice), 15000)
+
+
+def test_counting_lru_cache() -> None:
+    cache: CountingLRUCache[str, int] = CountingLRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.put("c", 3)
+
+    assertEqual(cache.get("c"), 3)
+    with pytest.raises(KeyError):
+        cache.get("a")
+
+    # Removing an entry isn't a hit.
+    assertEqual(cache.get("b", evict=True), 2)
+    assertEqual(
+        cache.stats(),
+        {"hits": 1, "misses": 1, "evictions": 1, "size": 1, "maxsize": 2},
+    )
+
+
+def test_transfer_batch() -> None:
+    app = Bank()
+
+    alice = _create_alice_with_200(app)
+    bob = _create_bob(app)
+    sue = _create_sue(app)
+    unknown = app.get_account_id_by_email("unknown@example.com")
+
+    # All-or-nothing - one failure aborts the whole batch.
+    results = app.transfer_funds_batch(
+        [(alice, bob, 5000), (alice, unknown, 100), (bob, sue, 100)]
+    )
+    assertEqual(
+        [result.status for result in results],
+        ["aborted", "failed", "aborted"],
+    )
+    assertEqual(results[1].error, "Account not found.")
+    assertEqual(app.get_balance(alice), 20000)
+    assertEqual(app.get_balance(bob), 200)
+
+    # Best effort - the valid transfers are saved together.
+    app.close_account(sue)
+    results = app.transfer_funds_batch(
+        [
+            (alice, bob, 5000),
+            (alice, alice, 100),
+            (bob, sue, 100),
+            (bob, alice, 100000),
+            (bob, alice, 5100),
+        ],
+        atomic=False,
+    )
+    assertEqual(
+        [result.status for result in results],
+        ["success", "failed", "failed", "failed", "success"],
+    )
+    assertEqual(app.get_balance(alice), 20100)
+    assertEqual(app.get_balance(bob), 100)
+
+    # All-or-nothing - every transfer succeeds.
+    results = app.transfer_funds_batch([(alice, bob, 100), (alice, bob, 1)])
+    assertEqual([result.status for result in results], ["success"] * 2)
+    assertEqual(app.get_balance(bob), 201)
+
+    with pytest.raises(TransactionError):
+        Bank(env={"TRANSFER_BATCH_MAX_SIZE": "1"}).transfer_funds_batch(
+            [(alice, bob, 1), (alice, bob, 1)]
+        )
+
+
+def test_unit_of_work() -> None:
+    app = Bank()
+    alice = _create_alice_with_200(app)
+    bob = _create_bob(app)
+    units = app.unit_of_work_stats()["units"]
+
+    # Changing the password reuses the account it validated.
+    app.change_password(alice, "alice", "alice")
+    assertEqual(app.unit_of_work_stats()["loads_avoided"], 1)
+
+    with app.unit_of_work() as unit_of_work:
+        app.deposit_funds(alice, 100)
+        app.transfer_funds(alice, bob, 300)
+        app.withdraw_funds(bob, 50)
+        assertEqual(app.get_balance(alice), 19800)
+
+        # Nothing is saved before the unit of work ends.
+        assertEqual(app.repository.get(alice).balance, 20000)
+        with app.unit_of_work() as nested:
+            assert nested is unit_of_work
+
+    assertEqual(unit_of_work.loads, 2)
+    assertEqual(unit_of_work.loads_avoided, 3)
+    assertEqual(app.get_balance(alice), 19800)
+    assertEqual(app.get_balance(bob), 450)
+
+    # Everything is discarded when the unit of work raises.
+    with pytest.raises(InsufficientFundsError):
+        with app.unit_of_work():
+            app.deposit_funds(alice, 100)
+            app.withdraw_funds(alice, 1000000)
+    assertEqual(app.get_balance(alice), 19800)
+
+    # An aborted batch leaves the identity map untouched.
+    with app.unit_of_work():
+        app.deposit_funds(alice, 200)
+        app.transfer_funds_batch([(alice, bob, 100), (bob, alice, 100000)])
+        app.transfer_funds_batch([(alice, bob, 100)])
+    assertEqual(app.get_balance(alice), 19900)
+    assertEqual(app.get_balance(bob), 550)
+
+    assertEqual(app.unit_of_work_stats()["units"], units + 4)
+
+
+def test_email_index(tmp_path: typing.Any) -> None:
+    env = {
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+        "EMAIL_INDEX_PATH": str(tmp_path / "emails.idx"),
+        "EMAIL_INDEX_CAPACITY": "100",
+    }
+    app = Bank(env=env)
+    alice = _create_alice_with_200(app)
+
+    assertEqual(app.email_index.lookup("alice@example.com"), alice)
+    assertEqual(app.email_index.lookup("bob@example.com"), None)
+    assertEqual(app.authenticate("alice@example.com", "alice"), alice)
+    with pytest.raises(AccountNotFoundError):
+        app.authenticate("bob@example.com", "bob")
+    with pytest.raises(AccountAlreadyExistsError):
+        app.open_account("Alice", "alice@example.com", "alice")
+    app.close()
+
+    # The saved index only scans events stored after it.
+    other = Bank(env=dict(env, EMAIL_INDEX_PATH=""))
+    bob = _create_bob(other)
+    app = Bank(env=env)
+    assertEqual(app.email_index.position, 6)
+    assertEqual(app.email_index.lookup("bob@example.com"), bob)
+    assertEqual(app.email_index.catch_up(), 0)
+
+    # Rescanning in small sections finds both accounts.
+    app.email_index.position = 0
+    assertEqual(app.email_index.catch_up(section_size=1), 2)
+
+    # Unknown ids that pass the filter are checked in the store.
+    app.email_index.add(app.get_account_id_by_email("sue@example.com"))
+    assertEqual(app.email_index.lookup("sue@example.com"), None)
+
+    # Accounts opened by another process on the store are found.
+    sue = other.open_account("Sue", "sue2@example.com", "sue")
+    assertEqual(app.authenticate("sue2@example.com", "sue"), sue)
+    other.open_account("Tom", "tom@example.com", "tom")
+    with pytest.raises(AccountAlreadyExistsError):
+        app.open_account("Tom", "tom@example.com", "tom")
+    assertEqual(app.concurrency_stats()["conflicts"], 0)
+
+
+def test_conflict_retry(tmp_path: typing.Any) -> None:
+    env = {
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+        "CONFLICT_RETRY_ATTEMPTS": "2",
+        "CONFLICT_RETRY_BACKOFF": "0.001",
+    }
+    app = Bank(env=env)
+    other = Bank(env=env)
+    alice = _create_alice_with_200(app)
+    attempts = []
+
+    def deposit_racing_with_other(amount: int) -> None:
+        account = app._get_account(alice)
+        attempts.append(account.version)
+        # Another writer saves alice before this attempt does.
+        other.deposit_funds(alice, 1)
+        account.credit(amount)
+        app._save(account)
+
+    # Both attempts lose the race, so the write gives up.
+    with pytest.raises(RecordConflictError):
+        app.run_unit_of_work(deposit_racing_with_other, 100)
+    assertEqual(attempts, [3, 4])
+
+    # The retry reloads alice and succeeds.
+    attempts.clear()
+    other.deposit_funds = lambda *args: None  # type: ignore
+    app.run_unit_of_work(deposit_racing_with_other, 100)
+    assertEqual(attempts, [5])
+    assertEqual(app.get_balance(alice), 20102)
+
+    stats = app.concurrency_stats()
+    assertEqual(stats["conflicts"], 2)
+    assertEqual(stats["retries"], 1)
+    assertEqual(stats["failures"], 1)
+
+
+def test_account_locks() -> None:
+    app = Bank(
+        env={
+            "ACCOUNT_LOCK_STRIPES": "1",
+            "ACCOUNT_LOCK_TIMEOUT": "0.01",
+            "CONFLICT_RETRY_ATTEMPTS": "2",
+            "CONFLICT_RETRY_BACKOFF": "0.001",
+        }
+    )
+    alice = _create_alice_with_200(app)
+    bob = _create_bob(app)
+    assert app.account_locks is not None
+
+    # Both accounts share the only stripe.
+    app.transfer_funds(alice, bob, 100)
+    assertEqual(app.get_balance(bob), 300)
+
+    # Another writer holds the stripe for too long.
+    stripe = app.account_locks.stripe(alice)
+    assert app.account_locks.acquire(stripe, timeout=0)
+    with pytest.raises(AccountBusyError):
+        app.deposit_funds(alice, 100)
+    app.account_locks.release(stripe)
+
+    app.deposit_funds(alice, 100)
+    assertEqual(app.get_balance(alice), 20000)
+    assertEqual(app.concurrency_stats()["failures"], 1)
+
+
+def test_striped_lock() -> None:
+    with pytest.raises(ValueError):
+        StripedLock(0)
+    for attempt in range(1, 10):
+        assert 0 <= backoff_delay(attempt, base=0.01, cap=0.1) <= 0.1
+
+
+def test_hot_mode() -> None:
+    app = Bank()
+    alice = _create_alice_with_200(app)
+    bob = _create_bob(app)
+
+    with pytest.raises(ValueError):
+        app.enable_hot_mode(bob, 0)
+    app.enable_hot_mode(bob, 4)
+    assertEqual(app.get_account(bob).shards, 4)
+
+    # Credits land on the shards, not on the main ledger.
+    for _ in range(10):
+        app.deposit_funds(bob, 100)
+    app.transfer_funds(alice, bob, 500)
+    assertEqual(app.get_balance(bob), 1700)
+    assertEqual(app.get_account(bob).balance, 200)
+    assertEqual(app.get_account(bob).version, 4)
+
+    # The main ledger covers the debit.
+    app.withdraw_funds(bob, 100)
+    assertEqual(app.get_account(bob).balance, 100)
+
+    # The shards are swept to cover the debit.
+    app.withdraw_funds(bob, 1000)
+    assertEqual(app.get_balance(bob), 600)
+    assertEqual(app.get_account(bob).balance, 600)
+    with pytest.raises(InsufficientFundsError):
+        app.transfer_funds(bob, alice, 601)
+    assertEqual(app.get_balance(bob), 600)
+
+    # Shards can grow, never shrink.
+    with pytest.raises(ValueError):
+        app.enable_hot_mode(bob, 2)
+    app.enable_hot_mode(bob, 6)
+    app.deposit_funds(bob, 300)
+    assertEqual(app.get_balance(bob), 900)
+
+    # Batches sweep the shards of the source and credit main ledgers.
+    results = app.transfer_funds_batch([(bob, alice, 900), (alice, bob, 50)])
+    assertEqual([result.status for result in results], ["success"] * 2)
+    assertEqual(app.get_balance(bob), 50)
+    assertEqual(app.get_account(bob).balance, 50)
+    assertEqual(app.get_balance(alice), 20350)
+
+    app.close_account(alice)
+    with pytest.raises(AccountClosedError):
+        app.enable_hot_mode(alice, 2)
+
+    shard = AccountShard(shard_id_for(bob, 0), bob)
+    shard.credit(100)
+    with pytest.raises(InsufficientFundsError):
+        shard.sweep(101)
+
+
+def test_transfer_pipeline(monkeypatch: typing.Any) -> None:
+    app = Bank()
+    app.follow(app.name, app.notification_log)
+    alice = _create_alice_with_200(app)
+    bob = _create_bob(app)
+    sue = _create_sue(app)
+
+    # The source pays right away, the destination when the Bank
+    # processes its log.
+    transfer_id = app.request_transfer(alice, bob, 500)
+    assertEqual(app.get_balance(alice), 19500)
+    assertEqual(app.get_balance(bob), 200)
+    assertEqual(app.get_transfer(transfer_id).status, "pending")
+    app.pull_and_process(app.name)
+    assertEqual(app.get_transfer(transfer_id).status, "completed")
+    assertEqual(app.get_balance(bob), 700)
+    # Only the transfer requests are tracked.
+    requested = [
+        notification.id
+        for notification in app.recorder.select_notifications(1, 100)
+        if notification.topic in app.follow_topics
+    ]
+    assertEqual(app.recorder.max_tracking_id(app.name), requested[-1])
+    assert requested[-1] < app.recorder.max_notification_id()
+
+    # Missing and closed destinations refund the source.
+    missing = app.request_transfer(alice, uuid4(), 100)
+    app.close_account(sue)
+    closed = app.request_transfer(alice, sue, 100)
+    assertEqual(app.get_balance(alice), 19300)
+    app.pull_and_process(app.name)
+    assertEqual(app.get_balance(alice), 19500)
+    assertEqual(app.get_transfer(missing).error, "Account not found.")
+    assertEqual(app.get_transfer(closed).status, "failed")
+    assertEqual(
+        app.get_transfer(closed).error, f"Account with ID {sue} is closed"
+    )
+
+    with pytest.raises(TransactionError):
+        app.request_transfer(alice, alice, 1)
+    with pytest.raises(InsufficientFundsError):
+        app.request_transfer(bob, alice, 701)
+    with pytest.raises(AccountClosedError):
+        app.request_transfer(sue, alice, 1)
+    for transfer_id in (alice, uuid4()):
+        with pytest.raises(TransferNotFoundError):
+            app.get_transfer(transfer_id)
+
+    # Hot sources sweep their shards, hot destinations take the
+    # credit on a shard.
+    app.enable_hot_mode(bob, 2)
+    app.deposit_funds(bob, 300)
+    app.request_transfer(bob, alice, 900)
+    app.request_transfer(alice, bob, 100)
+    app.pull_and_process(app.name)
+    assertEqual(app.get_balance(alice), 20300)
+    assertEqual(app.get_balance(bob), 200)
+    assertEqual(app.get_account(bob).balance, 100)
+
+    # Completing a transfer is retried when it loses a conflict.
+    record = app._record
+    conflicts = []
+
+    def conflicting_record(processing_event: typing.Any) -> typing.Any:
+        if not conflicts:
+            conflicts.append(processing_event)
+            raise RecordConflictError()
+        return record(processing_event)
+
+    app.request_transfer(alice, bob, 100)
+    monkeypatch.setattr(app, "_record", conflicting_record)
+    retries = app.concurrency_stats()["retries"]
+    app.pull_and_process(app.name)
+    assertEqual(app.concurrency_stats()["retries"], retries + 1)
+    assertEqual(app.get_balance(bob), 300)
+
+
+def _wait_for(condition: typing.Callable[[], bool]) -> None:
+    deadline = time.monotonic() + 10
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_transfer_pipeline_supervised(monkeypatch: typing.Any) -> None:
+    app = Bank()
+    alice = _create_alice_with_200(app)
+    bob = _create_bob(app)
+    # Transfers requested before the pipeline starts are completed.
+    before = app.request_transfer(alice, bob, 100)
+    pipeline = app.start_transfer_pipeline()
+    pipeline.retry_backoff = pipeline.max_retry_backoff = 0.01
+    _wait_for(lambda: app.get_transfer(before).status == "completed")
+    assert pipeline.healthy
+
+    # A failing event is pulled again until it is processed, and
+    # no transfer is taken while it fails.
+    failing = threading.Event()
+    failing.set()
+    policy = app.policy
+
+    def failing_policy(*args: typing.Any) -> None:
+        if failing.is_set():
+            raise ConnectionError("Database is down")
+        policy(*args)
+
+    monkeypatch.setattr(app, "policy", failing_policy)
+    transfer_id = app.request_transfer(alice, bob, 100)
+    _wait_for(lambda: pipeline.failures > 1)
+    assert not pipeline.healthy
+    assert isinstance(pipeline.error, ConnectionError)
+    assertEqual(app.get_transfer(transfer_id).status, "pending")
+    with pytest.raises(TransferPipelineError):
+        app.request_transfer(alice, bob, 100)
+
+    failing.clear()
+    _wait_for(lambda: pipeline.healthy)
+    assertEqual(app.get_transfer(transfer_id).status, "completed")
+    assertEqual(app.get_balance(bob), 400)
+    assert pipeline.error is None
+
+    app.close()
+    assert not pipeline.is_alive()
+
+
+def test_transactions() -> None:
+    app = Bank(env={"TRANSACTIONS_SCAN_SIZE": "3"})
+    alice = _create_alice_with_200(app)
+    bob = _create_bob(app)
+    app.set_overdraft_limit(alice, 100)
+    app.withdraw_funds(alice, 300)
+    app.change_password(alice, "alice", "secret")
+    transfer_id = app.request_transfer(alice, bob, 50)
+
+    # Pages of two, newest first, skipping the other events.
+    pages = []
+    cursor = None
+    while True:
+        page, cursor = app.get_transactions(alice, before=cursor, limit=2)
+        pages.append([(record.kind, record.amount) for record in page])
+        if cursor is None:
+            break
+    assertEqual(
+        pages,
+        [
+            [("debit", 50), ("debit", 300)],
+            [("credit", 10000), ("credit", 10000)],
+        ],
+    )
+    page, _ = app.get_transactions(alice, limit=1)
+    assertEqual(page[0].transfer_id, transfer_id)
+    assertEqual(page[0].version, 7)
+    assert page[0].timestamp.startswith("20")
+    assertEqual(app.get_transactions(alice, before=1), ([], None))
+
+    with pytest.raises(AccountNotFoundError):
+        app.get_transactions(uuid4())
+
+
+def test_legacy_password_hashes() -> None:
+    app = Bank(env={"EVENT_TRANSCODER": "json"})
+    alice = app.get_account_id_by_email("alice@example.com")
+    timestamp = {
+        "_type_": "datetime_iso",
+        "_data_": datetime.now(timezone.utc).isoformat(),
+    }
+    legacy_states = [
+        (
+            "Opened",
+            {
+                "originator_topic": get_topic(Account),
+                "full_name": "Alice",
+                "email_address": "alice@example.com",
+                "password": "alice",
+            },
+        ),
+        ("PasswordChanged", {"new_password": "alice2"}),
+    ]
+    app.recorder.insert_events(
+        [
+            StoredEvent(
+                originator_id=alice,
+                originator_version=version,
+                topic=f"banking.domainmodel:Account.{name}",
+                state=json.dumps({**state, "timestamp": timestamp}).encode(),
+            )
+            for version, (name, state) in enumerate(legacy_states, 1)
+        ]
+    )
+    app.email_index.catch_up()
+
+    # Plain passwords of old events are upcast to SHA-512 hashes.
+    legacy_hash = app.get_account(alice).hashed_password
+    assert legacy_hash == sha512(b"alice2").hexdigest()
+    with pytest.raises(BadCredentials):
+        app.authenticate("alice@example.com", "alice")
+
+    # A legacy hash is replaced by a PBKDF2 hash at login.
+    assert app.authenticate("alice@example.com", "alice2") == alice
+    assert app.get_account(alice).hashed_password.startswith("pbkdf2_sha256$")
+    assert app.authenticate("alice@example.com", "alice2") == alice
+    assert app.get_account(alice).version == 3
+
+
+def test_idempotent_responses(tmp_path: typing.Any) -> None:
+    env = {
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+        "CONFLICT_RETRY_ATTEMPTS": "1",
+    }
+    app = Bank(env=env)
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    assert app.get_idempotent_response(alice, "key-1", "digest") is None
+
+    # Saved with the changes of the request.
+    with app.unit_of_work():
+        app.deposit_funds(alice, 100)
+        app.save_idempotent_response(
+            alice, "key-1", "digest", {"result": "success"}, 200
+        )
+    assert app.get_idempotent_response(alice, "key-1", "digest") == (
+        {"result": "success"},
+        200,
+    )
+    assert app.idempotency_stats()["hits"] == 1
+    with pytest.raises(IdempotencyKeyReusedError):
+        app.get_idempotent_response(alice, "key-1", "other")
+    # Another response for the key was saved meanwhile.
+    with pytest.raises(RecordConflictError):
+        app.save_idempotent_response(alice, "key-1", "digest", {}, 200)
+    app.close()
+
+    # Persisted with the events of the Bank.
+    app = Bank(env=env)
+    assert app.get_idempotent_response(alice, "key-1", "digest") == (
+        {"result": "success"},
+        200,
+    )
+    assert app.idempotency_stats()["size"] == 1
+    app.close()
+
+    # Expired keys can be used again.
+    app = Bank(env=dict(env, IDEMPOTENCY_KEY_TTL="0"))
+    assert app.get_idempotent_response(alice, "key-1", "digest") is None
+    app.save_idempotent_response(alice, "key-1", "new", {"result": "x"}, 201)
+    assert app.get_idempotent_response(alice, "key-1", "new") is None
+    response = app.repository.get(idempotency_id_for(alice, "key-1"))
+    assert (response.fingerprint, response.status) == ("new", 201)
+    assert app.get_balance(alice) == 100
+    app.close()
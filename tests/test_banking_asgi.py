@@ -0,0 +1,333 @@
+# coding=utf-8
+
+import asyncio
+import json
+import typing
+from uuid import UUID
+
+from banking import api
+from banking.applicationmodel import Bank
+from banking.asgi import app, transfer
+from banking.utils.asgiserver import (
+    MAX_BODY_SIZE,
+    Receive,
+    Send,
+    start_server,
+)
+
+Response = typing.Tuple[int, typing.Any]
+
+
+async def _request(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    method: str,
+    path: str,
+    body: typing.Any = None,
+    token: typing.Optional[str] = None,
+    raw_body: typing.Optional[bytes] = None,
+) -> Response:
+    payload = json.dumps(body).encode() if body is not None else b""
+    if raw_body is not None:
+        payload = raw_body
+    lines = [f"{method} {path} HTTP/1.1", f"Content-Length: {len(payload)}"]
+    if token is not None:
+        lines.append(f"Authorization: Bearer {token}")
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + payload)
+    await writer.drain()
+    return await _response(reader)
+
+
+async def _response(reader: asyncio.StreamReader) -> Response:
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line == b"\r\n":
+            break
+        name, _, value = line.decode().partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    body = await reader.readexactly(length)
+    return status, json.loads(body) if body else None
+
+
+async def _endpoints() -> None:
+    server = await start_server(app, port=0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+
+    async def request(*args: typing.Any, **kwargs: typing.Any) -> Response:
+        return await _request(reader, writer, *args, **kwargs)
+
+    signup = {
+        "full_name": "Asgi",
+        "email_address": "asgi@example.com",
+        "password": "asgi",
+    }
+    status, body = await request("POST", "/api/v1/signup", signup)
+    assert status == 201
+    account_id = body["account_id"]
+    status, body = await request("POST", "/api/v1/signup", signup)
+    assert status == 409
+    assert "already exists" in body["error"]
+
+    status, body = await request(
+        "POST",
+        "/api/v1/login",
+        {"email_address": "asgi@example.com", "password": "wrong"},
+    )
+    assert status == 401
+    status, body = await request(
+        "POST",
+        "/api/v1/login",
+        {"email_address": "asgi@example.com", "password": "asgi"},
+    )
+    assert status == 200
+    token = body["access_token"]
+
+    # Every request goes through the same keep-alive connection.
+    status, body = await request(
+        "POST", "/api/v1/deposit", {"amount": 500}, token
+    )
+    assert (status, body) == (200, {"result": "success"})
+    status, body = await request(
+        "POST", "/api/v1/withdraw", {"amount": 50}, token
+    )
+    assert status == 200
+    status, body = await request(
+        "POST", "/api/v1/withdraw", {"amount": 5000}, token
+    )
+    assert status == 400
+    assert body["message"].startswith("Insufficient funds")
+    status, body = await request(
+        "POST",
+        "/api/v1/transfer",
+        {"destination_id": account_id, "amount": 10},
+        token,
+    )
+    assert (status, body) == (
+        400,
+        {"error": "Cannot transfer to the same account"},
+    )
+    status, body = await request(
+        "POST",
+        "/api/v1/transfer",
+        {"destination_id": str(UUID(int=0)), "amount": 1},
+        token,
+    )
+    assert (status, body) == (404, {"error": "Account not found."})
+    status, body = await request(
+        "POST",
+        "/api/v1/signup",
+        dict(signup, email_address="other@example.com"),
+    )
+    status, body = await request(
+        "POST",
+        "/api/v1/transfer",
+        {"destination_id": body["account_id"], "amount": 50},
+        token,
+    )
+    assert (status, body) == (200, {"result": "success"})
+    status, body = await request("GET", "/api/v1/account", token=token)
+    assert (status, body) == (200, {"balance": "400", "identity": account_id})
+
+    # JWT errors are the ones of flask_jwt_extended.
+    status, body = await request("GET", "/api/v1/account")
+    assert (status, body) == (401, {"msg": "Missing Authorization Header"})
+    status, body = await request("GET", "/api/v1/account", token="nope")
+    assert status == 422
+
+    status, body = await request("GET", "/api/v1/nowhere")
+    assert status == 404
+    status, body = await request("GET", "/api/v1/deposit")
+    assert status == 405
+    status, body = await request(
+        "POST", "/api/v1/deposit", token=token, raw_body=b"{"
+    )
+    assert status == 400
+
+    writer.close()
+    server.close()
+    await server.wait_closed()
+
+
+def test_asgi_endpoints() -> None:
+    asyncio.run(_endpoints())
+
+
+async def _server() -> None:
+    server = await start_server(app, port=0)
+    port = server.sockets[0].getsockname()[1]
+
+    async def exchange(data: bytes) -> bytes:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(data)
+        writer.write_eof()
+        response = await reader.read()
+        writer.close()
+        return response
+
+    # HTTP/1.0 and Connection: close end the connection.
+    response = await exchange(b"GET /api/v1/account HTTP/1.0\r\n\r\n")
+    assert response.startswith(b"HTTP/1.1 401 Unauthorized")
+    assert b"Connection: close" in response
+    response = await exchange(
+        b"GET /x?a=1 HTTP/1.1\r\nConnection: close\r\n\r\n"
+    )
+    assert response.startswith(b"HTTP/1.1 404 Not Found")
+
+    # Malformed requests get a 400 and the connection is closed.
+    for data in (
+        b"GET /\r\n\r\n",
+        b"GET / HTTP/1.1\r\nbroken\r\n\r\n",
+        b"GET / HTTP/1.1\r\n" + b"A: b\r\n" * 101 + b"\r\n",
+    ):
+        assert (await exchange(data)).startswith(b"HTTP/1.1 400")
+
+    # Bodies need a sane Content-Length and no Transfer-Encoding, and
+    # what follows a rejected request is never parsed as a request.
+    for length, status in (
+        (b"-1", b"400"),
+        (b"+5", b"400"),
+        (b"5\r\nContent-Length: 6", b"400"),
+        (b"%d" % (MAX_BODY_SIZE + 1), b"413"),
+    ):
+        response = await exchange(
+            b"POST / HTTP/1.1\r\nContent-Length: " + length + b"\r\n\r\n"
+        )
+        assert response.startswith(b"HTTP/1.1 " + status)
+        assert b"Connection: close" in response
+    chunked = (
+        b"POST /api/v1/signup HTTP/1.1\r\nTransfer-Encoding: chunked\r\n"
+        b"\r\n1e\r\nGET /api/v1/nowhere HTTP/1.1\r\n\r\n\r\n0\r\n\r\n"
+    )
+    response = await exchange(chunked)
+    assert response.startswith(b"HTTP/1.1 501")
+    assert response.count(b"HTTP/1.1") == 1
+
+    # A body shorter than its Content-Length, or no request at all.
+    short = b"POST / HTTP/1.1\r\nContent-Length: 9\r\n\r\n{"
+    assert await exchange(short) == b""
+    assert await exchange(b"\r\n") == b""
+
+    server.close()
+    await server.wait_closed()
+
+    # An app that raises gets a 500 sent for it.
+    async def broken(scope: typing.Any, receive: Receive, send: Send) -> None:
+        raise RuntimeError("broken")
+
+    server = await start_server(broken, port=0)
+    port = server.sockets[0].getsockname()[1]
+    response = await exchange(b"GET / HTTP/1.1\r\n\r\n")
+    assert response.startswith(b"HTTP/1.1 500")
+    server.close()
+    await server.wait_closed()
+
+
+def test_asgi_server() -> None:
+    asyncio.run(_server())
+
+
+def test_asgi_lifespan() -> None:
+    messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+    sent: typing.List[typing.Dict[str, typing.Any]] = []
+
+    async def receive() -> typing.Dict[str, typing.Any]:
+        return messages.pop(0)
+
+    async def send(message: typing.Dict[str, typing.Any]) -> None:
+        sent.append(message)
+
+    asyncio.run(app({"type": "lifespan"}, receive, send))
+    assert [message["type"] for message in sent] == [
+        "lifespan.startup.complete",
+        "lifespan.shutdown.complete",
+    ]
+
+
+def test_asgi_async_transfer(monkeypatch: typing.Any) -> None:
+    bank = Bank()
+    monkeypatch.setattr(api, "_bank", bank)
+    monkeypatch.setattr(api, "_async_transfers", True)
+    source = bank.open_account("Source", "source@example.com", "s")
+    destination = bank.open_account("Dest", "dest@example.com", "d")
+    bank.deposit_funds(source, 10)
+    body, status = transfer(
+        {"destination_id": str(destination), "amount": 5}, str(source)
+    )
+    assert (status, body["status"]) == (202, "pending")
+    assert bank.get_transfer(UUID(body["transfer_id"])).status == "pending"
+
+
+def _call(
+    method: str,
+    path: str,
+    body: typing.Any = None,
+    headers: typing.Optional[typing.Dict[str, str]] = None,
+) -> typing.Tuple[int, typing.Dict[bytes, bytes], typing.Any]:
+    messages = [{"body": json.dumps(body).encode() if body else b""}]
+    sent: typing.List[typing.Dict[str, typing.Any]] = []
+
+    async def receive() -> typing.Dict[str, typing.Any]:
+        return messages.pop(0)
+
+    async def send(message: typing.Dict[str, typing.Any]) -> None:
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "headers": [
+            (name.lower().encode(), value.encode())
+            for name, value in (headers or {}).items()
+        ],
+    }
+    asyncio.run(app(scope, receive, send))
+    start, response = sent
+    return (
+        start["status"],
+        dict(start["headers"]),
+        json.loads(response["body"]),
+    )
+
+
+def test_asgi_idempotency_key(monkeypatch: typing.Any) -> None:
+    bank = Bank()
+    monkeypatch.setattr(api, "_bank", bank)
+    source = bank.open_account("Source", "source@example.com", "s")
+    destination = bank.open_account("Dest", "dest@example.com", "d")
+    _, _, body = _call(
+        "POST",
+        "/api/v1/login",
+        {"email_address": "source@example.com", "password": "s"},
+    )
+    authorization = f"Bearer {body['access_token']}"
+
+    def post(path: str, body: typing.Any, key: str) -> typing.Any:
+        headers = {"Authorization": authorization, "Idempotency-Key": key}
+        return _call("POST", path, body, headers)
+
+    # Retries get the saved response and change nothing.
+    for route, body in (
+        ("deposit", {"amount": 500}),
+        ("withdraw", {"amount": 50}),
+        ("transfer", {"destination_id": str(destination), "amount": 100}),
+    ):
+        status, headers, response = post(f"/api/v1/{route}", body, route)
+        assert (status, response) == (200, {"result": "success"})
+        assert b"idempotent-replayed" not in headers
+        status, headers, response = post(f"/api/v1/{route}", body, route)
+        assert (status, response) == (200, {"result": "success"})
+        assert headers[b"idempotent-replayed"] == b"true"
+    assert bank.get_balance(source) == 350
+    assert bank.get_balance(destination) == 100
+
+    # A key reused for another request, or invalid, is rejected.
+    status, _, response = post("/api/v1/deposit", {"amount": 1}, "deposit")
+    assert status == 400
+    assert "different request" in response["error"]
+    status, _, _ = post("/api/v1/deposit", {"amount": 1}, "")
+    assert status == 400
@@ -0,0 +1,120 @@
+# coding=utf-8
+
+import csv
+import json
+import typing
+
+import pytest
+
+from banking.applicationmodel import Bank
+from banking.exporter import ExportReport, export_events, main, read_sections
+
+
+def _bank(accounts: int = 3, env: typing.Any = None) -> Bank:
+    app = Bank(env=env)
+    for number in range(accounts):
+        account_id = app.open_account(
+            f"User {number}", f"user{number}@example.com", "secret"
+        )
+        app.deposit_funds(account_id, 10)
+    return app
+
+
+def test_read_sections() -> None:
+    app = _bank()
+    sections = list(read_sections(app, section_size=4))
+
+    assert [len(rows) for rows in sections] == [4, 2]
+    row = sections[0][0]
+    assert row["id"] == 1
+    assert row["originator_version"] == 1
+    assert row["topic"].endswith("Account.Opened")
+    assert row["state"]["full_name"] == "User 0"
+    assert "hashed_password" not in row["state"]
+
+    assert [len(rows) for rows in read_sections(app, 3, 4)] == [2]
+    assert list(read_sections(app, section_size=6))[1:] == []
+
+    with pytest.raises(ValueError):
+        next(read_sections(app, section_size=0))
+
+
+def test_export_jsonl_resumes(tmp_path: typing.Any) -> None:
+    app = _bank()
+    path = tmp_path / "events.jsonl"
+    position_path = str(tmp_path / "events.pos")
+
+    def fail_after_first_section(report: ExportReport) -> None:
+        raise RuntimeError("Interrupted")
+
+    with pytest.raises(RuntimeError):
+        export_events(
+            app,
+            str(path),
+            position_path=position_path,
+            section_size=4,
+            progress=fail_after_first_section,
+        )
+    assert (tmp_path / "events.pos").read_text() == "4"
+
+    # Resumes after the last section written.
+    reports: typing.List[ExportReport] = []
+    report = export_events(
+        app,
+        str(path),
+        position_path=position_path,
+        section_size=4,
+        progress=reports.append,
+    )
+    assert (report.exported, report.position) == (2, 6)
+    assert [r.position for r in reports] == [6]
+
+    app.deposit_funds(app.get_account_id_by_email("user0@example.com"), 5)
+    report = export_events(app, str(path), position_path=position_path)
+    assert (report.exported, report.position) == (1, 7)
+    report = export_events(app, str(path), position_path=position_path)
+    assert (report.exported, report.position) == (0, 7)
+
+    rows = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [row["id"] for row in rows] == list(range(1, 8))
+    assert rows[-1]["state"]["amount_in_cents"] == 5
+
+
+def test_export_csv(tmp_path: typing.Any) -> None:
+    app = _bank(accounts=1)
+    path = tmp_path / "events.csv"
+
+    export_events(app, str(path), "csv")
+    export_events(app, str(path), "csv")
+
+    with open(path, newline="") as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    assert [row["id"] for row in rows] == ["1", "2", "1", "2"]
+    assert json.loads(rows[1]["state"]) == {"amount_in_cents": 10}
+
+    with pytest.raises(ValueError):
+        export_events(app, str(path), "parquet")
+
+
+def test_export_report_rate() -> None:
+    assert ExportReport(exported=10, position=10, seconds=0).rate == 0.0
+    assert ExportReport(exported=10, position=10, seconds=2).rate == 5.0
+
+
+def test_main(
+    tmp_path: typing.Any, capsys: typing.Any, monkeypatch: typing.Any
+) -> None:
+    env = {
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+    }
+    for key, value in env.items():
+        monkeypatch.setenv(key, value)
+    _bank(accounts=2).close()
+    path = tmp_path / "events.jsonl"
+
+    report = main([str(path), "--section-size", "3"])
+
+    assert (report.exported, report.position) == (4, 4)
+    assert "exported=3 position=3" in capsys.readouterr().out
+    assert len(path.read_text().splitlines()) == 4
@@ -0,0 +1,71 @@
+# coding=utf-8
+
+import json
+import typing
+
+import pytest
+
+from banking.applicationmodel import Bank
+from banking.importer import ImportReport, import_accounts, main, read_rows
+
+
+def _rows(count: int) -> typing.List[typing.Dict[str, str]]:
+    return [
+        {
+            "full_name": f"User {number}",
+            "email_address": f"user{number}@example.com",
+            "password": "secret",
+        }
+        for number in range(count)
+    ]
+
+
+def test_import_accounts() -> None:
+    app = Bank()
+    app.open_account("User 0", "user0@example.com", "secret")
+    reports: typing.List[ImportReport] = []
+
+    # One duplicate in the store and one in the input.
+    rows = _rows(5) + _rows(2)[1:]
+    report = import_accounts(
+        app, iter(rows), chunk_size=3, progress=reports.append
+    )
+
+    assert (report.imported, report.duplicates) == (4, 2)
+    assert [r.imported for r in reports] == [2, 4]
+    assert report.rate > 0
+    assert app.authenticate("user4@example.com", "secret")
+
+    # Everything is a duplicate the second time.
+    assert import_accounts(app, rows).duplicates == 6
+
+    with pytest.raises(ValueError):
+        import_accounts(app, rows, chunk_size=0)
+
+
+def test_import_report_rate() -> None:
+    assert ImportReport(imported=10, duplicates=0, seconds=0).rate == 0.0
+    assert ImportReport(imported=10, duplicates=0, seconds=2).rate == 5.0
+
+
+def test_read_rows() -> None:
+    jsonl = [json.dumps(row) + "\n" for row in _rows(2)] + ["\n"]
+    assert list(read_rows(jsonl, "jsonl")) == _rows(2)
+
+    csv_lines = ["full_name,email_address,password\n", "A,a@b.com,x\n"]
+    assert list(read_rows(csv_lines, "csv")) == [
+        {"full_name": "A", "email_address": "a@b.com", "password": "x"}
+    ]
+
+    with pytest.raises(ValueError):
+        read_rows(csv_lines, "xml")
+
+
+def test_main(tmp_path: typing.Any, capsys: typing.Any) -> None:
+    path = tmp_path / "accounts.jsonl"
+    path.write_text("".join(json.dumps(row) + "\n" for row in _rows(3)))
+
+    report = main([str(path), "--chunk-size", "2", "--workers", "0"])
+
+    assert report.imported == 3
+    assert "imported=3 duplicates=0" in capsys.readouterr().out
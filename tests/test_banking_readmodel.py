@@ -0,0 +1,69 @@
+# coding=utf-8
+
+import pytest
+from eventsourcing.system import SingleThreadedRunner, System
+
+from banking.applicationmodel import Bank
+from banking.readmodel import AccountBalances, AccountSummary
+from banking.utils.custom_exceptions import AccountNotFoundError
+
+
+def test_account_balances() -> None:
+    runner = SingleThreadedRunner(System(pipes=[[Bank, AccountBalances]]))
+    runner.start()
+    app = runner.get(Bank)
+    balances = runner.get(AccountBalances)
+
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    app.deposit_funds(alice, 10000)
+    app.transfer_funds(alice, bob, 2500)
+    app.set_overdraft_limit(bob, 500)
+    app.change_password(bob, "bob", "bob2")
+    app.close_account(alice)
+
+    assert balances.get_summary(alice) == AccountSummary(7500, True, 0)
+    assert balances.get_summary(bob) == AccountSummary(2500, False, 500)
+    assert balances.position(app) == 8
+    assert balances.lag(app) == 0
+
+    with pytest.raises(AccountNotFoundError):
+        balances.get_summary(app.get_account_id_by_email("sue@example.com"))
+    runner.stop()
+
+
+def test_account_balances_catch_up() -> None:
+    app = Bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.deposit_funds(alice, 10000)
+
+    balances = AccountBalances()
+    balances.follow(app.name, app.notification_log)
+    assert balances.lag(app) == 2
+
+    # Events of unknown accounts are ignored.
+    balances.pull_and_process(app.name, start=2)
+    assert balances.table == {}
+
+    balances.pull_and_process(app.name, start=1)
+    assert balances.get_summary(alice).balance == 10000
+    assert balances.lag(app) == 0
+
+
+def test_account_balances_hot_mode() -> None:
+    runner = SingleThreadedRunner(System(pipes=[[Bank, AccountBalances]]))
+    runner.start()
+    app = runner.get(Bank)
+    balances = runner.get(AccountBalances)
+
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.enable_hot_mode(alice, 3)
+    for _ in range(6):
+        app.deposit_funds(alice, 1000)
+    app.withdraw_funds(alice, 5000)
+
+    assert balances.get_summary(alice).balance == app.get_balance(alice)
+    assert balances.get_summary(alice).balance == 1000
+    assert len(balances.shard_owners) == 3
+    assert set(balances.table) == {alice}
+    runner.stop()
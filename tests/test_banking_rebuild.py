@@ -0,0 +1,183 @@
+# coding=utf-8
+
+import os
+import typing
+from uuid import uuid4
+
+import pytest
+
+from banking import rebuild
+from banking.applicationmodel import Bank
+from banking.readmodel import AccountBalances
+from banking.rebuild import (
+    RebuildReport,
+    main,
+    merge_partitions,
+    partition_ranges,
+    project_range,
+    rebuild_balances,
+)
+
+
+def _history(app: Bank) -> None:
+    app.follow(app.name, app.notification_log)
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    sue = app.open_account("Sue", "sue@example.com", "sue")
+    app.deposit_funds(alice, 10000)
+    app.enable_hot_mode(bob, 2)
+    for _ in range(4):
+        app.transfer_funds(alice, bob, 500)
+    app.withdraw_funds(bob, 1500)
+    app.set_overdraft_limit(bob, 500)
+    app.close_account(sue)
+    app.request_transfer(alice, sue, 100)
+    app.request_transfer(alice, bob, 100)
+    app.request_transfer(alice, uuid4(), 100)
+    app.pull_and_process(app.name)
+
+
+def _sequential(app: Bank) -> AccountBalances:
+    balances = AccountBalances()
+    balances.follow(app.name, app.notification_log)
+    balances.pull_and_process(app.name)
+    return balances
+
+
+def test_rebuild_balances() -> None:
+    app = Bank()
+    _history(app)
+    expected = _sequential(app)
+    head = app.recorder.max_notification_id()
+
+    # Every way of splitting the log gives the sequential table.
+    for partition_size in range(1, head + 1):
+        balances = AccountBalances()
+        report = rebuild_balances(app, balances, partition_size=partition_size)
+        assert balances.table == expected.table
+        assert balances.shard_owners == expected.shard_owners
+        assert balances.position(app) == head
+        assert report.events == head
+        assert report.partitions == -(-head // partition_size)
+
+    # The rebuilt read model follows the Bank from the head.
+    balances.follow(app.name, app.notification_log)
+    app.deposit_funds(app.get_account_id_by_email("alice@example.com"), 7)
+    balances.pull_and_process(app.name)
+    expected.pull_and_process(app.name)
+    assert balances.table == expected.table
+
+
+def test_rebuild_balances_resumes(tmp_path: typing.Any) -> None:
+    app = Bank()
+    _history(app)
+    checkpoint_dir = str(tmp_path / "rebuild")
+
+    def fail_after_two_ranges(report: RebuildReport) -> None:
+        if report.partitions == 2:
+            raise RuntimeError("Interrupted")
+
+    with pytest.raises(RuntimeError):
+        rebuild_balances(
+            app,
+            AccountBalances(),
+            partition_size=10,
+            checkpoint_dir=checkpoint_dir,
+            progress=fail_after_two_ranges,
+        )
+    assert sorted(os.listdir(checkpoint_dir)) == [
+        "partition-1-10.json",
+        "partition-11-20.json",
+    ]
+
+    reports: typing.List[RebuildReport] = []
+    balances = AccountBalances()
+    report = rebuild_balances(
+        app,
+        balances,
+        partition_size=10,
+        checkpoint_dir=checkpoint_dir,
+        progress=reports.append,
+    )
+    head = app.recorder.max_notification_id()
+    assert report.events == head - 20
+    assert reports[0].partitions == 3
+    assert report.rate > 0
+    assert balances.table == _sequential(app).table
+
+
+def test_merge_partitions() -> None:
+    app = Bank()
+    _history(app)
+    head = app.recorder.max_notification_id()
+    partitions = [
+        project_range(app, start, stop, section_size=2)
+        for start, stop in partition_ranges(1, head, 5)
+    ]
+
+    table, shard_owners = merge_partitions(partitions[:3])
+    table, shard_owners = merge_partitions(partitions[3:], table, shard_owners)
+
+    assert table == _sequential(app).table
+    assert merge_partitions(partitions[1:])[0] == {}
+
+
+def test_partition_ranges() -> None:
+    assert partition_ranges(1, 7, 3) == [(1, 3), (4, 6), (7, 7)]
+    assert partition_ranges(5, 7, 3) == [(5, 6), (7, 7)]
+    assert partition_ranges(1, 0, 3) == []
+
+    with pytest.raises(ValueError):
+        partition_ranges(1, 7, 0)
+
+
+def test_rebuild_report_rate() -> None:
+    assert RebuildReport(events=10, partitions=1, seconds=0).rate == 0.0
+    assert RebuildReport(events=10, partitions=1, seconds=2).rate == 5.0
+
+
+def test_rebuild_worker(monkeypatch: typing.Any) -> None:
+    # The functions of the worker processes, run in this one.
+    monkeypatch.setattr(rebuild, "_bank", None)
+    rebuild._start_worker({})
+    assert rebuild._bank is not None
+    rebuild._bank.open_account("Alice", "alice@example.com", "alice")
+
+    partition = rebuild._project_range(1, 1)
+
+    assert (partition.events, len(partition.deltas)) == (1, 1)
+
+
+def test_rebuild_balances_workers(tmp_path: typing.Any) -> None:
+    app = Bank(
+        env={
+            "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+            "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+        }
+    )
+    _history(app)
+    balances = AccountBalances()
+
+    report = rebuild_balances(app, balances, workers=2, partition_size=10)
+
+    assert report.partitions == 4
+    assert balances.table == _sequential(app).table
+    app.close()
+
+
+def test_main(
+    tmp_path: typing.Any, capsys: typing.Any, monkeypatch: typing.Any
+) -> None:
+    monkeypatch.setenv("PERSISTENCE_MODULE", "eventsourcing.sqlite")
+    monkeypatch.setenv("SQLITE_DBNAME", str(tmp_path / "bank.db"))
+    app = Bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.deposit_funds(alice, 250)
+    app.close()
+
+    report = main(["--workers", "0", "--partition-size", "1"])
+
+    assert (report.events, report.partitions) == (2, 2)
+    out = capsys.readouterr().out
+    assert "events=1 partitions=1" in out
+    assert "1 accounts holding 250" in out
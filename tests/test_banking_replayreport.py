@@ -0,0 +1,59 @@
+# coding=utf-8
+
+import typing
+
+from banking.applicationmodel import Bank
+from banking.replayreport import account_ids, main
+
+
+def test_main(
+    tmp_path: typing.Any, capsys: typing.Any, monkeypatch: typing.Any
+) -> None:
+    monkeypatch.setenv("PERSISTENCE_MODULE", "eventsourcing.sqlite")
+    monkeypatch.setenv("SQLITE_DBNAME", str(tmp_path / "bank.db"))
+    app = Bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    app.deposit_funds(alice, 250)
+    assert list(account_ids(app)) == [alice, bob]
+    app.close()
+
+    top = main(["--top", "1", "--by", "events"])
+
+    assert [replays.aggregate_id for replays in top] == [alice]
+    out = capsys.readouterr().out
+    assert "2 accounts, 3 events" in out
+    assert str(alice) in out
+    assert str(bob) not in out
+
+
+def test_main_more_accounts_than_maxsize(
+    tmp_path: typing.Any, capsys: typing.Any, monkeypatch: typing.Any
+) -> None:
+    monkeypatch.setenv("PERSISTENCE_MODULE", "eventsourcing.sqlite")
+    monkeypatch.setenv("SQLITE_DBNAME", str(tmp_path / "bank.db"))
+    monkeypatch.setenv("REPLAY_STATS_MAXSIZE", "2")
+    app = Bank()
+    # The most expensive account is loaded first.
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    for _ in range(5):
+        app.deposit_funds(alice, 10)
+    for n in range(5):
+        app.open_account("Bob", f"bob{n}@example.com", "bob")
+    app.close()
+
+    top = main(["--top", "1"])
+
+    assert [replays.aggregate_id for replays in top] == [alice]
+    assert top[0].events == 6
+
+
+def test_account_ids_sections(monkeypatch: typing.Any) -> None:
+    app = Bank()
+    opened = [
+        app.open_account("Alice", f"alice{n}@example.com", "alice")
+        for n in range(3)
+    ]
+    monkeypatch.setattr("banking.replayreport.SECTION_SIZE", 2)
+
+    assert list(account_ids(app)) == opened
@@ -0,0 +1,129 @@
+# coding=utf-8
+
+from uuid import uuid4
+
+import pytest
+
+from banking.applicationmodel import Bank
+from banking.replaystats import ReplayStats
+
+
+def test_replay_stats() -> None:
+    app = Bank(env={Bank.ACCOUNT_SNAPSHOTTING_INTERVAL: "5"})
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    for _ in range(6):
+        app.deposit_funds(alice, 10)
+
+    # The cached copy is fast-forwarded, nothing is replayed.
+    app.replays = ReplayStats()
+    app.get_account(alice)
+    assert app.replay_stats()["full_loads"] == 0
+    assert app.top_replays()[0].events == 0
+
+    # Loads from the store start from the latest snapshot.
+    app.repository.cache = None
+    app.get_account(alice)
+    app.get_account(bob)
+
+    stats = app.replay_stats()
+    assert stats["loads"] == 3
+    assert stats["full_loads"] == 2
+    assert stats["snapshot_loads"] == 1
+    assert stats["events"] == 3
+    assert stats["events_per_load"] == 1.0
+    assert stats["seconds"] > 0
+    assert stats["versions"] == {
+        "<10": 2,
+        "<100": 0,
+        "<1000": 0,
+        "<10000": 0,
+        ">=10000": 0,
+    }
+    top = app.top_replays(1, by="loads")
+    assert [replays.aggregate_id for replays in top] == [alice]
+    assert top[0].version == 7
+    assert top[0].max_events == 2
+    assert top[0].snapshot_loads == 1
+    assert top[0].decode_seconds > 0
+    assert app.top_replays(by="events")[0].aggregate_id == alice
+    with pytest.raises(ValueError):
+        app.top_replays(by="name")
+
+    # Decoding outside a load isn't counted.
+    app.follow(app.name, app.notification_log)
+    app.pull_and_process(app.name)
+    assert app.replay_stats()["loads"] == 3
+
+
+def test_replay_stats_bounds() -> None:
+    replays = ReplayStats(maxsize=2)
+    first, second, third = uuid4(), uuid4(), uuid4()
+    for aggregate_id, version in ((first, 5), (second, 50), (third, 50000)):
+        replays.record(aggregate_id, version, False, True, 0.1, 0.05, version)
+
+    # The first is no longer a recent aggregate, but still a leader.
+    assert sum(replays.stats()["versions"].values()) == 2
+    assert [r.aggregate_id for r in replays.top(by="version")] == [
+        third,
+        second,
+        first,
+    ]
+    assert replays.stats()["versions"][">=10000"] == 1
+    assert replays.stats()["loads"] == 3
+
+    # The most expensive aggregates outlive their eviction.
+    replays = ReplayStats(maxsize=2, top_size=2)
+    expensive, restarted = uuid4(), uuid4()
+    replays.record(expensive, 50, False, True, 0.5, 0.1, 50)
+    replays.record(restarted, 40, False, True, 0.1, 0.1, 40)
+    for _ in range(20):
+        replays.record(uuid4(), 1, False, True, 0.1, 0.1, 1)
+    replays.record(restarted, 2, False, True, 0.1, 0.1, 42)
+    assert [r.aggregate_id for r in replays.top(2)] == [
+        expensive,
+        restarted,
+    ]
+    assert replays.top(2)[1].events == 40
+    assert replays.top(1, by="version")[0].version == 50
+    assert replays.top(1, by="seconds")[0].aggregate_id == expensive
+    assert len(replays.top(5)) == 3
+    # A leader is ranked by its latest figures once they catch up, and
+    # the least expensive leader makes room for a more expensive one.
+    replays.record(restarted, 60, False, True, 0.1, 0.1, 102)
+    assert replays.top(1)[0].events == 62
+    bigger = uuid4()
+    replays.record(bigger, 55, False, True, 0.1, 0.1, 55)
+    for _ in range(5):
+        replays.record(restarted, 1, False, True, 0.1, 0.1, 103)
+    assert [(r.aggregate_id, r.events) for r in replays.top(2)] == [
+        (restarted, 67),
+        (bigger, 55),
+    ]
+
+    recent = ReplayStats(maxsize=1, top_size=0)
+    recent.record(first, 50, False, True, 0.1, 0.05, 50)
+    recent.record(second, 1, False, True, 0.1, 0.05, 1)
+    assert [r.aggregate_id for r in recent.top()] == [second]
+
+    disabled = ReplayStats(maxsize=0)
+    disabled.record(first, 5, False, True, 0.1, 0.05, 5)
+    assert disabled.top() == []
+    assert disabled.stats()["events"] == 5
+    assert ReplayStats().stats()["events_per_load"] == 0.0
+
+
+def test_replay_stats_nested_loads() -> None:
+    app = Bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.repository.cache = None
+    replays = ReplayStats()
+
+    # The inner load counts for the outer one.
+    account = replays.measure(
+        alice, lambda: replays.measure(alice, lambda: app.get_account(alice))
+    )
+
+    assert account.id == alice
+    assert replays.stats()["loads"] == 1
+    assert replays.stats()["events"] == 1
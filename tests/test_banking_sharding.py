@@ -0,0 +1,210 @@
+import pickle
+from concurrent.futures.process import BrokenProcessPool
+from uuid import UUID
+
+import pytest
+from eventsourcing.application import AggregateNotFound
+
+from banking import sharding
+from banking.api import start_bank
+from banking.emailindex import account_id_for
+from banking.sharding import ShardedBank, shard_env, shard_for
+from banking.utils.custom_exceptions import (
+    AccountAlreadyExistsError,
+    AccountBusyError,
+    AccountClosedError,
+    AccountNotFoundError,
+    BadCredentials,
+    IdempotencyKeyReusedError,
+    InsufficientFundsError,
+    TransactionError,
+    TransferNotFoundError,
+)
+
+
+def _emails(shards: int) -> list:
+    """One email per shard, in the order of the shards"""
+    emails = {}
+    number = 0
+    while len(emails) < shards:
+        email = f"shard{number}@example.com"
+        emails.setdefault(shard_for(account_id_for(email), shards), email)
+        number += 1
+    return [emails[index] for index in range(shards)]
+
+
+def test_shard_for_and_env(monkeypatch) -> None:
+    assert shard_for(UUID(int=7), 4) == 3
+    monkeypatch.setenv("SQLITE_DBNAME", "bank-{shard}.db")
+    env = shard_env({"SQLITE_LOCK_TIMEOUT": "5"}, 2)
+    assert env == {
+        "CREDENTIAL_POOL_WORKERS": "0",
+        "SQLITE_DBNAME": "bank-2.db",
+        "SQLITE_LOCK_TIMEOUT": "5",
+    }
+    assert shard_env({"CREDENTIAL_POOL_WORKERS": "2"}, 0)[
+        "CREDENTIAL_POOL_WORKERS"
+    ] == "2"
+    with pytest.raises(ValueError):
+        ShardedBank(0)
+
+
+def test_sharded_bank() -> None:
+    bank = ShardedBank(2, env={"PASSWORD_HASH_ITERATIONS": "1000"})
+    first, second = _emails(2)
+    alice = bank.open_account("Alice", first, "alice")
+    bob = bank.open_account("Bob", second, "bob")
+    assert bank.get_account_id_by_email(first) == alice
+    assert shard_for(alice, 2) != shard_for(bob, 2)
+
+    local_email = next(
+        f"local{number}@example.com"
+        for number in range(100)
+        if shard_for(account_id_for(f"local{number}@example.com"), 2)
+        == shard_for(alice, 2)
+    )
+    opened, duplicates = bank.open_accounts(
+        [
+            ("Carol", local_email, "carol"),
+            ("Alice", first, "alice"),
+            ("Dave", "dave@example.com", "dave"),
+        ]
+    )
+    assert duplicates == 1
+    carol = account_id_for(local_email)
+    assert set(opened) == {carol, account_id_for("dave@example.com")}
+
+    assert bank.authenticate(first, "alice") == alice
+    with pytest.raises(BadCredentials) as bad_credentials:
+        bank.authenticate(first, "wrong")
+    assert bad_credentials.value.email_address == first
+    with pytest.raises(AccountNotFoundError):
+        bank.authenticate("nobody@example.com", "x")
+
+    assert bank.run_unit_of_work(bank.deposit_funds, alice, 1000) is None
+    bank.withdraw_funds(alice, 100)
+    with pytest.raises(InsufficientFundsError) as insufficient:
+        bank.withdraw_funds(bob, 1)
+    assert insufficient.value.withdrawal_amount == 1
+
+    # A transfer on one shard, and a saga across shards.
+    bank.transfer_funds(alice, carol, 100)
+    bank.transfer_funds(alice, bob, 200)
+    with pytest.raises(InsufficientFundsError):
+        bank.transfer_funds(bob, alice, 1000)
+    with pytest.raises(TransactionError):
+        bank.transfer_funds(alice, alice, 1)
+
+    # A credit that fails gives the debit back.
+    bank.close_account(bob)
+    with pytest.raises(AccountClosedError) as closed:
+        bank.transfer_funds(alice, bob, 50)
+    assert closed.value.account_id == bob
+    missing = next(
+        UUID(int=number)
+        for number in range(10)
+        if shard_for(UUID(int=number), 2) != shard_for(alice, 2)
+    )
+    with pytest.raises(AggregateNotFound):
+        bank.transfer_funds(alice, missing, 50)
+    assert bank.get_balance(alice) == 600
+    assert bank.get_balance(carol) == 100
+    assert bank.get_balance(bob) == 200
+    assert bank.transfer_stats() == {
+        "local": 1,
+        "cross_shard": 4,
+        "compensated": 2,
+        "in_doubt": 0,
+    }
+
+    # Batches run on one shard, or each transfer on its own.
+    assert bank.transfer_funds_batch([(alice, carol, 10)]) == [
+        ("success", None)
+    ]
+    assert bank.transfer_funds_batch([]) == []
+    with pytest.raises(TransactionError):
+        bank.transfer_funds_batch([(carol, alice, 1), (alice, bob, 1)])
+    results = bank.transfer_funds_batch(
+        [(alice, carol, 10), (alice, bob, 10)], atomic=False
+    )
+    assert [result.status for result in results] == ["success", "failed"]
+
+    page, cursor = bank.get_transactions(alice, limit=1)
+    # The refund of the saga that failed last.
+    assert (page[0].kind, page[0].amount, cursor) == ("credit", 10, 13)
+    assert bank.balances.get_summary(alice).balance == 580
+    assert bank.balances.get_summary(bob).is_closed
+    assert bank.balances.lag() == 0
+    assert bank.balances.position() > 0
+
+    # A credit with an unknown outcome is never refunded.
+    remote_email = next(
+        f"remote{number}@example.com"
+        for number in range(100)
+        if shard_for(account_id_for(f"remote{number}@example.com"), 2)
+        != shard_for(alice, 2)
+    )
+    dave = bank.open_account("Dave", remote_email, "dave")
+    deposit_funds = bank.deposit_funds
+
+    def deposit_then_break(account_id: UUID, amount: int) -> None:
+        deposit_funds(account_id, amount)
+        raise BrokenProcessPool("worker died")
+
+    bank.deposit_funds = deposit_then_break  # type: ignore[assignment]
+    with pytest.raises(BrokenProcessPool):
+        bank.transfer_funds(alice, dave, 30)
+    del bank.deposit_funds
+    assert bank.get_balance(alice) == 550
+    assert bank.get_balance(dave) == 30
+    assert bank.transfer_stats()["in_doubt"] == 1
+    assert bank.in_doubt_transfers() == [
+        (alice, dave, 30, "BrokenProcessPool('worker died')")
+    ]
+
+    # Idempotency keys are rejected.
+    with pytest.raises(TransactionError):
+        bank.get_idempotent_response(alice, "key", "digest")
+    bank.close()
+
+
+def test_shard_process(monkeypatch) -> None:
+    # What a worker process runs, in this process.
+    monkeypatch.setattr(sharding, "_runner", None)
+    sharding._start_shard(shard_env({}, 0))
+    account_id = sharding._call(
+        "open_account", "Eve", "eve@example.com", "e"
+    )
+    sharding._call("deposit_funds", account_id, 10)
+    sharding._call("close_account", account_id)
+    # Refunds reach accounts closed since their debit.
+    sharding._call("refund_funds", account_id, 5)
+    assert sharding._get_summary(account_id).balance == 15
+    assert sharding._projection() == (4, 0)
+    sharding._stop_shard()
+
+
+def test_start_bank() -> None:
+    bank, balances = start_bank(1)
+    assert isinstance(bank, ShardedBank)
+    assert bank.shards == 1
+    assert balances is bank.balances
+    bank.close()
+
+
+def test_exceptions_pickle() -> None:
+    account_id = UUID(int=1)
+    for error in (
+        AccountAlreadyExistsError("a@example.com"),
+        AccountBusyError(account_id),
+        AccountClosedError(account_id),
+        InsufficientFundsError(10, 20),
+        BadCredentials("a@example.com"),
+        AccountNotFoundError("a@example.com"),
+        TransactionError("failed"),
+        TransferNotFoundError(account_id),
+        IdempotencyKeyReusedError("key"),
+    ):
+        copy = pickle.loads(pickle.dumps(error))
+        assert type(copy) is type(error)
+        assert str(copy) == str(error)
@@ -0,0 +1,268 @@
+# coding=utf-8
+
+import threading
+import typing
+from uuid import uuid4
+
+import eventsourcing.sqlite
+import pytest
+from eventsourcing.persistence import (
+    IntegrityError,
+    PersistenceError,
+    StoredEvent,
+)
+from eventsourcing.utils import Environment
+
+from banking.applicationmodel import Bank
+from banking.sqlite import (
+    Factory,
+    GroupCommitSQLiteProcessRecorder,
+    TunedSQLiteConnectionPool,
+    _Write,
+)
+
+
+def _pragmas(bank: Bank) -> typing.Dict[str, typing.Any]:
+    with bank.factory.datastore.get_connection(commit=False) as connection:
+        cursor = connection._sqlite_conn.cursor()
+        return {
+            name: cursor.execute(f"PRAGMA {name}").fetchone()[0]
+            for name in (
+                "journal_mode",
+                "synchronous",
+                "mmap_size",
+                "cache_size",
+                "busy_timeout",
+            )
+        }
+
+
+def test_sqlite_profile(tmp_path: typing.Any) -> None:
+    bank = Bank(
+        env={
+            "PERSISTENCE_MODULE": "banking.sqlite",
+            "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+            "SQLITE_SYNCHRONOUS": "normal",
+            "SQLITE_POOL_SIZE": "2",
+            "SQLITE_MAX_OVERFLOW": "0",
+        }
+    )
+    assert isinstance(bank.factory, Factory)
+    assert _pragmas(bank) == {
+        "journal_mode": "wal",
+        "synchronous": 1,
+        "mmap_size": 268435456,
+        "cache_size": -65536,
+        "busy_timeout": 5000,
+    }
+    pool = bank.factory.datastore.pool
+    assert (pool.pool_size, pool.max_overflow) == (2, 0)
+
+    alice = bank.open_account("Alice", "alice@example.com", "alice")
+    bob = bank.open_account("Bob", "bob@example.com", "bob")
+    bank.deposit_funds(alice, 100)
+    bank.transfer_funds(alice, bob, 40)
+    bank.close()
+
+    bank = Bank(
+        env={
+            "PERSISTENCE_MODULE": "banking.sqlite",
+            "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+        }
+    )
+    assert _pragmas(bank)["synchronous"] == 2
+    assert bank.get_balance(bob) == 40
+    bank.close()
+
+
+def test_sqlite_profile_in_memory() -> None:
+    bank = Bank(
+        env={
+            "PERSISTENCE_MODULE": "banking.sqlite",
+            "SQLITE_DBNAME": "file:bank?mode=memory&cache=shared",
+        }
+    )
+    alice = bank.open_account("Alice", "alice@example.com", "alice")
+    bank.deposit_funds(alice, 100)
+    assert bank.get_balance(alice) == 100
+    bank.close()
+
+
+@pytest.mark.parametrize(
+    "key, value",
+    [
+        ("SQLITE_SYNCHRONOUS", "sometimes"),
+        ("SQLITE_MMAP_SIZE", "-1"),
+        ("SQLITE_CACHE_SIZE", "lots"),
+        ("SQLITE_POOL_SIZE", "0"),
+        ("SQLITE_POOL_TIMEOUT", "never"),
+        ("SQLITE_POOL_TIMEOUT", "0"),
+        ("SQLITE_GROUP_COMMIT_SIZE", "-1"),
+        ("SQLITE_GROUP_COMMIT_WINDOW", "-1"),
+    ],
+)
+def test_sqlite_profile_settings(
+    tmp_path: typing.Any, key: str, value: str
+) -> None:
+    with pytest.raises(EnvironmentError, match=key):
+        Bank(
+            env={
+                "PERSISTENCE_MODULE": "banking.sqlite",
+                "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+                key: value,
+            }
+        )
+
+
+def test_sqlite_profile_pragmas_checked(
+    tmp_path: typing.Any, monkeypatch: typing.Any
+) -> None:
+    # Connections opened without the pragmas keep SQLite's defaults.
+    monkeypatch.setattr(
+        TunedSQLiteConnectionPool,
+        "_create_connection",
+        eventsourcing.sqlite.SQLiteConnectionPool._create_connection,
+    )
+
+    with pytest.raises(EnvironmentError, match="synchronous"):
+        Bank(
+            env={
+                "PERSISTENCE_MODULE": "banking.sqlite",
+                "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+                "SQLITE_SYNCHRONOUS": "OFF",
+            }
+        )
+
+
+def test_group_commit(tmp_path: typing.Any) -> None:
+    bank = Bank(
+        env={
+            "PERSISTENCE_MODULE": "banking.sqlite",
+            "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+            "SQLITE_GROUP_COMMIT_WINDOW": "1",
+        }
+    )
+    assert isinstance(bank.recorder, GroupCommitSQLiteProcessRecorder)
+    assert bank.recorder.window == 0.001
+    accounts = [
+        bank.open_account("Alice", f"alice{n}@example.com", "alice")
+        for n in range(8)
+    ]
+
+    def deposit(account_id: typing.Any) -> None:
+        for _ in range(10):
+            bank.deposit_funds(account_id, 1)
+
+    workers = [
+        threading.Thread(target=deposit, args=(account_id,))
+        for account_id in accounts
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert [bank.get_balance(a) for a in accounts] == [10] * len(accounts)
+    head = bank.recorder.max_notification_id()
+    assert head == len(accounts) * 11
+    bank.close()
+
+    # Saves are committed on their own once the writer stopped.
+    bank = Bank(
+        env={
+            "PERSISTENCE_MODULE": "banking.sqlite",
+            "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+            "SQLITE_GROUP_COMMIT_SIZE": "0",
+        }
+    )
+    assert not isinstance(bank.recorder, GroupCommitSQLiteProcessRecorder)
+    assert bank.get_balance(accounts[0]) == 10
+    bank.close()
+
+    bank = Bank(
+        env={
+            "PERSISTENCE_MODULE": "banking.sqlite",
+            "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+            "CREATE_TABLE": "n",
+        }
+    )
+    bank.deposit_funds(accounts[0], 1)
+    assert bank.get_balance(accounts[0]) == 11
+    bank.close()
+
+
+def _stored_event(originator_id: typing.Any, version: int) -> StoredEvent:
+    return StoredEvent(originator_id, version, "topic", b"state")
+
+
+def test_group_commit_conflicts(tmp_path: typing.Any) -> None:
+    factory = Factory(
+        Environment(env={"SQLITE_DBNAME": str(tmp_path / "bank.db")})
+    )
+    recorder = factory.process_recorder()
+    assert isinstance(recorder, GroupCommitSQLiteProcessRecorder)
+    taken = uuid4()
+    recorder.insert_events([_stored_event(taken, 1)])
+
+    # A conflict fails its own save only.
+    conflict = _Write([_stored_event(taken, 1)], {})
+    other = _Write([_stored_event(uuid4(), 1)], {})
+    recorder._commit([conflict, other])
+    assert isinstance(conflict.error, IntegrityError)
+    assert other.error is None and other.result == [2]
+    assert conflict.done.is_set() and other.done.is_set()
+    with pytest.raises(IntegrityError):
+        recorder.insert_events([_stored_event(taken, 1)])
+
+    # Any other error fails the whole group.
+    broken = _Write([_stored_event(uuid4(), 1)], {"tracking": object()})
+    other = _Write([_stored_event(uuid4(), 1)], {})
+    recorder._commit([other, broken])
+    assert isinstance(broken.error, AttributeError)
+    assert other.error is broken.error and other.result is None
+    assert recorder.max_notification_id() == 2
+
+    recorder.close()
+    assert recorder.insert_events([_stored_event(uuid4(), 1)]) == [3]
+    factory.close()
+
+
+@pytest.mark.filterwarnings(
+    "ignore::pytest.PytestUnhandledThreadExceptionWarning"
+)
+def test_group_commit_writer_stopped(
+    tmp_path: typing.Any, monkeypatch: typing.Any
+) -> None:
+    factory = Factory(
+        Environment(
+            env={
+                "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+                "SQLITE_GROUP_COMMIT_SIZE": "1",
+            }
+        )
+    )
+    recorder = factory.process_recorder()
+    assert isinstance(recorder, GroupCommitSQLiteProcessRecorder)
+
+    def interrupted(*args: typing.Any, **kwargs: typing.Any) -> None:
+        raise SystemExit()
+
+    # The writer stops in the middle of a group, its writes and the
+    # queued ones fail instead of waiting forever.
+    monkeypatch.setattr(recorder, "_insert_events", interrupted)
+    first = _Write([_stored_event(uuid4(), 1)], {})
+    queued = _Write([_stored_event(uuid4(), 1)], {})
+    with recorder._condition:
+        recorder._queue.extend([first, queued])
+        recorder._condition.notify()
+    recorder._writer.join(10)
+    assert not recorder._writer.is_alive()
+    assert first.done.is_set() and queued.done.is_set()
+    assert isinstance(first.error, PersistenceError)
+    assert isinstance(queued.error, PersistenceError)
+    assert first.error is not queued.error
+
+    # Later saves are committed on their own.
+    monkeypatch.undo()
+    assert recorder.insert_events([_stored_event(uuid4(), 1)]) == [1]
+    factory.close()
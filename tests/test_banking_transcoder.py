@@ -0,0 +1,94 @@
+# coding=utf-8
+
+import typing
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from eventsourcing.persistence import DatetimeAsISO
+from eventsourcing.system import SingleThreadedRunner, System
+
+from banking.applicationmodel import Bank
+from banking.readmodel import AccountBalances
+from banking.transcoder import (
+    AMOUNT_EVENT,
+    CompactTranscoder,
+    TolerantZlibCompressor,
+)
+
+
+def test_compact_transcoder() -> None:
+    transcoder = CompactTranscoder()
+    transcoder.register(DatetimeAsISO())
+    timestamp = datetime(2023, 5, 1, 12, 30, 1, 123456, tzinfo=timezone.utc)
+    state = {"timestamp": timestamp, "amount_in_cents": 2500}
+    data = transcoder.encode(state)
+    assert len(data) == AMOUNT_EVENT.size
+    assert transcoder.decode(data) == state
+
+    # Anything else is JSON.
+    for other in (
+        {"timestamp": "2023-05-01", "amount_in_cents": 2500},
+        {"timestamp": timestamp, "amount_in_cents": True},
+        {"timestamp": timestamp, "amount_in_cents": 2**63},
+        {
+            "timestamp": timestamp.astimezone(timezone(timedelta(hours=1))),
+            "amount_in_cents": 1,
+        },
+        {"amount": 1},
+    ):
+        data = transcoder.encode(other)
+        assert data[:1] == b"{"
+        assert transcoder.decode(data) == other
+
+
+def test_tolerant_zlib_compressor() -> None:
+    compressor = TolerantZlibCompressor()
+    short = b'{"a":1}'
+    assert compressor.compress(short) == short
+    assert compressor.decompress(short) == short
+
+    long = b'{"full_name":"' + b"a" * 100 + b'"}'
+    compressed = compressor.compress(long)
+    assert len(compressed) < len(long)
+    assert compressor.decompress(compressed) == long
+
+
+def test_event_formats_migration(tmp_path: typing.Any) -> None:
+    env = {
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+        "AGGREGATE_CACHE_MAXSIZE": "",
+    }
+    app = Bank(env={**env, "EVENT_TRANSCODER": "json"})
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.deposit_funds(alice, 1000)
+    app.close()
+
+    # Events stored as JSON are read by the compact transcoder.
+    app = Bank(env={**env, "EVENT_COMPRESSION": "zlib"})
+    assert app.get_balance(alice) == 1000
+    app.deposit_funds(alice, 500)
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    app.close()
+
+    app = Bank(env={**env, "EVENT_COMPRESSION": "zlib"})
+    assert app.get_balance(alice) == 1500
+    assert app.authenticate("bob@example.com", "bob") == bob
+    app.close()
+
+    for setting in ("EVENT_TRANSCODER", "EVENT_COMPRESSION"):
+        with pytest.raises(ValueError):
+            Bank(env={setting: "unknown"})
+
+
+def test_account_balances_read_compressed_events() -> None:
+    runner = SingleThreadedRunner(
+        System(pipes=[[Bank, AccountBalances]]),
+        env={"EVENT_COMPRESSION": "zlib"},
+    )
+    runner.start()
+    app = runner.get(Bank)
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.deposit_funds(alice, 1000)
+    assert runner.get(AccountBalances).get_summary(alice).balance == 1000
+    runner.stop()
@@ -0,0 +1,300 @@
+# coding=utf-8
+
+import os
+import signal
+import time
+from concurrent.futures.process import BrokenProcessPool
+from hashlib import sha512
+from uuid import UUID
+
+import pytest
+
+from banking.utils import metrics
+from banking.utils.bloomfilter import BloomFilter
+from banking.utils.custom_exceptions import CredentialPoolBusyError
+from banking.utils.idempotency import IdempotencyCache
+from banking.utils.tokencache import TokenCache
+from banking.utils.passwords import (
+    CredentialPool,
+    hash_password,
+    needs_rehash,
+    verify_password,
+)
+
+
+def test_bloom_filter() -> None:
+    bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+    for number in range(1000):
+        bloom_filter.add(b"key-%d" % number)
+
+    assert all(b"key-%d" % number in bloom_filter for number in range(1000))
+    false_positives = sum(
+        b"other-%d" % number in bloom_filter for number in range(10000)
+    )
+    assert false_positives < 300
+
+    restored = BloomFilter.from_bytes(bloom_filter.hashes, bloom_filter.bits)
+    assert b"key-1" in restored
+    assert restored.size == bloom_filter.size
+
+    with pytest.raises(ValueError):
+        BloomFilter(capacity=0)
+    with pytest.raises(ValueError):
+        BloomFilter(capacity=10, error_rate=1)
+
+
+def test_passwords() -> None:
+    hashed_password = hash_password("secret", 1000)
+    assert hashed_password.startswith("pbkdf2_sha256$1000$")
+    assert hashed_password != hash_password("secret", 1000)
+    assert verify_password("secret", hashed_password)
+    assert not verify_password("other", hashed_password)
+    assert not verify_password("secret", "md5$1$00$00")
+    assert not needs_rehash(hashed_password, 1000)
+    assert needs_rehash(hashed_password, 2000)
+
+    legacy_hash = sha512(b"secret").hexdigest()
+    assert verify_password("secret", legacy_hash)
+    assert not verify_password("other", legacy_hash)
+    assert needs_rehash(legacy_hash, 1000)
+
+    for arguments in ({"iterations": 0}, {"workers": -1}, {"max_pending": 0}):
+        with pytest.raises(ValueError):
+            CredentialPool(**{"iterations": 1, **arguments})
+
+
+def test_credential_pool() -> None:
+    pool = CredentialPool(iterations=1000, workers=1, max_pending=2)
+    # The workers start with the first hash.
+    assert pool.executor is None
+    hashed_password = pool.hash("secret")
+    assert pool.executor is not None
+    assert pool.verify("secret", hashed_password)
+    assert not pool.verify("other", hashed_password)
+    assert not pool.needs_rehash(hashed_password)
+    hashed_passwords = pool.hash_many(["a", "b", "c"])
+    assert [pool.verify(*pair) for pair in zip("abc", hashed_passwords)] == [
+        True
+    ] * 3
+
+    # A full queue rejects at once.
+    pool._slots.acquire()
+    pool._slots.acquire()
+    with pytest.raises(CredentialPoolBusyError):
+        pool.hash("secret")
+    pool._slots.release()
+    pool._slots.release()
+
+    # A slow hash times out, and frees its slot once done.
+    pool.timeout = 0.001
+    with pytest.raises(CredentialPoolBusyError):
+        pool._call(hash_password, "secret", 10**6)
+    assert pool.stats() == {"calls": 7, "rejected": 1, "timeouts": 1}
+    pool.shutdown()
+    assert pool.executor is None
+
+    inline = CredentialPool(iterations=1000, max_pending=1)
+    assert inline.hash_many(["a"])[0].startswith("pbkdf2_sha256$1000$")
+    inline._slots.acquire()
+    with pytest.raises(CredentialPoolBusyError):
+        inline.verify("secret", hashed_password)
+    inline.shutdown()
+
+
+def test_credential_pool_recovers() -> None:
+    pool = CredentialPool(iterations=1000, workers=1, max_pending=3)
+    hashed_password = pool.hash("secret")
+
+    # A call to the dead worker is rejected, and frees its slot, the
+    # next ones run on new workers.
+    broken = pool.executor
+    assert broken is not None
+    for pid in list(broken._processes):
+        os.kill(pid, signal.SIGKILL)
+    deadline = time.monotonic() + 10
+    while not broken._broken:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    with pytest.raises(CredentialPoolBusyError):
+        pool.verify("secret", hashed_password)
+    assert pool.executor is None
+    for _ in range(5):
+        assert pool.verify("secret", hashed_password)
+    assert pool.executor is not None and pool.executor is not broken
+
+    # So is a call whose worker dies while running it.
+    with pytest.raises(CredentialPoolBusyError):
+        pool._call(os._exit, 1)
+    assert pool.executor is None
+    for _ in range(5):
+        assert pool.verify("secret", hashed_password)
+
+    # A bulk hash drops the broken workers too.
+    for pid in list(pool.executor._processes):
+        os.kill(pid, signal.SIGKILL)
+    with pytest.raises(BrokenProcessPool):
+        pool.hash_many(["a", "b"])
+    assert pool.executor is None
+    assert len(pool.hash_many(["a", "b"])) == 2
+    assert pool.hash("secret")
+
+    # A broken pool seen late by another call is already replaced.
+    current = pool.executor
+    pool._discard(broken)
+    assert pool.executor is current
+
+    # Other errors of submit free their slot as well.
+    current.shutdown()
+    for _ in range(5):
+        with pytest.raises(RuntimeError):
+            pool.hash("secret")
+    pool.shutdown()
+
+
+def test_token_cache() -> None:
+    now = [1000.0]
+    cache = TokenCache(maxsize=2, max_ttl=60, clock=lambda: now[0])
+    header = {"alg": "HS256"}
+    claims = {"sub": "alice", "jti": "1", "iat": 990, "exp": 1030}
+    cache.put("token-1", header, claims)
+    assert cache.get("token-1") == (header, claims)
+    assert cache.get("token-2") is None
+
+    # Entries expire at exp, or after max_ttl without exp.
+    cache.put("token-2", header, {"sub": "bob", "jti": "2", "iat": 990})
+    now[0] = 1030
+    assert cache.get("token-1") is None
+    assert cache.get("token-2") is not None
+    now[0] = 1060
+    assert cache.get("token-2") is None
+    cache.put("token-1", header, claims)
+    assert cache.get("token-1") is None
+
+    # The least recently used entry is evicted.
+    for number in range(3):
+        cache.put(f"token-{number}", header, {"jti": str(number)})
+    assert cache.get("token-0") is None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["size"] == 2
+
+    # Revoked tokens are dropped from the cache.
+    cache.revoke({"jti": "1", "exp": 1100})
+    assert cache.is_revoked({"jti": "1"})
+    assert cache.get("token-1") is None
+    now[0] = 1200
+    cache.revoke({"jti": "2"})
+    assert not cache.is_revoked({"jti": "1"})
+    assert cache.is_revoked({"jti": "2"})
+
+    cache.revoke_identity("alice")
+    assert cache.is_revoked({"sub": "alice", "iat": 1200})
+    assert not cache.is_revoked({"sub": "alice", "iat": 1201})
+    assert not cache.is_revoked({"sub": "bob", "iat": 1000})
+
+    stats = cache.stats()
+    assert stats["hit_rate"] == stats["hits"] / (
+        stats["hits"] + stats["misses"]
+    )
+    assert TokenCache().stats()["hit_rate"] == 0.0
+    disabled = TokenCache(maxsize=0)
+    disabled.put("token", header, claims)
+    assert disabled.stats()["size"] == 0
+
+
+def test_idempotency_cache() -> None:
+    now = [1000.0]
+    cache = IdempotencyCache(maxsize=2, clock=lambda: now[0])
+    first, second, third = UUID(int=1), UUID(int=2), UUID(int=3)
+    response = ("digest", {"result": "success"}, 200)
+    cache.put(first, 1010, response)
+    assert cache.get(first) == response
+    assert cache.get(second) is None
+
+    # Entries expire with their response, expired ones aren't cached.
+    now[0] = 1010
+    assert cache.get(first) is None
+    cache.put(first, 1010, response)
+    assert cache.get(first) is None
+
+    # The least recently used entry is evicted.
+    for response_id in (first, second, third):
+        cache.put(response_id, 2000, response)
+    assert cache.get(first) is None
+    assert cache.stats() == {
+        "hits": 1,
+        "misses": 4,
+        "evictions": 1,
+        "expirations": 1,
+        "size": 2,
+    }
+
+    disabled = IdempotencyCache(maxsize=0)
+    disabled.put(first, 2000, response)
+    assert disabled.get(first) is None
+
+
+def test_histogram() -> None:
+    histogram = metrics.Histogram(
+        "latency_seconds", "Latency.", ("endpoint",), buckets=(0.1, 1)
+    )
+    histogram.observe(0.05, 'a"b')
+    histogram.observe(0.5, 'a"b')
+    histogram.observe(5, 'a"b')
+    assert histogram.count('a"b') == 3
+    assert histogram.count("c") == 0
+    assert histogram.render() == [
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{endpoint="a\\"b",le="0.1"} 1',
+        'latency_seconds_bucket{endpoint="a\\"b",le="1.0"} 2',
+        'latency_seconds_bucket{endpoint="a\\"b",le="+Inf"} 3',
+        'latency_seconds_sum{endpoint="a\\"b"} 5.55',
+        'latency_seconds_count{endpoint="a\\"b"} 3',
+    ]
+
+    with pytest.raises(ValueError):
+        histogram.observe(1)
+
+    registry = metrics.Registry()
+    registry.histogram("up_seconds", "Up.", (), buckets=(1,)).observe(2)
+    assert registry.render().endswith(
+        'up_seconds_bucket{le="+Inf"} 1\nup_seconds_sum{} 2.0\n'
+        "up_seconds_count{} 1\n"
+    )
+
+
+def test_request_timer() -> None:
+    # Outside a request nothing is timed.
+    with metrics.phase("load"):
+        pass
+    metrics.set_outcome("success")
+    metrics.finish_request(200)
+    assert metrics.current_request() is None
+
+    metrics.start_request("/test/timer")
+    with metrics.phase("jwt"):
+        pass
+    with metrics.phase("handler"):
+        with metrics.phase("load"):
+            pass
+        with metrics.phase("save"):
+            pass
+    timer = metrics.current_request()
+    assert timer is not None and set(timer.phases) == {
+        "jwt",
+        "handler",
+        "load",
+        "save",
+    }
+    metrics.finish_request(400)
+    assert metrics.current_request() is None
+
+    assert metrics.REQUEST_SECONDS.count("/test/timer", "http_400") == 1
+    for phase in ("jwt", "handler", "load", "save", "framework"):
+        assert metrics.PHASE_SECONDS.count("/test/timer", phase) == 1
+
+    metrics.start_request("/test/timer")
+    metrics.set_outcome("rejected")
+    metrics.finish_request(400)
+    assert metrics.REQUEST_SECONDS.count("/test/timer", "rejected") == 1
+    assert metrics.PHASE_SECONDS.count("/test/timer", "framework") == 2